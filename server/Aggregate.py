@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Round-robin aggregate files.
+#
+# An aggregate file (user.agg) holds the statistics for the same windows as the analyser:
+# by default the last 25 hours, the last 8 days and the last 13 months (see opt_Hours etc.).
+# Each window is a ring of slots.
+# A slot belongs to one hour, day or month (its key) and holds, for each sensor in Config.sensornames,
+# the time and value of the most recent reading, the min and max, and the sum and count of the
+# current values. The slot for a key is key % (number of slots); when a newer reading arrives for
+# an occupied slot, the old content is discarded.
+#
+# The aggregates are updated at ingest time (opt_Aggregates), so the analyser only has to read
+# a few kilobytes however many log files there are.
+#
+# Layout (all little-endian):
+#	Header:
+#		magic			4 bytes		b'PLA1'
+#		nsensors		uint16
+#		nhours			uint16
+#		ndays			uint16
+#		nmonths			uint16
+#		sensor table	nsensors x 8 bytes, sensor names padded with NUL
+#	Slots (hourly, then daily, then monthly):
+#		key				int64		hours or days since 1970-01-01, or year*12 + month-1; -1 if empty
+#		per sensor:		int64 time of the current value (seconds since 1970-01-01)
+#						int32 cur, min, max (NOVALUE if not present)
+#						int32 count
+#						int64 sum
+#
+# Usage:
+#	./Aggregate.py user ...			rebuilds the aggregate files from the text logs in the current directory
+
+import os
+import sys
+import struct
+import fcntl
+import calendar
+import time
+import io
+import contextlib
+import LogDir
+import Helpers
+from py.Config import Config
+
+NHOURS = getattr(Config, 'opt_Hours', 25)		# Current hour + previous hours
+NDAYS = getattr(Config, 'opt_Days', 8)			# Current day + previous days
+NMONTHS = getattr(Config, 'opt_Months', 13)		# Current month + previous months
+
+MAGIC = b'PLA1'
+NAMELEN = 8
+HEADER = struct.Struct('<4sHHHH')
+KEY = struct.Struct('<q')
+VALUES = struct.Struct('<qiiiiq')
+NOVALUE = -2147483648
+
+# Get the name of the aggregate file for a user
+#
+def AggregateFileName(user):
+	return LogDir.UserFileName(user, user + '.agg')
+
+# Keys for a date and time given as YYYYMMDD and hhmmss strings.
+# Returns (epoch, hour key, day key, month key)
+#
+def Keys(d, t):
+	y = int(d[0:4])
+	m = int(d[4:6])
+	epoch = calendar.timegm((y, m, int(d[6:8]), int(t[0:2]), int(t[2:4]), int(t[4:6])))
+	return (epoch, epoch // 3600, epoch // 86400, y * 12 + m - 1)
+
+# ===
+# The aggregates for one user, held in memory
+#
+class Aggregates():
+	def __init__(self, names=None):
+		if names == None:
+			names = list(Config.sensornames)
+		self.names = names
+		self.index = {}
+		for i in range(0, len(names)):
+			self.index[names[i]] = i
+		self.hourly = self.EmptyRing(NHOURS)
+		self.daily = self.EmptyRing(NDAYS)
+		self.monthly = self.EmptyRing(NMONTHS)
+		return
+
+	# Make a ring of empty slots. A slot is [key, [values for each sensor]]
+	#
+	def EmptyRing(self, n):
+		ring = []
+		for i in range(0, n):
+			ring.append(self.EmptySlot(-1))
+		return ring
+
+	def EmptySlot(self, key):
+		vals = []
+		for s in self.names:
+			vals.append([0, None, None, None, 0, 0])	# time, cur, min, max, count, sum
+		return [key, vals]
+
+	# Load the aggregates from a file.
+	# Returns False if the file doesn't exist or doesn't match the configuration
+	#
+	def Load(self, fname):
+		try:
+			f = open(fname, 'rb')
+		except OSError:
+			return False
+		data = f.read()
+		f.close()
+		return self.Decode(data)
+
+	def Decode(self, data):
+		if len(data) < HEADER.size:
+			return False
+		(magic, ns, nh, nd, nm) = HEADER.unpack_from(data, 0)
+		if magic != MAGIC or (nh, nd, nm) != (NHOURS, NDAYS, NMONTHS):
+			return False
+		pos = HEADER.size
+		names = []
+		for i in range(0, ns):
+			names.append(data[pos:pos+NAMELEN].rstrip(b'\0').decode())
+			pos += NAMELEN
+		if names != self.names:
+			return False
+		if len(data) != pos + (nh + nd + nm) * (KEY.size + ns * VALUES.size):
+			return False
+		for ring in [ self.hourly, self.daily, self.monthly ]:
+			for slot in ring:
+				slot[0] = KEY.unpack_from(data, pos)[0]
+				pos += KEY.size
+				for v in slot[1]:
+					v[:] = VALUES.unpack_from(data, pos)
+					pos += VALUES.size
+					for i in [1, 2, 3]:
+						if v[i] == NOVALUE:
+							v[i] = None
+		return True
+
+	# Encode the aggregates for saving
+	#
+	def Encode(self):
+		data = bytearray(HEADER.pack(MAGIC, len(self.names), NHOURS, NDAYS, NMONTHS))
+		for n in self.names:
+			data += n.encode()[0:NAMELEN].ljust(NAMELEN, b'\0')
+		for ring in [ self.hourly, self.daily, self.monthly ]:
+			for slot in ring:
+				data += KEY.pack(slot[0])
+				for v in slot[1]:
+					(t, cur, mn, mx, count, total) = v
+					if cur == None:
+						cur = NOVALUE
+					if mn == None:
+						mn = NOVALUE
+					if mx == None:
+						mx = NOVALUE
+					data += VALUES.pack(t, cur, mn, mx, count, total)
+		return bytes(data)
+
+	# Update the aggregates from the (checked) parameters of one record
+	#
+	def Update(self, params):
+		(epoch, hkey, dkey, mkey) = Keys(params['date'], params['time'])
+		slots = []
+		for (ring, key) in [ (self.hourly, hkey), (self.daily, dkey), (self.monthly, mkey) ]:
+			slot = self.FindSlot(ring, key)
+			if slot != None:
+				slots.append(slot)
+		if len(slots) == 0:
+			return
+
+		for key in params:
+			try:
+				idx = self.index[key]
+			except KeyError:
+				continue		# Not a sensor, or a sensor that isn't in the configuration
+			vals = params[key].split(',')
+			cur = StrToInt(vals[0])
+			mn = None
+			mx = None
+			if len(vals) > 1:
+				mn = StrToInt(vals[1])
+			if len(vals) > 2:
+				mx = StrToInt(vals[2])
+			for slot in slots:
+				UpdateValues(slot[1][idx], epoch, cur, mn, mx)
+		return
+
+	# Find the slot for a key. An older slot is emptied and reused.
+	# Returns None if the slot holds newer data, i.e. the key is outside the window
+	#
+	def FindSlot(self, ring, key):
+		i = key % len(ring)
+		slot = ring[i]
+		if slot[0] == key:
+			return slot
+		if slot[0] > key:
+			return None
+		slot = self.EmptySlot(key)
+		ring[i] = slot
+		return slot
+
+	# Get the values for a sensor in the hour, day or month given by key.
+	# Returns (time, cur, min, max, count, sum) or None if there's no data
+	#
+	def Get(self, ring, key, name):
+		slot = ring[key % len(ring)]
+		if slot[0] != key:
+			return None
+		try:
+			v = slot[1][self.index[name]]
+		except KeyError:
+			return None
+		if v[0] == 0:
+			return None		# No readings for this sensor
+		return v
+
+# Convert a string to an integer.
+# Return None if string is not valid
+#
+def StrToInt(valstr):
+	try:
+		v = int(valstr)
+	except:
+		v = None
+	return v
+
+# Update the values of one sensor in one slot with a new reading.
+# Follows the same rules as Sensor.Update in Analyse.py: without opt_UseMinMax, the current value
+# only counts for the min/max if the reading is newer than all the readings before it
+#
+def UpdateValues(v, epoch, cur, mn, mx):
+	newer = v[0] < epoch
+	if newer:
+		v[0] = epoch
+		v[1] = cur
+
+	if Config.opt_UseMinMax:
+		if mn != None:
+			if v[2] == None or v[2] > mn:
+				v[2] = mn
+		if mx != None:
+			if v[3] == None or v[3] < mx:
+				v[3] = mx
+	elif newer and cur != None:
+		if v[2] == None or v[2] > cur:
+			v[2] = cur
+		if v[3] == None or v[3] < cur:
+			v[3] = cur
+
+	if cur != None:
+		v[4] += 1
+		v[5] += cur
+	return
+
+# Update an aggregate file from a list of (checked) parameter sets.
+# The file is locked for the update. If it doesn't exist or doesn't match the
+# configuration, or if rebuild is True, it is rebuilt from the text logs instead.
+# The parameter sets have already been written to the text logs, so they are
+# included in the rebuilt file and mustn't be added again.
+#
+def UpdateFile(user, plist, rebuild=False):
+	fname = AggregateFileName(user)
+	try:
+		fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0o644)
+	except FileNotFoundError:
+		LogDir.MakeDir(fname)
+		fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0o644)
+	try:
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		size = os.fstat(fd).st_size
+		agg = Aggregates()
+		if rebuild or not agg.Decode(os.pread(fd, size, 0)):
+			agg = Build(user)
+		else:
+			for params in plist:
+				agg.Update(params)
+		data = agg.Encode()
+		os.pwrite(fd, data, 0)
+		if size > len(data):
+			os.ftruncate(fd, len(data))
+	finally:
+		os.close(fd)
+	return
+
+# Build the aggregates for a user from the text logs in the current directory.
+# Only the files that can fall into the windows are read. Lines that the analyser rejects
+# (a parameter without a value, or a failed SanityCheck()) are skipped
+#
+def Build(user):
+	agg = Aggregates()
+	now = int(time.time())
+	gmt = time.gmtime(now)
+	mkey = gmt.tm_year * 12 + gmt.tm_mon - 1 - (NMONTHS - 1)
+	first = '%04d%02d01' % (mkey // 12, mkey % 12 + 1)
+	for t in [ now - (NHOURS - 1) * 3600, now - (NDAYS - 1) * 86400 ]:
+		g = time.gmtime(t)
+		d = '%04d%02d%02d' % (g.tm_year, g.tm_mon, g.tm_mday)
+		if d < first:
+			first = d
+	last = '%04d%02d%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday)
+
+	for fname in LogDir.LogsInRange(user, first, last):
+		f = io.TextIOWrapper(LogDir.OpenLog(fname))
+		with contextlib.redirect_stdout(io.StringIO()):		# The errors aren't wanted here
+			for line in f:
+				params = {}
+				for pair in line.strip().split('&'):
+					k_v = pair.split('=', 1)
+					if len(k_v) != 2:
+						params = None
+						break
+					params[k_v[0]] = k_v[1]
+				if params != None and Helpers.SanityCheck(params, False):
+					agg.Update(params)
+		f.close()
+	return agg
+
+# Rebuild the aggregate file for a user from the text logs
+#
+def Rebuild(user):
+	UpdateFile(user, [], True)
+	return AggregateFileName(user)
+
+if __name__ == '__main__':
+	for user in sys.argv[1:]:
+		print(Rebuild(user))
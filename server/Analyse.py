@@ -24,19 +24,138 @@ import os
 import sys
 import traceback
 import time
+import io
+import contextlib
 from py.Config import Config
 from Helpers import *
+import DayFile
+import LogDir
+import NumpyEngine
+import Aggregate
+import SqlStore
+import datetime
+import calendar
+import concurrent.futures
+import html
+import json
+import Helpers
+
+EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+SKETCH_BINS = 256			# Maximum number of bins in a quantile sketch
+
+# Instrumentation (see Analyser.GetDiagnostics())
+PHASES = [ 'discovery', 'read', 'parse', 'aggregate', 'render' ]
+COUNTERS = [ 'files', 'bytes', 'lines', 'readings', 'rejected', 'unknown_sensors', 'extra_values', 'problems' ]
+MAX_PROBLEMS = 100			# Maximum number of problems kept in Analyser.diagnostics
+NOT_SENSORS = ( 'date', 'time', 'user', 'pass' )		# Fields of a log line that aren't sensor readings
+
+# ===
+# A quantile sketch of the current values of a sensor in a period.
+#
+# The values (integers, in tenths) are counted in bins of equal width. The width is a power of two,
+# 2**shift, and bin k holds the values v with v >> shift == k. When there are more than SKETCH_BINS bins,
+# the width is doubled and pairs of bins are combined, so the size of the sketch doesn't depend on the
+# number of values. Any set of values ends up with the smallest width that fits, so the sketch is the
+# same whatever the order in which values are added and partial sketches are merged.
+#
+class Sketch():
+	__slots__ = ( 'shift', 'bins' )
+
+	def __init__(self):
+		self.shift = 0
+		self.bins = {}			# Bin number --> number of values
+		return
+
+	# Add a value
+	#
+	def Add(self, v):
+		k = v >> self.shift
+		try:
+			self.bins[k] += 1
+		except KeyError:
+			self.bins[k] = 1
+			if len(self.bins) > SKETCH_BINS:
+				self.Coarsen(self.shift + 1)
+		return
+
+	# Widen the bins to 2**shift (at least), and further until there are no more than SKETCH_BINS bins
+	#
+	def Coarsen(self, shift):
+		while shift > self.shift or len(self.bins) > SKETCH_BINS:
+			shift = max(shift, self.shift + 1)
+			d = shift - self.shift
+			bins = {}
+			for (k, n) in self.bins.items():
+				bins[k >> d] = bins.get(k >> d, 0) + n
+			self.bins = bins
+			self.shift = shift
+		return
+
+	# Merge another sketch
+	#
+	def Merge(self, other):
+		if len(self.bins) == 0:
+			self.shift = other.shift
+			self.bins = dict(other.bins)
+			return
+		self.Coarsen(other.shift)
+		d = self.shift - other.shift
+		for (k, n) in other.bins.items():
+			self.bins[k >> d] = self.bins.get(k >> d, 0) + n
+		self.Coarsen(self.shift)
+		return
+
+	# Get the value below which a fraction q of the values lie (e.g. 0.5 for the median), or None if
+	# there are no values. The result is the middle of the bin, so it's exact while the width is 1
+	#
+	def Quantile(self, q):
+		n = sum(self.bins.values())
+		if n == 0:
+			return None
+		rank = max(int(q * n + 0.999999) - 1, 0)
+		seen = 0
+		for k in sorted(self.bins):
+			seen += self.bins[k]
+			if seen > rank:
+				break
+		return (k << self.shift) + ((1 << self.shift) - 1) / 2
+
+	# Get the state for saving in a checkpoint
+	#
+	def GetState(self):
+		return [ self.shift, list(self.bins.items()) ]
+
+	# Restore the state from a checkpoint
+	#
+	def SetState(self, state):
+		self.shift = state[0]
+		self.bins = dict([ (k, n) for (k, n) in state[1] ])
+		return
 
 # ===
 # Stores the current, min and max values for a given sensor
 #
+# The mean, variance and quantiles of the current values are kept too: the count and sum, the running mean
+# and the sum of the squared differences from it (m2), updated with Welford's method, and a Sketch.
+# m2 and the sketch are None if the statistics came from a source that doesn't have them (the aggregate files).
+#
+# There is a Sensor object for each sensor in each period of each window, so the attributes are slots rather
+# than a dictionary per object.
+#
 class Sensor():
+	__slots__ = ( 'name', 'curtime', 'curval', 'minval', 'maxval', 'count', 'total', 'mean', 'm2', 'sketch' )
+
 	def __init__(self, name):
 		self.name = name
 		self.curtime = None
 		self.curval = None
 		self.minval = None
 		self.maxval = None
+		self.count = 0			# Number of current values
+		self.total = 0			# Sum of current values
+		self.mean = 0.0			# Running mean of current values
+		self.m2 = 0.0			# Sum of squared differences from the mean of the current values
+		self.sketch = Sketch()	# Distribution of the current values
 		return
 
 	# Update the stored sensor values from another (temporary) Sensor object
@@ -63,6 +182,96 @@ class Sensor():
 					self.minval = self.curval
 				if self.maxval == None or self.maxval < self.curval:
 					self.maxval = self.curval
+
+		# Welford's method. (m2 and sketch are only None for statistics from the aggregate
+		# files, which aren't updated with readings)
+		x = new.curval
+		if x != None:
+			n = self.count + 1
+			self.count = n
+			self.total += x
+			delta = x - self.mean
+			mean = self.mean + delta / n
+			self.mean = mean
+			self.m2 += delta * (x - mean)
+			bins = self.sketch.bins
+			k = x >> self.sketch.shift
+			if k in bins:
+				bins[k] += 1		# Sketch.Add(), inline for speed
+			else:
+				self.sketch.Add(x)
+		return
+
+	# Merge the statistics from another Sensor object that holds the statistics for
+	# a different set of readings (e.g. from a different file)
+	#
+	def Merge(self, other):
+		if other.count > 0:
+			if other.m2 == None or self.m2 == None:
+				self.m2 = None
+			else:
+				# Chan et al.: combine the sums of squared differences from the two means
+				n = self.count + other.count
+				delta = other.mean - self.mean
+				self.m2 += other.m2 + delta * delta * self.count * other.count / n
+				self.mean += delta * other.count / n
+			if other.sketch == None:
+				self.sketch = None
+			elif self.sketch != None:
+				self.sketch.Merge(other.sketch)
+		if other.curtime != None:
+			if self.curtime == None or self.curtime < other.curtime:
+				self.curtime = other.curtime
+				self.curval = other.curval
+		if other.minval != None:
+			if self.minval == None or self.minval > other.minval:
+				self.minval = other.minval
+		if other.maxval != None:
+			if self.maxval == None or self.maxval < other.maxval:
+				self.maxval = other.maxval
+		self.count += other.count
+		self.total += other.total
+		return
+
+	# Get the mean of the current values, or None if there aren't any
+	#
+	def GetMean(self):
+		if self.count == 0:
+			return None
+		return self.total / self.count
+
+	# Get the variance of the current values, or None if it isn't known
+	#
+	def GetVariance(self):
+		if self.count < 2 or self.m2 == None:
+			return None
+		return self.m2 / (self.count - 1)
+
+	# Get a quantile of the current values (see Sketch.Quantile()), or None if it isn't known
+	#
+	def GetQuantile(self, q):
+		if self.sketch == None:
+			return None
+		return self.sketch.Quantile(q)
+
+	# Get the state for saving in a checkpoint
+	#
+	def GetState(self):
+		if self.sketch == None:
+			sketch = None
+		else:
+			sketch = self.sketch.GetState()
+		return [ self.curtime, self.curval, self.minval, self.maxval, self.count, self.total, self.mean, self.m2, sketch ]
+
+	# Restore the state from a checkpoint
+	#
+	def SetState(self, state):
+		(self.curtime, self.curval, self.minval, self.maxval, self.count, self.total, self.mean, self.m2, sketch) = state
+		if sketch == None:
+			self.sketch = None
+		else:
+			self.sketch = Sketch()
+			self.sketch.SetState(sketch)
 		return
 
 
@@ -70,6 +279,8 @@ class Sensor():
 # Stores the current, min and max values for all sensors for a given period
 #
 class Statistics():
+	__slots__ = ( 'period', 'timedate', 'sensors' )
+
 	def __init__(self, per, td):
 		self.period = per		# h (hourly)		d (daily)		m (monthly)
 		self.timedate = td		# YYYY-MM-DD HH		YYYY-MM-DD		YYYY-MM
@@ -81,64 +292,165 @@ class Statistics():
 		return
 
 	# Find and update a stored sensor from a temporary sensor object
+	# Sensors that aren't in the configuration are ignored
 	#
 	def Update(self, sensor):
+		s = self.sensors.get(sensor.name)
+		if s != None:
+			s.Update(sensor)
+		return
+
+	# Merge the statistics from another Statistics object for the same period.
+	# The result doesn't depend on the order in which partial statistics are merged
+	#
+	def Merge(self, other):
+		for s in other.sensors:
+			if s in self.sensors:
+				self.sensors[s].Merge(other.sensors[s])
+		return
+
+	# Get the state of all sensors that have data, for saving in a checkpoint
+	#
+	def GetState(self):
+		state = {}
 		for s in self.sensors:
-			if s == sensor.name:
-				self.sensors[s].Update(sensor)
-				return
+			if self.sensors[s].curtime != None:
+				state[s] = self.sensors[s].GetState()
+		return state
+
+	# Restore the state from a checkpoint
+	#
+	def SetState(self, state):
+		for s in state:
+			if s in self.sensors:
+				self.sensors[s].SetState(state[s])
+		return
 
-	# Print a line of headers
+	# Get the cells of a line of headers: the name of the period column and the names of the sensors
 	#
-	def PrintHeaders(self):
+	def HeaderCells(self):
 		if self.period == 'h':
-			line = '%16s' % ('Date/time')
+			cells = [ 'Date/time' ]
 		elif self.period == 'd':
-			line = '%16s' % ('Date')
+			cells = [ 'Date' ]
 		elif self.period == 'm':
-			line = '%16s' % ('Month')
+			cells = [ 'Month' ]
 		else:
-			line = '%16s' % ('???')
-			
+			cells = [ '???' ]
+		for s in self.sensors:
+			cells.append(Config.sensornames[self.sensors[s].name])
+		return cells
+
+	# Get the cells of a line of current values
+	#
+	def CurrentCells(self):
+		cells = [ self.timedate ]
+		for s in self.sensors:
+			cells.append(Tenths(self.sensors[s].curval))
+		return cells
+
+	# Get the cells of a line of min/max values
+	#
+	def MinMaxCells(self):
+		cells = [ self.timedate ]
 		for s in self.sensors:
 			sensor = self.sensors[s]
-			line += '  %-15s' % (Config.sensornames[sensor.name])
-		print(line)
-		return
+			cells.append('%s .. %s' % (Tenths(sensor.minval), Tenths(sensor.maxval)))
+		return cells
 
-	# Print a line of current values
+	# Get the cells of a line of mean, median and 95th percentile values
 	#
-	def PrintCurrent(self):
-		line = '%16s' % ( self.timedate )
+	def SpreadCells(self):
+		cells = [ self.timedate ]
 		for s in self.sensors:
 			sensor = self.sensors[s]
-			if sensor.curval == None:
-				curval = '---'
-			else:
-				curval = '%d.%d' % (sensor.curval//10, sensor.curval%10)
-			line += '  %-15s' % (curval)
-		print(line)
-		return
+			vals = []
+			for v in [ sensor.GetMean(), sensor.GetQuantile(0.5), sensor.GetQuantile(0.95) ]:
+				if v == None:
+					vals.append('---')
+				else:
+					vals.append('%.1f' % (v / 10))
+			cells.append('/'.join(vals))
+		return cells
 
-	# Print a line of min/max values
+	# Get the values for a JSON report: { sensor: { 'cur': ..., 'min': ..., ... } } in the sensors' units.
+	# Sensors without readings are left out
 	#
-	def PrintMinMax(self):
-		line = '%16s' % ( self.timedate )
+	def JsonValues(self):
+		values = {}
 		for s in self.sensors:
 			sensor = self.sensors[s]
-			if sensor.minval == None:
-				minval = '---'
-			else:
-				minval = '%d.%d' % (sensor.minval//10, sensor.minval%10)
-			if sensor.maxval == None:
-				maxval = '---'
-			else:
-				maxval = '%d.%d' % (sensor.maxval//10, sensor.maxval%10)
-			tmp = '%s .. %s' % (minval, maxval)
-			line += '  %-15s' % (tmp)
-		print(line)
+			if sensor.curtime == None:
+				continue
+			v = { 'time': sensor.curtime, 'count': sensor.count }
+			for (key, x) in [ ('cur', sensor.curval), ('min', sensor.minval), ('max', sensor.maxval),
+								('mean', sensor.GetMean()), ('median', sensor.GetQuantile(0.5)),
+								('p95', sensor.GetQuantile(0.95)) ]:
+				v[key] = None if x == None else round(x / 10, 2)
+			values[s] = v
+		return values
+
+# Format a value in tenths (e.g. -56 --> '-5.6'). None is shown as '---'
+#
+def Tenths(v):
+	if v == None:
+		return '---'
+	if v < 0:
+		return '-%d.%d' % (-v // 10, -v % 10)
+	return '%d.%d' % (v // 10, v % 10)
+
+# ===
+# Formats the rows of a report: the period and a column for each sensor.
+# The format string is made once for the number of columns, so a row is formatted with a single % operation.
+# If escape is given (e.g. html.escape), it is applied to each cell
+#
+class RowFormat():
+	def __init__(self, first, column, end, ncols, escape=None):
+		self.fmt = first + column * ncols + end
+		self.escape = escape
 		return
 
+	def Format(self, cells):
+		if self.escape != None:
+			cells = [ self.escape(c) for c in cells ]
+		return self.fmt % tuple(cells)
+
+# Row formats for the plain text and HTML reports
+#
+def TextRow(ncols):
+	return RowFormat('%16s', '  %-15s', '\n', ncols)
+
+def HtmlRow(ncols, tag='td'):
+	return RowFormat('<tr><th>%s</th>', '<' + tag + '>%s</' + tag + '>', '</tr>\n', ncols, html.escape)
+
+
+# Generator that reads an open log file in large chunks.
+# Yields (lines, nbytes) for each chunk, where lines is a list of the complete lines (without
+# the newlines) and nbytes is the number of bytes they occupy in the file. An incomplete line
+# at the end of the file is not returned.
+#
+def LogChunks(f, chunksize=1024*1024):
+	rest = b''
+	while True:
+		data = f.read(chunksize)
+		if len(data) == 0:
+			return
+		data = rest + data
+		end = data.rfind(b'\n') + 1
+		rest = data[end:]
+		if end > 0:
+			yield (data[0:end-1].decode(errors='replace').split('\n'), end)
+
+# Worker for Analyser.ReadLogsParallel(): analyse a group of log files for a user, with the
+# windows for the given time. Anything printed (e.g. errors in the logs) is returned to be printed
+# by the caller. Returns (output, partial statistics, diagnostics)
+#
+def ReadPart(user, now, flist):
+	a = Analyser(user, now)
+	buf = io.StringIO()
+	with contextlib.redirect_stdout(buf):
+		a.ReadFiles(flist)
+	return (buf.getvalue(), a.GetStates(), a.GetDiagnostics())
 
 # ===
 # Stores the sensor values for all periods.
@@ -146,119 +458,687 @@ class Statistics():
 #
 class Analyser():
 
-	def __init__(self):
-		self.diagnostics = []
-		self.hourly = []		# Hourly statistics for now + past 24 hours
-		self.daily = []			# Daily statistics for today + past 7 days
-		self.monthly = []		# Monthly statistics for this month + last 12 months
-		self.now = time.time()
-
-		# Populate the stats arrays
-		t = self.now
-		for i in range(0,25):		# Current hour + previous 24 hours
-			gmt = time.gmtime(t)
+	def __init__(self, user=None, now=None):
+		if user == None:
+			user = GetOption('opt_ReportUser', 'dh')
+		if now == None:
+			now = time.time()
+		self.user = user
+		self.diagnostics = []	# Problems found in the logs (see Problem())
+		self.counters = dict.fromkeys(COUNTERS, 0)
+		self.timers = dict.fromkeys(PHASES, 0.0)
+		self.curfile = None		# The file being read, for the diagnostics
+		self.temp = Sensor(None)	# For passing the values of a reading to the statistics
+		self.hours = {}				# YYYYMMDDhh --> (hourly, daily, monthly, 'YYYY-MM-DD hh:'), for AnalyseLine()
+		self.hourly = []		# Hourly statistics for now + past opt_Hours-1 hours
+		self.daily = []			# Daily statistics for today + past opt_Days-1 days
+		self.monthly = []		# Monthly statistics for this month + past opt_Months-1 months
+		self.datekeys = {}		# Cache: YYYYMMDD --> (day number, month number)
+		self.now = now
+		self.MakeWindows()
+		return
+
+	# Populate the stats arrays with empty statistics
+	#
+	# Each period has a number: hours or days since 1970-01-01 (UTC), or year*12 + month-1.
+	# Element i of a stats array is for the period whose number is (number of the current period) - i,
+	# so the statistics for a reading can be found by arithmetic instead of by searching.
+	#
+	def MakeWindows(self):
+		self.hourly = []
+		self.daily = []
+		self.monthly = []
+
+		now = int(self.now)
+		self.hour0 = now // 3600
+		self.day0 = now // 86400
+		gmt = time.gmtime(now)
+		self.month0 = gmt.tm_year * 12 + gmt.tm_mon - 1
+
+		for i in range(0, GetOption('opt_Hours', 25)):		# Current hour + previous hours
+			gmt = time.gmtime((self.hour0 - i) * 3600)
 			tstr = '%04d-%02d-%02d %02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday, gmt.tm_hour)
-			s = Statistics('h', tstr)
-			self.hourly.append(s)
-			t -= 60*60
+			self.hourly.append(Statistics('h', tstr))
 
-		t = self.now
-		for i in range(0,8):		# Current day + previous 7 days
-			gmt = time.gmtime(t)
+		for i in range(0, GetOption('opt_Days', 8)):		# Current day + previous days
+			gmt = time.gmtime((self.day0 - i) * 86400)
 			tstr = '%04d-%02d-%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday)
-			s = Statistics('d', tstr)
-			self.daily.append(s)
-			t -= 60*60*24
+			self.daily.append(Statistics('d', tstr))
 
-		gmt = time.gmtime(self.now)
-		tm_mon = gmt.tm_mon
-		tm_year = gmt.tm_year
-		for i in range(0,13):		# Current month + previous 12 months
-			tstr = '%04d-%02d' % (tm_year, tm_mon)
-			s = Statistics('m', tstr)
-			self.monthly.append(s)
-			tm_mon -= 1
-			if tm_mon < 1:
-				tm_year -= 1
-				tm_mon = 12
-	
+		for i in range(0, GetOption('opt_Months', 13)):		# Current month + previous months
+			m = self.month0 - i
+			tstr = '%04d-%02d' % (m // 12, m % 12 + 1)
+			self.monthly.append(Statistics('m', tstr))
 		return
 
-	# Read all the log files
+	# Find the statistics for a date (YYYYMMDD) and hour (hh).
+	# Returns (hourly, daily, monthly); each is None if the time is outside that window
 	#
-	# To do: ignore files that are older than 13 months, for efficiency
+	def FindBuckets(self, d, hh):
+		try:
+			(dkey, mkey) = self.datekeys[d]
+		except KeyError:
+			y = int(d[0:4])
+			m = int(d[4:6])
+			dkey = datetime.date(y, m, int(d[6:8])).toordinal() - EPOCH_DAY
+			mkey = y * 12 + m - 1
+			self.datekeys[d] = (dkey, mkey)
+
+		hourly = None
+		daily = None
+		monthly = None
+		i = self.hour0 - (dkey * 24 + int(hh))
+		if i >= 0 and i < len(self.hourly):
+			hourly = self.hourly[i]
+		i = self.day0 - dkey
+		if i >= 0 and i < len(self.daily):
+			daily = self.daily[i]
+		i = self.month0 - mkey
+		if i >= 0 and i < len(self.monthly):
+			monthly = self.monthly[i]
+		return (hourly, daily, monthly)
+
+	# Is any part of a date (YYYYMMDD) inside one of the windows?
+	# The hourly and daily windows can reach further back than the monthly window, and the hourly
+	# window can start part way through the day
+	#
+	def DateInWindows(self, d):
+		(hourly, daily, monthly) = self.FindBuckets(d, 0)
+		if monthly != None or daily != None:
+			return True
+		i = self.hour0 - self.datekeys[d][0] * 24		# Index of the first hour of the day
+		return i >= 0 and i - 23 < len(self.hourly)
+
+	# Read all the log files for the user that can contain data for the windows
+	# If opt_Aggregates is set and the aggregate file is valid, read that instead.
+	# If opt_Database is set, the statistics are computed by the database.
 	#
 	def ReadLogs(self):
-		# Find list of files matching pattern dh-YYYYMMDD.log
-		flist = []
-		dir_obj = os.scandir()
-		for dir_ent in dir_obj:
-			if dir_ent.is_file():
-				fname = dir_ent.name
-				if len(fname) == len('dh-YYYYMMDD.log') and fname[0:3] == 'dh-' and fname[-4:] == '.log':
-					flist.append(fname)
-		dir_obj.close()
-
-		# Read all the logs
+		t = time.perf_counter()
+		if GetOption('opt_Aggregates', False) and self.ReadAggregates(self.user):
+			self.Lap('read', t)
+			return
+
+		if GetOption('opt_Database', None) != None:
+			self.ReadDatabase()
+			self.Lap('aggregate', t)
+			return
+
+		flist = self.FindLogs()
+		self.Lap('discovery', t)
+
+		if GetOption('opt_Checkpoint', False):
+			self.ReadLogsIncremental(flist)
+			return
+
+		workers = GetOption('opt_Workers', 1)
+		if workers > 1 and len(flist) > 1:
+			self.ReadLogsParallel(flist, workers)
+		else:
+			self.ReadFiles(flist)
+		return
+
+	# Read a list of log files
+	#
+	def ReadFiles(self, flist):
+		if GetOption('opt_Engine', 'python') == 'numpy' and NumpyEngine.Available():
+			self.ReadLogsNumpy(flist)
+			return
+
 		for fname in flist:
-			self.ReadLog(fname)
+			self.ReadFile(fname)
+		return
 
+	# Read the log files using a pool of worker processes.
+	# The files are divided into contiguous groups. Each worker analyses a group with its own Analyser
+	# and returns the partial statistics (see ReadPart()), which are merged in the order of the groups.
+	#
+	def ReadLogsParallel(self, flist, workers):
+		ngroups = min(len(flist), workers * 4)
+		groups = []
+		for g in range(0, ngroups):
+			groups.append(flist[g * len(flist) // ngroups : (g + 1) * len(flist) // ngroups])
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+			parts = pool.map(ReadPart, [ self.user ] * ngroups, [ self.now ] * ngroups, groups)
+			for (output, states, diag) in parts:
+				print(output, end='')
+				t = time.perf_counter()
+				self.MergeStates(states)
+				self.Lap('aggregate', t)
+				self.MergeDiagnostics(diag)
 		return
 
-	# Read a single log file and analyse the content
+	# Add the time since t to a phase. Returns the current time, for timing the next phase
 	#
-	def ReadLog(self, fname):
-		log_file = open(fname, 'r')
-		log = log_file.readlines()
-		log_file.close()
+	def Lap(self, phase, t):
+		now = time.perf_counter()
+		self.timers[phase] += now - t
+		return now
+
+	# Record a problem found in a log. Only the first MAX_PROBLEMS are kept
+	#
+	def Problem(self, message, line=None):
+		self.counters['problems'] += 1
+		if len(self.diagnostics) < MAX_PROBLEMS:
+			self.diagnostics.append({ 'file': self.curfile, 'message': message, 'line': line })
+		return
+
+	# Get the instrumentation: the time spent in each phase (seconds), the counters and the problems
+	# found. With worker processes, the times are the sums of the times in the workers.
+	#
+	def GetDiagnostics(self):
+		return { 'user': self.user, 'timers': self.timers, 'counters': self.counters, 'problems': self.diagnostics }
+
+	# Merge the diagnostics from another Analyser (e.g. a worker)
+	#
+	def MergeDiagnostics(self, diag):
+		for phase in diag['timers']:
+			self.timers[phase] += diag['timers'][phase]
+		for c in diag['counters']:
+			self.counters[c] += diag['counters'][c]
+		self.diagnostics += diag['problems'][0:max(MAX_PROBLEMS - len(self.diagnostics), 0)]
+		return
 
-		for line in log:
-			self.AnalyseLine(line.strip())
+	# Get the state of all the statistics that have data, keyed by period and date/time
+	#
+	def GetStates(self):
+		states = {}
+		for stats_list in [ self.hourly, self.daily, self.monthly ]:
+			for st in stats_list:
+				state = st.GetState()
+				if len(state) > 0:
+					states[st.period + st.timedate] = state
+		return states
+
+	# Merge partial statistics (from GetStates()) into the statistics
+	#
+	def MergeStates(self, states):
+		for stats_list in [ self.hourly, self.daily, self.monthly ]:
+			for st in stats_list:
+				try:
+					state = states[st.period + st.timedate]
+				except KeyError:
+					continue
+				part = Statistics(st.period, st.timedate)
+				part.SetState(state)
+				st.Merge(part)
+		return
+
+	# Find the list of files matching the pattern user-YYYYMMDD.log, for the dates from the
+	# beginning of the oldest window up to today.
+	#
+	def FindLogs(self):
+		(first, last) = self.WindowDates()
+		return LogDir.LogsInRange(self.user, first, last)
+
+	# Get the first and last dates (YYYYMMDD) covered by the windows
+	#
+	def WindowDates(self):
+		first = self.monthly[-1].timedate.replace('-', '') + '01'
+		for stats in [ self.hourly[-1], self.daily[-1] ]:
+			d = stats.timedate[0:10].replace('-', '')
+			if d < first:
+				first = d
+		gmt = time.gmtime(self.day0 * 86400)
+		last = '%04d%02d%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday)
+		return (first, last)
+
+	# Read a log file starting at the given offset.
+	# If there's an up-to-date binary day file, read that instead of the text log. kind is 'log' or 'pld'
+	# to force the choice (for continuing from a checkpoint), or None to choose.
+	# Returns (kind, offset) where offset is the position after the last record that was read.
+	#
+	def ReadFile(self, fname, kind=None, offset=0):
+		self.curfile = fname
+		self.counters['files'] += 1
+		dfname = DayFile.DayFileName(fname)
+		if kind == None:
+			try:
+				if os.stat(dfname).st_mtime >= os.stat(fname).st_mtime:
+					kind = 'pld'
+			except OSError:
+				pass
+		if kind == 'pld':
+			end = self.ReadDayFile(dfname, fname[-12:-4], offset)
+			if end != None:
+				return ('pld', end)
+			offset = 0
+		return ('log', self.ReadLog(fname, offset))
+
+	# Read the log files, continuing from the checkpoint (cache/user.ckpt) saved by the previous run.
+	#
+	# The log files are only ever appended to, so the checkpoint records how far each file has been
+	# read (the offset) together with the statistics for all the periods. Statistics for periods that
+	# are no longer in the windows are dropped. If a file has been truncated or rewritten, or has
+	# disappeared, all the files are read again from the beginning.
+	#
+	# Readings that arrive for a period that was not yet in a window at the time of the previous
+	# run (i.e. timestamps in the future) are not counted.
+	#
+	def ReadLogsIncremental(self, flist):
+		ckname = self.user + '.ckpt'
+		ck = self.LoadCheckpoint(ckname)
+		files = ck['files']
+		(first, last) = self.WindowDates()
+
+		# Decide whether the checkpoint can be used
+		rescan = False
+		for fname in files:
+			if fname not in flist and fname[-12:-4] >= first:
+				rescan = True
+		todo = []
+		for fname in flist:
+			try:
+				(kind, offset, tail) = files[fname]
+			except KeyError:
+				(kind, offset, tail) = (None, 0, '')
+			if not self.CheckTail(fname, kind, offset, tail):
+				rescan = True
+			todo.append((fname, kind, offset))
+
+		if rescan:
+			todo = [ (fname, None, 0) for fname in flist ]
+		else:
+			self.RestoreStats(ck['stats'])
+
+		# Read the new data and save the new checkpoint
+		files = {}
+		for (fname, kind, offset) in todo:
+			(kind, offset) = self.ReadFile(fname, kind, offset)
+			files[fname] = [ kind, offset, self.GetTail(fname, kind, offset) ]
+		self.SaveCheckpoint(ckname, files)
+		return
+
+	# Load a checkpoint. Returns an empty checkpoint if there isn't one or if it was
+	# made with a different configuration
+	#
+	def LoadCheckpoint(self, ckname):
+		empty = { 'files': {}, 'stats': {} }
+		ck = LogDir.LoadCache(ckname)
+		if type(ck) != dict or ck.get('config') != self.CheckpointConfig():
+			return empty
+		return ck
+
+	# Save a checkpoint
+	#
+	def SaveCheckpoint(self, ckname, files):
+		ck = { 'config': self.CheckpointConfig(), 'files': files, 'stats': self.GetStates() }
+		LogDir.SaveCache(ckname, ck)
+		return
+
+	# The parts of the configuration that affect the saved statistics. The lengths of the windows are included
+	# because the saved offsets skip readings that were outside the windows when the checkpoint was made
+	#
+	def CheckpointConfig(self):
+		return [ 3, Config.opt_UseMinMax, list(Config.sensornames), len(self.hourly), len(self.daily), len(self.monthly) ]
+
+	# Restore the saved statistics for the periods that are still in the windows
+	#
+	def RestoreStats(self, saved):
+		for stats_list in [ self.hourly, self.daily, self.monthly ]:
+			for st in stats_list:
+				try:
+					st.SetState(saved[st.period + st.timedate])
+				except KeyError:
+					pass
+		return
+
+	# The last few bytes before the offset, to detect files that have been rewritten
+	#
+	def GetTail(self, fname, kind, offset):
+		if kind == 'pld':
+			fname = DayFile.DayFileName(fname)
+		start = max(0, offset - 32)
+		try:
+			if kind == 'pld':
+				f = open(fname, 'rb')
+			else:
+				f = LogDir.OpenLog(fname)
+			f.seek(start)
+			tail = f.read(offset - start)
+			f.close()
+		except OSError:
+			return ''
+		return tail.hex()
+
+	# Check that a file still has the content that was read last time.
+	# A new file (offset 0) is always OK
+	#
+	def CheckTail(self, fname, kind, offset, tail):
+		if offset == 0:
+			return True
+		if kind == 'pld':
+			dfname = DayFile.DayFileName(fname)
+			try:
+				if os.stat(dfname).st_mtime < os.stat(fname).st_mtime:
+					return False			# The day file is out of date; read the text log instead
+			except OSError:
+				return False
+			if not DayFile.Usable(dfname):
+				return False				# The day file has been marked incomplete
+		return self.GetTail(fname, kind, offset) == tail
+
+	# Fill the statistics from a user's aggregate file (see Aggregate.py)
+	# Returns False if there's no valid aggregate file
+	#
+	def ReadAggregates(self, user):
+		agg = Aggregate.Aggregates()
+		if not agg.Load(Aggregate.AggregateFileName(user)):
+			return False
+		self.counters['files'] += 1
+
+		for i in range(0, len(self.hourly)):
+			self.FillFromAggregates(self.hourly[i], agg, agg.hourly, self.hour0 - i)
+		for i in range(0, len(self.daily)):
+			self.FillFromAggregates(self.daily[i], agg, agg.daily, self.day0 - i)
+		for i in range(0, len(self.monthly)):
+			self.FillFromAggregates(self.monthly[i], agg, agg.monthly, self.month0 - i)
+		return True
+
+	def FillFromAggregates(self, stats, agg, ring, key):
+		for name in stats.sensors:
+			v = agg.Get(ring, key, name)
+			if v == None:
+				continue
+			sensor = stats.sensors[name]
+			gmt = time.gmtime(v[0])
+			sensor.curtime = '%04d-%02d-%02d %02d:%02d:%02d' % gmt[0:6]
+			(sensor.curval, sensor.minval, sensor.maxval, sensor.count, sensor.total) = v[1:6]
+			sensor.m2 = None		# Not kept in the aggregate files
+			sensor.sketch = None
 		return
 
+	# Read the log files with the NumPy engine (see NumpyEngine.py).
+	# Each file (or its day file) is loaded into arrays and the statistics for all the windows
+	# are computed in one go. Files with an invalid date in the name are read the usual way.
+	#
+	def ReadLogsNumpy(self, flist):
+		index = {}
+		names = list(Config.sensornames)
+		for i in range(0, len(names)):
+			index[names[i]] = i
+
+		days = []
+		for fname in flist:
+			d = fname[-12:-4]
+			t = time.perf_counter()
+			if CheckDate(d) != None:
+				self.ReadFile(fname)
+				continue
+			if not self.DateInWindows(d):
+				continue			# Nothing in this file is inside the windows
+			self.curfile = fname
+			self.counters['files'] += 1
+			arrays = None
+			dfname = DayFile.DayFileName(fname)
+			try:
+				if os.stat(dfname).st_mtime >= os.stat(fname).st_mtime:
+					arrays = NumpyEngine.LoadDayFile(dfname, index)
+					t = self.Lap('read', t)
+			except OSError:
+				pass
+			if arrays == None:
+				arrays = NumpyEngine.LoadLog(fname, d, index, self.AnalyseLine, self.counters)
+				t = self.Lap('parse', t)
+			self.counters['readings'] += len(arrays[0])
+			(dkey, mkey) = self.datekeys[d]
+			days.append((dkey, mkey, arrays))
+
+		t = time.perf_counter()
+		windows = [ (self.hour0, len(self.hourly)), (self.day0, len(self.daily)), (self.month0, len(self.monthly)) ]
+		results = NumpyEngine.Summarise(days, windows, len(names), Config.opt_UseMinMax)
+		for (stats_list, result) in zip([ self.hourly, self.daily, self.monthly ], results):
+			for (i, idx, epoch, cur, mn, mx, count, total, m2, hist) in result:
+				s = Sensor(names[idx])
+				gmt = time.gmtime(epoch)
+				s.curtime = '%04d-%02d-%02d %02d:%02d:%02d' % gmt[0:6]
+				(s.curval, s.minval, s.maxval, s.count, s.total, s.m2) = (cur, mn, mx, count, total, m2)
+				if count > 0:
+					s.mean = total / count
+				s.sketch.bins = hist
+				s.sketch.Coarsen(0)
+				stats_list[i].sensors[s.name].Merge(s)
+		self.Lap('aggregate', t)
+		return
+
+	# Fill the statistics using range queries on the database (see SqlStore.py).
+	# The database computes the statistics for each hour in the hourly window and for each day from the
+	# start of the oldest window. The monthly statistics are merged from the daily statistics.
+	#
+	def ReadDatabase(self):
+		m = self.month0 - (len(self.monthly) - 1)
+		first = min(calendar.timegm((m // 12, m % 12 + 1, 1, 0, 0, 0)), (self.day0 - len(self.daily) + 1) * 86400)
+		hfirst = (self.hour0 - len(self.hourly) + 1) * 3600
+		end = (self.day0 + 1) * 86400
+		for name in Config.sensornames:
+			hists = SqlStore.RangeHistograms(self.user, name, 3600, hfirst, end)
+			for row in SqlStore.RangeStats(self.user, name, 3600, hfirst, end, Config.opt_UseMinMax):
+				i = self.hour0 - row[0]
+				if i >= 0 and i < len(self.hourly):
+					self.MergeRow(self.hourly[i], name, row, hists.get(row[0], {}))
+			hists = SqlStore.RangeHistograms(self.user, name, 86400, first, end)
+			for row in SqlStore.RangeStats(self.user, name, 86400, first, end, Config.opt_UseMinMax):
+				hist = hists.get(row[0], {})
+				i = self.day0 - row[0]
+				if i >= 0 and i < len(self.daily):
+					self.MergeRow(self.daily[i], name, row, hist)
+				gmt = time.gmtime(row[0] * 86400)
+				i = self.month0 - (gmt.tm_year * 12 + gmt.tm_mon - 1)
+				if i >= 0 and i < len(self.monthly):
+					self.MergeRow(self.monthly[i], name, row, hist)
+		return
+
+	# Merge a row from SqlStore.RangeStats() and the counts of each value from SqlStore.RangeHistograms()
+	# into the statistics for a sensor
+	#
+	def MergeRow(self, stats, name, row, hist):
+		(period, t, mn, mx, count, total, squares) = row
+		s = Sensor(name)
+		s.curtime = '%04d-%02d-%02d %02d:%02d:%02d' % time.gmtime(t)[0:6]
+		s.curval = SqlStore.ValueAt(self.user, name, t)
+		(s.minval, s.maxval, s.count, s.total) = (mn, mx, count, total)
+		if count > 0:
+			s.mean = total / count
+			s.m2 = (count * squares - total * total) / count
+		s.sketch.bins = dict(hist)
+		s.sketch.Coarsen(0)
+		stats.sensors[name].Merge(s)
+		return
+
+	# Read a binary day file and analyse the content, starting at the given offset
+	# Returns the offset after the last record, or None if the file isn't a valid day file
+	#
+	def ReadDayFile(self, fname, d, offset=0):
+		t = time.perf_counter()
+		content = DayFile.ReadDayFile(fname, offset)
+		t = self.Lap('read', t)
+		if content == None:
+			return None
+		(names, records, end) = content
+		self.counters['bytes'] += end - offset
+		self.counters['readings'] += (end - max(offset, DayFile.HEADER_SIZE)) // DayFile.RECORD.size
+
+		td = d[0:4] + '-' + d[4:6] + '-' + d[6:8]
+		(hourly, daily, monthly) = self.FindBuckets(d, 0)
+		inside = self.DateInWindows(d)
+		hours = {}
+		s = self.temp
+		for (secs, idx, cur, mn, mx) in records:
+			if not inside:
+				continue
+			hh = secs // 3600
+			try:
+				hourly = hours[hh]
+			except KeyError:
+				hourly = self.FindBuckets(d, hh)[0]
+				hours[hh] = hourly
+			s.name = names[idx]
+			s.curtime = '%s %02d:%02d:%02d' % (td, hh, (secs // 60) % 60, secs % 60)
+			s.curval = cur
+			s.minval = mn
+			s.maxval = mx
+			if hourly != None:
+				hourly.Update(s)
+			if daily != None:
+				daily.Update(s)
+			if monthly != None:
+				monthly.Update(s)
+		self.Lap('aggregate', t)
+		return end
+
+	# Read a single log file and analyse the content, starting at the given offset.
+	# Only complete lines are analysed, so a line that is still being written gets read next time.
+	# Returns the offset after the last complete line
+	#
+	# All the lines in a file have the date from the file name, so the date is checked once and the
+	# statistics for the month and day are found once. Lines that don't start with the expected date and
+	# a plausible time are passed to AnalyseLine(), which reports the error.
+	#
+	# Each chunk of lines is parsed into a list of readings first and then added to the statistics,
+	# so that the time spent in each can be measured (see GetDiagnostics()).
+	#
+	def ReadLog(self, fname, offset=0):
+		d = fname[-12:-4]
+		t = time.perf_counter()
+		log_file = LogDir.OpenLog(fname)
+		log_file.seek(offset)
+		counters = self.counters
+
+		if CheckDate(d) != None:
+			for (lines, nbytes) in LogChunks(log_file):
+				t = self.Lap('read', t)
+				counters['bytes'] += nbytes
+				counters['lines'] += len(lines)
+				for line in lines:
+					self.AnalyseLine(line.strip())
+				offset += nbytes
+				t = self.Lap('parse', t)
+			log_file.close()
+			return offset
+
+		td = d[0:4] + '-' + d[4:6] + '-' + d[6:8]
+		(hourly, daily, monthly) = self.FindBuckets(d, 0)
+		inside = self.DateInWindows(d)
+		hours = {}
+		known = Config.sensornames
+		prefix = 'date=' + d + '&time='
+		p = len(prefix)
+		s = self.temp
+
+		for (lines, nbytes) in LogChunks(log_file):
+			t = self.Lap('read', t)
+			offset += nbytes
+			counters['bytes'] += nbytes
+			counters['lines'] += len(lines)
+			if not inside:
+				continue			# Nothing in this file is inside the windows
+
+			# Parse: (hourly statistics, time, sensor, cur, min, max), or (None, None, problem, None, None, line)
+			# for a bad line (problem None) or a problem in a line, so that the messages keep their order.
+			# A line that AnalyseLine() would treat differently (a field without a value, or another date,
+			# time, user or pass) is passed to it as a bad line
+			readings = []
+			unknown = 0
+			nreadings = 0
+			for line in lines:
+				tt = line[p:p+6]
+				if not line.startswith(prefix) or line[p+6:p+7] != '&' or not tt.isdigit() \
+						or tt[0:2] > '23' or tt[2] > '5' or tt[4] > '5':
+					readings.append((None, None, None, None, None, line.strip()))
+					continue
+				hh = tt[0:2]
+				try:
+					hourly = hours[hh]
+				except KeyError:
+					hourly = self.FindBuckets(d, hh)[0]
+					hours[hh] = hourly
+				if hourly == None and daily == None and monthly == None:
+					continue
+				curtime = td + ' ' + hh + ':' + tt[2:4] + ':' + tt[4:6]
+
+				mark = (len(readings), nreadings, unknown)
+				for pair in line[p+7:].rstrip().split('&'):
+					(key, eq, value) = pair.partition('=')
+					if eq == '':
+						break
+					if key in known:
+						(cur, mn, mx, more) = SplitValues(value)
+						if more:
+							readings.append((None, None, 'More than three values', None, None, line.strip()))
+						readings.append((hourly, curtime, key, cur, mn, mx))
+						nreadings += 1
+					elif key != 'from':
+						if key in NOT_SENSORS:
+							break
+						if value.count(',') > 2:
+							readings.append((None, None, 'More than three values', None, None, line.strip()))
+						unknown += 1
+						nreadings += 1
+				else:
+					continue
+				del readings[mark[0]:]			# Let AnalyseLine() report the line
+				(nreadings, unknown) = mark[1:]
+				readings.append((None, None, None, None, None, line.strip()))
+			counters['unknown_sensors'] += unknown
+			t = self.Lap('parse', t)
+
+			# Aggregate
+			for (hourly, s.curtime, s.name, s.curval, s.minval, s.maxval) in readings:
+				if s.curtime == None:
+					if s.name == None:
+						self.AnalyseLine(s.maxval)
+					else:
+						print(s.name + '; remainder ignored')
+						counters['extra_values'] += 1
+						self.Problem(s.name, s.maxval)
+					continue
+				if hourly != None:
+					hourly.Update(s)
+				if daily != None:
+					daily.Update(s)
+				if monthly != None:
+					monthly.Update(s)
+			counters['readings'] += nreadings
+			t = self.Lap('aggregate', t)
+
+		log_file.close()
+		return offset
+
 	# Analyse a single line of a log
 	#
 	def AnalyseLine(self, line):
-		pairs = line.split('&')	# An array of key=value strings
-		if len(pairs) < 3:
+		if line.count('&') < 2:
 			print('Short line "' + line +'" ignored')
+			self.counters['rejected'] += 1
+			self.Problem('Short line', line)
 			return
-		values = {}
-		for pair in pairs:
-			(key, value) = pair.split('=', 1)
-			values[key] = value
-		if not SanityCheck(values, False):
+		rec = ParseRecord(line, False, True)
+		if rec == None:
+			self.counters['rejected'] += 1
+			self.Problem(Helpers.lasterror, line)
 			return
 
-		d = values['date']
-		t = values['time']
-		td = d[0:4] + '-' + d[4:6]
-		monthly = self.FindStats(self.monthly, td)
-		td += '-' + d[6:8]
-		daily = self.FindStats(self.daily, td)
-		td += ' ' + t[0:2]
-		hourly = self.FindStats(self.hourly, td)
+		t = rec.time
+		try:
+			(hourly, daily, monthly, prefix) = self.hours[rec.date + t[0:2]]
+		except KeyError:
+			d = rec.date
+			(hourly, daily, monthly) = self.FindBuckets(d, t[0:2])
+			prefix = d[0:4] + '-' + d[4:6] + '-' + d[6:8] + ' ' + t[0:2] + ':'
+			self.hours[d + t[0:2]] = (hourly, daily, monthly, prefix)
 		if monthly == None and daily == None and hourly == None:
 			return
-		td += ':' + t[2:4] + ':' + t[4:6]
-		s = Sensor(None)
-		s.curtime = td
-		for key in values:
-			if key in ['date', 'time', 'from']:	# These aren't sensor fields; ignore them
-				continue
-
-			s.name = key
-			s.minval = None
-			s.maxval = None
-
-			vals = values[key].split(',')
-			s.curval = self.StrToInt(vals[0])
-			if len(vals) > 1:
-				s.minval = self.StrToInt(vals[1])
-			if len(vals) > 2:
-				s.maxval = self.StrToInt(vals[2])
-			if len(vals) > 3:
+		s = self.temp
+		s.curtime = prefix + t[2:4] + ':' + t[4:6]
+		known = Config.sensornames
+		for (s.name, s.curval, s.minval, s.maxval, more) in rec.readings:
+			if s.name not in known:
+				self.counters['unknown_sensors'] += 1
+			if more:
 				print('More than three values; remainder ignored')
+				self.counters['extra_values'] += 1
+				self.Problem('More than three values', line)
 
 			if hourly != None:
 				hourly.Update(s)
@@ -266,98 +1146,131 @@ class Analyser():
 				daily.Update(s)
 			if monthly != None:
 				monthly.Update(s)
+		self.counters['readings'] += len(rec.readings)
 		return
 
-	# Find the stats object for a given date. The list is passed as a parameter
+	# Get the sections of the report. Each section is (title, statistics for the headers, groups) and each
+	# group is (label, function that gets the cells of a row from a Statistics object, list of Statistics).
+	# The title and the labels can be None
 	#
-	def FindStats(self, stats, td):
-		for s in stats:
-			if s.timedate == td:
-				return s
-		return None
-
-	# Convert a string to an integer.
-	# Return None if string is not valid
-	def StrToInt(self, valstr):
-		try:
-			v = int(valstr)
-		except:
-			v = None
-		return v
+	def Sections(self):
+		sections = [
+			(None, self.hourly[0], [
+				('Current', Statistics.CurrentCells, self.hourly[0:1]),
+				('Hour', Statistics.MinMaxCells, self.hourly[0:1]),
+				('Last %d hours' % (len(self.hourly) - 1), Statistics.MinMaxCells, self.hourly[1:]) ]),
+			(None, self.daily[0], [
+				('Today', Statistics.MinMaxCells, self.daily[0:1]),
+				('Last %d days' % (len(self.daily) - 1), Statistics.MinMaxCells, self.daily[1:]) ]),
+			(None, self.monthly[0], [
+				('This month', Statistics.MinMaxCells, self.monthly[0:1]),
+				('Last %d months' % (len(self.monthly) - 1), Statistics.MinMaxCells, self.monthly[1:]) ])
+		]
+		if GetOption('opt_ShowSpread', False):
+			sections.append(('Mean/median/95th percentile', self.daily[0], [ (None, Statistics.SpreadCells, self.daily) ]))
+			sections.append((None, self.monthly[0], [ (None, Statistics.SpreadCells, self.monthly) ]))
+		return sections
 
-	# Print all the statistics as plain text
+	# Get the current time (UTC) and the server's local time as strings
 	#
-	def PrintStats(self):
-		print(Config.title)
-		print()
+	def Times(self):
 		gmt = time.gmtime(self.now)
-		utc = (gmt.tm_year, gmt.tm_mon, gmt.tm_mday, gmt.tm_hour, gmt.tm_min)
-		print('Current time (UTC): %04d-%02d-%02d %02d:%02d' % utc)
+		utc = '%04d-%02d-%02d %02d:%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday, gmt.tm_hour, gmt.tm_min)
 		loc = time.localtime(self.now)
-		tim = (loc.tm_year, loc.tm_mon, loc.tm_mday, loc.tm_hour, loc.tm_min)
-		print('Server local time : %04d-%02d-%02d %02d:%02d' % tim)
-		print()
-		print('All times below are UTC')
-		self.hourly[0].PrintHeaders()
-		print('Current')
-		self.hourly[0].PrintCurrent()
-		print('Hour')
-		self.hourly[0].PrintMinMax()
-		print('Last 24 hours')
-		for stats in self.hourly[1:]:
-			stats.PrintMinMax()
-		print()
-
-		self.daily[0].PrintHeaders()
-		print('Today')
-		self.daily[0].PrintMinMax()
-		print('Last 7 days')
-		for stats in self.daily[1:]:
-			stats.PrintMinMax()
-		print()
-		self.monthly[0].PrintHeaders()
-		print('This month')
-		self.monthly[0].PrintMinMax()
-		print('Last 12 months')
-		for stats in self.monthly[1:]:
-			stats.PrintMinMax()
-		print()
-		return
-
-	# Print all the statistics as HTML
-	# ToDo: WORKING HERE
+		tim = '%04d-%02d-%02d %02d:%02d' % (loc.tm_year, loc.tm_mon, loc.tm_mday, loc.tm_hour, loc.tm_min)
+		return (utc, tim)
+
+	# Render all the statistics as plain text. Returns the text
+	#
+	def TextReport(self):
+		row = TextRow(len(Config.sensornames))
+		(utc, tim) = self.Times()
+		out = [ Config.title, '\n\n',
+				'Current time (UTC): ', utc, '\n',
+				'Server local time : ', tim, '\n\n',
+				'All times below are UTC\n' ]
+		for (title, first, groups) in self.Sections():
+			if title != None:
+				out.append(title + '\n')
+			out.append(row.Format(first.HeaderCells()))
+			for (label, cells, stats_list) in groups:
+				if label != None:
+					out.append(label + '\n')
+				for stats in stats_list:
+					out.append(row.Format(cells(stats)))
+			out.append('\n')
+		return ''.join(out)
+
+	# Render all the statistics as an HTML page. Returns the text
+	#
+	def HtmlReport(self):
+		ncols = len(Config.sensornames)
+		row = HtmlRow(ncols)
+		head = HtmlRow(ncols, 'th')
+		title = html.escape(Config.title)
+		(utc, tim) = self.Times()
+		out = [ '<!DOCTYPE html>\n'
+				'<html lang="en">\n'
+				'<head>\n'
+				'<meta charset="utf-8">\n'
+				'<meta name="viewport" content="width=device-width, initial-scale=1.0">\n'
+				'<title>', title, '</title>\n'
+				'<style>\n'
+				'table { border-collapse: collapse; margin-bottom: 1em; }\n'
+				'th, td { padding: 0.1em 0.8em; text-align: left; white-space: nowrap; }\n'
+				'tbody th { font-weight: normal; }\n'
+				'tr.group th { font-weight: bold; padding-top: 0.5em; }\n'
+				'</style>\n'
+				'</head>\n'
+				'<body>\n'
+				'<h1>', title, '</h1>\n'
+				'<p>Current time (UTC): ', utc, '<br>\n'
+				'Server local time: ', tim, '</p>\n'
+				'<p>All times below are UTC</p>\n' ]
+		group = '<tr class="group"><th colspan="%d">%%s</th></tr>\n' % (ncols + 1)
+		for (title, first, groups) in self.Sections():
+			if title != None:
+				out.append('<h2>' + html.escape(title) + '</h2>\n')
+			out.append('<table>\n<thead>\n')
+			out.append(head.Format(first.HeaderCells()))
+			out.append('</thead>\n<tbody>\n')
+			for (label, cells, stats_list) in groups:
+				if label != None:
+					out.append(group % html.escape(label))
+				for stats in stats_list:
+					out.append(row.Format(cells(stats)))
+			out.append('</tbody>\n</table>\n')
+		out.append('</body>\n</html>\n')
+		return ''.join(out)
+
+	# Print all the statistics as plain text, with a single write
+	#
+	def PrintStats(self):
+		t = time.perf_counter()
+		sys.stdout.write(self.TextReport())
+		self.Lap('render', t)
+		return
+
+	# Print all the statistics as an HTML page, with a single write
 	#
 	def HtmlStats(self):
-		print('<h1>' + Config.title + '</h1>')
-		print('<p>All times are UTC</p>')
-		print()
-		gmt = time.gmtime(self.now)
-		utc = (gmt.tm_year, gmt.tm_mon, gmt.tm_mday, gmt.tm_hour, gmt.tm_min)
-		print('<p>Current time: %04d-%02d-%02d %02d:%02d</p>' % utc)
-		print()
-		self.hourly[0].PrintHeaders()
-		print('Current')
-		self.hourly[0].PrintCurrent()
-		print('Hour')
-		self.hourly[0].PrintMinMax()
-		print('Last 24 hours')
-		for stats in self.hourly[1:]:
-			stats.PrintMinMax()
-		print()
-
-		self.daily[0].PrintHeaders()
-		print('Today')
-		self.daily[0].PrintMinMax()
-		print('Last 7 days')
-		for stats in self.daily[1:]:
-			stats.PrintMinMax()
-		print()
-		self.monthly[0].PrintHeaders()
-		print('This month')
-		self.monthly[0].PrintMinMax()
-		print('Last 12 months')
-		for stats in self.monthly[1:]:
-			stats.PrintMinMax()
-		print()
+		t = time.perf_counter()
+		sys.stdout.write(self.HtmlReport())
+		self.Lap('render', t)
 		return
 
+	# Print all the statistics as JSON. The values are in the sensors' units (i.e. tenths / 10)
+	#
+	def JsonStats(self):
+		t = time.perf_counter()
+		report = {
+			'title':	Config.title,
+			'station':	self.user,
+			'time':		int(self.now),
+			'sensors':	dict(Config.sensornames)
+		}
+		for (key, stats_list) in [ ('hourly', self.hourly), ('daily', self.daily), ('monthly', self.monthly) ]:
+			report[key] = [ { 'period': stats.timedate, 'sensors': stats.JsonValues() } for stats in stats_list ]
+		print(json.dumps(report, separators=(',', ':')))
+		self.Lap('render', t)
+		return
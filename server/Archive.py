@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compressed archives of old log files.
+#
+# The day logs of a user for one month are compressed into a single archive, user-YYYYMM.pla.
+# Each day's log is split into blocks of about 64 KiB of complete lines and each block is compressed
+# separately (lzma or zlib), so a reader only has to decompress the blocks it needs.
+#
+# Layout:
+#	Header		magic b'PLZ1', codec name (8 bytes, padded with NUL)
+#	Blocks		compressed data
+#	Index		JSON:
+#					'days':		{ YYYYMMDD: [ [size, mtime_ns], ... ] }	the log files that were archived
+#					'blocks':	[ [YYYYMMDD, first, last, offset, clen, ulen], ... ]
+#				first and last are the range of times (seconds since midnight) of the lines in the block
+#	Footer		index offset (uint64), index length (uint32), magic
+#
+# The log files are read through LogDir.OpenLog(), which returns the archived content of a day followed
+# by the content of the log file, if there is one (records that arrived for the day after it was archived).
+# A log file whose size and modification time match those recorded in the index is one that should
+# have been deleted when it was archived (e.g. after a crash); its content isn't counted twice.
+#
+# Usage:
+#	./Archive.py [--days N] [--codec lzma|zlib] user ...
+#		archives the logs of the users that are more than N days old (default opt_ArchiveDays)
+
+import os
+import json
+import time
+import struct
+import zlib
+import lzma
+import argparse
+import LogDir
+from py.Config import Config
+
+MAGIC = b'PLZ1'
+HEADER_SIZE = 12
+FOOTER = struct.Struct('<QI4s')
+BLOCKSIZE = 65536
+
+CODECS = {
+	'zlib':	(lambda data: zlib.compress(data, 9), zlib.decompress),
+	'lzma':	(lzma.compress, lzma.decompress)
+}
+
+indexes = {}		# Cache of archive indexes: name --> (size, mtime_ns, codec, index)
+
+# Get the name of the archive that holds (or would hold) a log file (user-YYYYMMDD.log)
+#
+def ArchiveName(logname):
+	return logname[:-6] + '.pla'
+
+# Read the index of an archive. Returns (codec, index), or None if there is no valid archive
+#
+def ReadIndex(aname):
+	try:
+		st = os.stat(aname)
+	except OSError:
+		return None
+	try:
+		(size, mtime, codec, index) = indexes[aname]
+		if size == st.st_size and mtime == st.st_mtime_ns:
+			return (codec, index)
+	except KeyError:
+		pass
+
+	f = open(aname, 'rb')
+	hdr = f.read(HEADER_SIZE)
+	if len(hdr) < HEADER_SIZE or hdr[0:4] != MAGIC or st.st_size < HEADER_SIZE + FOOTER.size:
+		f.close()
+		return None
+	codec = hdr[4:HEADER_SIZE].rstrip(b'\0').decode()
+	f.seek(st.st_size - FOOTER.size)
+	(ipos, ilen, magic) = FOOTER.unpack(f.read(FOOTER.size))
+	if magic != MAGIC or codec not in CODECS:
+		f.close()
+		return None
+	f.seek(ipos)
+	index = json.loads(f.read(ilen))
+	f.close()
+	indexes[aname] = (st.st_size, st.st_mtime_ns, codec, index)
+	return (codec, index)
+
+# Get the archived content of a day, only decompressing the blocks that contain times in the range
+# first <= time < last (seconds since midnight; None for the whole day)
+#
+def ReadDay(aname, codec, index, d, first=None, last=None):
+	decompress = CODECS[codec][1]
+	data = bytearray()
+	f = open(aname, 'rb')
+	for (bd, t0, t1, offset, clen, ulen) in index['blocks']:
+		if bd != d:
+			continue
+		if first != None and t1 < first:
+			continue
+		if last != None and t0 >= last:
+			continue
+		f.seek(offset)
+		data += decompress(f.read(clen))
+	f.close()
+	return bytes(data)
+
+# Check whether a log file is the same as one that was archived (and should have been deleted)
+#
+def IsArchived(index, d, st):
+	for (size, mtime) in index['days'].get(d, []):
+		if size == st.st_size and mtime == st.st_mtime_ns:
+			return True
+	return False
+
+# Split the content of a log file into blocks of complete lines.
+# Returns a list of (first, last, data) where first and last are the range of times in the block
+#
+def SplitBlocks(d, data):
+	prefix = ('date=' + d + '&time=').encode()
+	p = len(prefix)
+	blocks = []
+	start = 0
+	while start < len(data):
+		end = data.find(b'\n', start + BLOCKSIZE)
+		if end < 0:
+			end = len(data)
+		else:
+			end += 1
+		t0 = 86400
+		t1 = 0
+		for line in data[start:end].splitlines():
+			t = line[p:p+6]
+			if line.startswith(prefix) and len(t) == 6 and t.isdigit():
+				secs = int(t[0:2]) * 3600 + int(t[2:4]) * 60 + int(t[4:6])
+				t0 = min(t0, secs)
+				t1 = max(t1, secs)
+			else:
+				t0 = 0				# Unknown time; the block must always be read
+				t1 = 86399
+		blocks.append((t0, t1, data[start:end]))
+		start = end
+	return blocks
+
+# Add log files to an archive (creating it if necessary). The new archive is written to a temporary
+# file and renamed, so readers see either the old or the new archive.
+#	logs	list of log file names, all for the same user and month
+# Returns (uncompressed bytes, compressed bytes) of the added logs
+#
+def AddLogs(aname, logs, codecname):
+	old = ReadIndex(aname)
+	if old != None:
+		codecname = old[0]
+		index = json.loads(json.dumps(old[1]))		# A copy; the cached index stays valid if this fails
+	else:
+		index = { 'days': {}, 'blocks': [] }
+	data = bytearray(MAGIC + codecname.encode().ljust(8, b'\0'))
+	if len(index['blocks']) > 0:
+		end = max([ b[3] + b[4] for b in index['blocks'] ])
+		f = open(aname, 'rb')
+		f.seek(HEADER_SIZE)
+		data += f.read(end - HEADER_SIZE)
+		f.close()
+	compress = CODECS[codecname][0]
+
+	usize = 0
+	csize = 0
+	for logname in logs:
+		d = logname[-12:-4]
+		st = os.stat(logname)
+		f = open(logname, 'rb')
+		content = f.read(st.st_size)
+		f.close()
+		for (t0, t1, block) in SplitBlocks(d, content):
+			cblock = compress(block)
+			index['blocks'].append([ d, t0, t1, len(data), len(cblock), len(block) ])
+			data += cblock
+			usize += len(block)
+			csize += len(cblock)
+		index['days'].setdefault(d, []).append([ st.st_size, st.st_mtime_ns ])
+
+	ijson = json.dumps(index, separators=(',', ':')).encode()
+	data += ijson + FOOTER.pack(len(data), len(ijson), MAGIC)
+
+	tmpname = aname + '.tmp'
+	f = open(tmpname, 'wb')
+	f.write(data)
+	f.flush()
+	os.fsync(f.fileno())
+	f.close()
+	os.replace(tmpname, aname)
+	return (usize, csize)
+
+# Archive the logs of a user that are more than <days> days old.
+# The log files (and their day files) are deleted after the archive has been written.
+# Returns a list of (archive name, uncompressed bytes, compressed bytes)
+#
+def Compact(user, days, codec):
+	gmt = time.gmtime(time.time() - days * 86400)
+	limit = '%04d%02d%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday)
+	months = {}
+	for name in LogDir.ListLogs(user):
+		if name[-12:-4] < limit and os.path.isfile(name):
+			months.setdefault(ArchiveName(name), []).append(name)
+
+	result = []
+	for aname in sorted(months):
+		logs = sorted(months[aname])
+		old = ReadIndex(aname)
+		if old != None:
+			# Logs that were archived but not deleted (interrupted compaction)
+			done = [ l for l in logs if IsArchived(old[1], l[-12:-4], os.stat(l)) ]
+			Delete(done)
+			logs = [ l for l in logs if l not in done ]
+		if len(logs) == 0:
+			continue
+		(usize, csize) = AddLogs(aname, logs, codec)
+		Delete(logs)
+		result.append((aname, usize, csize))
+	return result
+
+# Delete log files and their day files
+#
+def Delete(logs):
+	for logname in logs:
+		os.unlink(logname)
+		try:
+			os.unlink(logname[:-4] + '.pld')
+		except OSError:
+			pass
+	return
+
+def Main():
+	parser = argparse.ArgumentParser(description='Archive old pico-logger log files')
+	parser.add_argument('--days', type=int, default=getattr(Config, 'opt_ArchiveDays', 400),
+						help='archive the logs that are older than this number of days')
+	parser.add_argument('--codec', default=getattr(Config, 'opt_ArchiveCodec', 'lzma'),
+						choices=sorted(CODECS), help='compression')
+	parser.add_argument('users', nargs='+')
+	args = parser.parse_args()
+
+	for user in args.users:
+		for (aname, usize, csize) in Compact(user, args.days, args.codec):
+			print('%s: %d bytes --> %d bytes (ratio %.1f)' % (aname, usize, csize, usize / max(csize, 1)))
+	return
+
+if __name__ == '__main__':
+	Main()
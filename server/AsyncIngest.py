@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Asyncio ingest server: an alternative to Ingest.py for many stations on slow connections.
+#
+# Each connection is handled by a coroutine, so a station that is slow to send its request (e.g. over
+# a flaky TLS link) only holds a few kilobytes of memory instead of a whole process or thread.
+# The requests are checked in exactly the same way as in wlog.py (CheckQuery() and CheckBatch() in
+# Helpers.py) and the responses are the same.
+#
+# The checked records are put on a bounded queue. A single writer task takes everything that is waiting
+# on the queue and writes it with WriteRecords(), i.e. with one append per log file, in a separate thread
+# so that the connections are still served while it waits for the disk. A request is answered with OK
+# only after its records have been written. When the queue is full, the request is answered at once with
+# 503 Service Unavailable and a Retry-After header instead of waiting behind the backlog.
+#
+# Usage:
+#	./AsyncIngest.py [--bind ADDRESS] [--port PORT] [--dir LOGDIR] [--cert CERTFILE --key KEYFILE]
+
+import os
+import io
+import ssl
+import signal
+import asyncio
+import argparse
+import traceback
+import contextlib
+import concurrent.futures
+from urllib.parse import urlsplit
+from Helpers import *
+from LogWriter import LogWriter
+
+MAXHEADER = 8192			# Maximum size of the request line and headers
+MAXWRITE = 1000				# Maximum number of requests that the writer takes from the queue at once
+
+STATUS = {
+	200: 'OK',
+	405: 'Method Not Allowed',
+	503: 'Service Unavailable'
+}
+
+# ===
+# The server
+#
+class AsyncIngest():
+	def __init__(self, queuesize, retry, timeout):
+		self.queue = asyncio.Queue(queuesize)		# (list of records, future)
+		self.retry = retry
+		self.timeout = timeout
+		self.logwriter = LogWriter('record', fsync=GetOption('opt_Fsync', False),
+									maxopen=GetOption('opt_MaxOpenLogs', 64))
+		self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+		self.busy = 0				# Number of requests answered with 503
+		self.connections = {}		# Task --> StreamWriter, for closing the connections when the server stops
+		return
+
+	# Handle a connection: read and answer requests until the client closes the connection
+	# or doesn't send a complete request within the timeout
+	#
+	async def HandleConnection(self, reader, writer):
+		self.connections[asyncio.current_task()] = writer
+		try:
+			while True:
+				request = await asyncio.wait_for(self.ReadRequest(reader), self.timeout)
+				if request == None:
+					break
+				(method, target, keepalive, body) = request
+				(status, text) = await self.HandleRequest(method, target, body)
+				self.Reply(writer, status, text, keepalive)
+				await writer.drain()
+				if not keepalive:
+					break
+		except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError,
+				ssl.SSLError, ValueError):
+			pass			# The client is too slow, has gone away or isn't speaking HTTP
+		writer.close()
+		try:
+			await writer.wait_closed()
+		except (ConnectionError, ssl.SSLError):
+			pass
+		del self.connections[asyncio.current_task()]
+		return
+
+	# Read a request. Returns (method, target, keepalive, body) or None at the end of the connection.
+	# body is None for a GET request, otherwise the text of the body
+	#
+	async def ReadRequest(self, reader):
+		try:
+			head = await reader.readuntil(b'\r\n\r\n')
+		except asyncio.IncompleteReadError as e:
+			if len(e.partial) == 0:
+				return None
+			raise
+		lines = head.decode('latin-1').split('\r\n')
+		(method, target, version) = lines[0].split(' ', 2)	# ValueError if malformed
+		headers = {}
+		for line in lines[1:]:
+			(key, sep, value) = line.partition(':')
+			headers[key.strip().lower()] = value.strip()
+
+		connection = headers.get('connection', '').lower()
+		if version == 'HTTP/1.1':
+			keepalive = connection != 'close'
+		else:
+			keepalive = connection == 'keep-alive'
+
+		body = None
+		if method == 'POST':
+			n = int(headers.get('content-length', '0'))
+			if n > maxbatch:
+				return (method, target, False, None)		# Rejected in HandleRequest(); the body isn't read
+			body = (await reader.readexactly(n)).decode(errors='replace')
+		return (method, target, keepalive, body)
+
+	# Check a request and, if there are records to log, queue them and wait until they have been written.
+	# Returns (status, text of the response)
+	#
+	async def HandleRequest(self, method, target, body):
+		if method not in [ 'GET', 'POST' ]:
+			return (405, 'Error: method not allowed\n')
+		if method == 'POST' and body == None:
+			return (200, 'Error: request body too long\n')
+
+		q = urlsplit(target).query
+		buf = io.StringIO()
+		with contextlib.redirect_stdout(buf):
+			try:
+				if body != None:
+					records = None
+					checked = CheckBatch(q, body)
+					if checked != None:
+						(results, records) = checked
+						PrintResults(results)
+				else:
+					rec = CheckQuery(q)
+					records = None if rec == None else [ rec ]
+			except Exception as e:
+				PrintException(q, e)
+				return (200, buf.getvalue())
+		if records == None:
+			return (200, buf.getvalue())
+
+		if len(records) > 0:
+			done = asyncio.get_running_loop().create_future()
+			try:
+				self.queue.put_nowait((records, done))
+			except asyncio.QueueFull:
+				self.busy += 1
+				return (503, 'Error: server busy; try again later\n')
+			try:
+				await done
+			except Exception as e:
+				with contextlib.redirect_stdout(buf):
+					PrintException(q, e)
+				return (200, buf.getvalue())
+		return (200, buf.getvalue() + 'OK\n')
+
+	# Send a text/plain response
+	#
+	def Reply(self, writer, status, text, keepalive):
+		body = text.encode()
+		head = 'HTTP/1.1 %d %s\r\n' % (status, STATUS[status])
+		head += 'Content-Type: text/plain\r\n'
+		head += 'Content-Length: %d\r\n' % len(body)
+		if status == 503:
+			head += 'Retry-After: %d\r\n' % self.retry
+		if not keepalive:
+			head += 'Connection: close\r\n'
+		writer.write(head.encode() + b'\r\n' + body)
+		return
+
+	# The writer task: takes all the waiting requests from the queue and writes their records,
+	# then tells the requests that their records have been written
+	#
+	async def Writer(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			items = [ await self.queue.get() ]
+			while len(items) < MAXWRITE and not self.queue.empty():
+				items.append(self.queue.get_nowait())
+			records = []
+			for (recs, done) in items:
+				records += recs
+			try:
+				await loop.run_in_executor(self.pool, WriteRecords, records, self.logwriter)
+				for (recs, done) in items:
+					if not done.done():
+						done.set_result(True)
+			except Exception as e:
+				for (recs, done) in items:
+					if not done.done():
+						done.set_exception(e)
+			for item in items:
+				self.queue.task_done()
+		return
+
+	# Run the server until SIGTERM or SIGINT. The records that are waiting are written before it stops
+	#
+	async def Serve(self, bind, port, sslctx=None):
+		loop = asyncio.get_running_loop()
+		stop = asyncio.Event()
+		for sig in [ signal.SIGTERM, signal.SIGINT ]:
+			loop.add_signal_handler(sig, stop.set)
+
+		wtask = asyncio.create_task(self.Writer())
+		server = await asyncio.start_server(self.HandleConnection, bind, port, limit=MAXHEADER, ssl=sslctx,
+											ssl_handshake_timeout=self.timeout if sslctx != None else None)
+		print('Listening on %s:%d' % (bind, port), flush=True)
+		await stop.wait()
+
+		server.close()
+		await self.queue.join()
+		await asyncio.sleep(0)				# Let the requests whose records were written send their responses
+		tasks = list(self.connections)
+		for writer in self.connections.values():
+			writer.transport.abort()		# Idle and incomplete requests
+		await asyncio.gather(*tasks, return_exceptions=True)
+		wtask.cancel()
+		self.pool.shutdown()
+		self.logwriter.Close()
+		if self.busy > 0:
+			print('%d requests were refused because the queue was full' % self.busy)
+		return
+
+# Print the response for an exception, as wlog.py does
+#
+def PrintException(q, e):
+	print('Sorry; an exception occurred.')
+	print('QUERY_STRING', q)
+	fexc = traceback.format_exception(e)
+	for l in fexc:
+		print(l.rstrip())
+	print('')
+	return
+
+# Run the server
+#
+def Main():
+	parser = argparse.ArgumentParser(description='pico-logger asyncio ingest server')
+	parser.add_argument('--bind', default='127.0.0.1', help='address to listen on')
+	parser.add_argument('--port', type=int, default=8081, help='port to listen on')
+	parser.add_argument('--dir', default=None, help='directory for the log files')
+	parser.add_argument('--cert', default=None, help='certificate file (PEM) for HTTPS')
+	parser.add_argument('--key', default=None, help='private key file (PEM) for HTTPS')
+	args = parser.parse_args()
+
+	sslctx = None
+	if args.cert != None:
+		sslctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+		sslctx.load_cert_chain(args.cert, args.key)
+	if args.dir != None:
+		os.chdir(args.dir)
+
+	server = AsyncIngest(GetOption('opt_IngestQueue', 1000), GetOption('opt_IngestRetry', 5),
+							GetOption('opt_IngestTimeout', 30))
+	asyncio.run(server.Serve(args.bind, args.port, sslctx))
+	return
+
+if __name__ == '__main__':
+	Main()
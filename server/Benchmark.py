@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmarks for the analyser.
+#
+# A month of synthetic logs (one reading every 5 minutes) is written to a temporary directory
+# and then analysed in different ways, as text and as binary day files.
+# The results are printed in lines per second. ReadLogs() is timed with 1, 2, 4, ... worker
+# processes, up to the number of CPUs; use a large number of days to see the scaling.
+# Ingest and report times are compared for the text logs and the SQLite database.
+# The compression ratio and read throughput of the archive codecs are printed too.
+#
+# Usage:
+#	./Benchmark.py [days]
+
+import os
+import sys
+import time
+import random
+import tempfile
+from py.Config import Config
+from Analyse import Analyser
+import DayFile
+import Archive
+import NumpyEngine
+import SqlStore
+from Helpers import ProcessQuery
+from bench import LogGen
+
+# Write synthetic logs for a user (see bench/LogGen.py), ending now. One line every <interval> seconds.
+# Returns the list of file names and the total number of lines
+#
+def MakeLogs(user, days, interval=300):
+	now = int(time.time())
+	return LogGen.WriteStation(user, list(Config.sensornames), interval, now // 86400 - days + 1, now // 86400,
+								random.Random(1), now)
+
+# The original way of reading a log: readlines() and AnalyseLine() for every line
+#
+def ReadLogByLine(a, fname):
+	f = open(fname, 'r')
+	log = f.readlines()
+	f.close()
+	for line in log:
+		a.AnalyseLine(line.strip())
+	return
+
+# Read a log with the NumPy engine
+#
+def ReadLogNumpy(a, fname):
+	a.ReadLogsNumpy([fname])
+	return
+
+# Time a function that analyses all the files. Returns the best of <repeat> runs in seconds
+#
+def TimeIt(fn, flist, repeat=3):
+	best = None
+	for i in range(0, repeat):
+		a = Analyser('bench')
+		t = time.perf_counter()
+		for fname in flist:
+			fn(a, fname)
+		t = time.perf_counter() - t
+		if best == None or t < best:
+			best = t
+	return best
+
+# Time Analyser.ReadLogs() with different numbers of worker processes (opt_Workers)
+#
+def Scaling(nlines):
+	workers = 1
+	while workers <= max(os.cpu_count(), 1):
+		Config.opt_Workers = workers
+		t = TimeIt(ReadLogs, [ None ])
+		print('%-24s %10d lines/s' % ('ReadLogs, %d workers' % workers, nlines / t))
+		workers *= 2
+	return
+
+def ReadLogs(a, fname):
+	a.ReadLogs()
+	return
+
+# Time the ingest of n records (ProcessQuery) with the current storage options.
+# Returns the mean time per record in seconds
+#
+def IngestTime(n):
+	Config.passwords['ingest'] = 'ingest'
+	gmt = time.gmtime()
+	d = '%04d%02d%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday)
+	t = time.perf_counter()
+	for i in range(0, n):
+		ProcessQuery('date=%s&time=%02d%02d%02d&from=pico&user=ingest&pass=ingest&T00=%d,%d,%d&T01=%d'
+						% (d, (i // 3600) % 24, (i // 60) % 60, i % 60, i % 300, i % 300 - 5, i % 300 + 5, i % 250))
+	return (time.perf_counter() - t) / n
+
+# Compare the text logs with the SQLite database (opt_Database): ingest time per record
+# and the time taken to compute the report windows
+#
+def Storage(flist):
+	Config.opt_Database = None
+	print('%-24s %10.1f us/record' % ('Ingest (text)', IngestTime(1000) * 1000000))
+	print('%-24s %10.1f ms' % ('Report (text)', TimeIt(ReadLogs, [ None ]) * 1000))
+
+	Config.opt_Database = 'bench.db'
+	for fname in flist:
+		SqlStore.ImportLog(fname)
+	print('%-24s %10.1f us/record' % ('Ingest (text + SQLite)', IngestTime(1000) * 1000000))
+	print('%-24s %10.1f ms' % ('Report (SQLite)', TimeIt(ReadLogs, [ None ]) * 1000))
+	Config.opt_Database = None
+	SqlStore.db.close()
+	SqlStore.db = None
+	return
+
+# Compare the archive codecs (Archive.py): compression ratio and the speed of reading the days
+# back from the archive. The logs aren't deleted
+#
+def Compression(flist, nlines):
+	for codec in sorted(Archive.CODECS):
+		aname = 'bench-' + codec + '.pla'
+		t = time.perf_counter()
+		(usize, csize) = Archive.AddLogs(aname, flist, codec)
+		tc = time.perf_counter() - t
+		(codec, index) = Archive.ReadIndex(aname)
+		t = time.perf_counter()
+		for fname in flist:
+			Archive.ReadDay(aname, codec, index, fname[-12:-4])
+		td = time.perf_counter() - t
+		print('%-24s %10.1f ratio, %.1f MB/s compress, %.1f MB/s (%d lines/s) read'
+				% ('Archive (' + codec + ')', usize / csize, usize / tc / 1e6, usize / td / 1e6, nlines / td))
+		os.unlink(aname)
+	return
+
+def Main():
+	days = 31
+	if len(sys.argv) > 1:
+		days = int(sys.argv[1])
+
+	olddir = os.getcwd()
+	with tempfile.TemporaryDirectory() as tmpdir:
+		os.chdir(tmpdir)
+		(flist, nlines) = MakeLogs('bench', days)
+		print('%d files, %d lines, %d sensors' % (len(flist), nlines, len(Config.sensornames)))
+
+		t = TimeIt(ReadLogByLine, flist)
+		print('%-24s %10d lines/s' % ('readlines/AnalyseLine', nlines / t))
+		t = TimeIt(Analyser.ReadLog, flist)
+		print('%-24s %10d lines/s' % ('ReadLog', nlines / t))
+		if NumpyEngine.Available():
+			t = TimeIt(ReadLogNumpy, flist)
+			print('%-24s %10d lines/s' % ('NumPy (text)', nlines / t))
+
+		Scaling(nlines)
+		Storage(flist)
+		Compression(flist, nlines)
+
+		for fname in flist:
+			DayFile.ConvertLog(fname)
+		t = TimeIt(Analyser.ReadFile, flist)
+		print('%-24s %10d lines/s' % ('ReadDayFile', nlines / t))
+		if NumpyEngine.Available():
+			t = TimeIt(ReadLogNumpy, flist)
+			print('%-24s %10d lines/s' % ('NumPy (day files)', nlines / t))
+		os.chdir(olddir)
+	return
+
+if __name__ == '__main__':
+	Main()
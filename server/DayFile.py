@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Binary day files.
+#
+# A day file (user-YYYYMMDD.pld) holds the same readings as the text log file (user-YYYYMMDD.log)
+# in a form that can be read without any string parsing.
+#
+# Layout (all little-endian):
+#	Header (264 bytes):
+#		magic			4 bytes		b'PLD1'
+#		nsensors		uint16		number of entries in the sensor table
+#		flags			uint16		INCOMPLETE if the file mustn't be used (see below)
+#		sensor table	32 x 8 bytes, sensor names padded with NUL
+#	Records (12 bytes each):
+#		time			uint32		seconds since midnight (UTC)
+#		sensor			uint16		index into the sensor table
+#		cur, min, max	int16		values in tenths; NOVALUE if not present
+#
+# The records are fixed-width, so the file can be mapped with mmap and viewed as columns
+# (see Columns()) or as a NumPy structured array:
+#	numpy.dtype([('time','<u4'), ('sensor','<u2'), ('cur','<i2'), ('min','<i2'), ('max','<i2')])
+#	with offset=HEADER_SIZE
+#
+# Values that aren't numbers are stored as NOVALUE, as the analyser treats them when it reads the text log.
+# If a reading can't be stored exactly (a value that doesn't fit in an int16, a sensor name longer than
+# NAMELEN or more than MAXSENSORS sensors), the file is marked INCOMPLETE and nothing more is written to it.
+# The readers treat an incomplete file as invalid and read the text log, which remains the master copy.
+#
+# Usage:
+#	./DayFile.py user-YYYYMMDD.log ...		converts text logs to day files
+
+import os
+import sys
+import io
+import struct
+import mmap
+import fcntl
+import LogDir
+
+MAGIC = b'PLD1'
+MAXSENSORS = 32
+NAMELEN = 8
+HEADER_SIZE = 4 + 2 + 2 + MAXSENSORS * NAMELEN
+RECORD = struct.Struct('<IHhhh')
+NOVALUE = -32768
+INCOMPLETE = 1				# Flag in the header
+
+# Get the name of the day file that belongs to a text log file
+#
+def DayFileName(logname):
+	return logname[:-4] + '.pld'
+
+# Is a day file usable, i.e. does it have a valid header and isn't it incomplete?
+#
+def Usable(fname):
+	try:
+		f = open(fname, 'rb')
+		hdr = f.read(HEADER_SIZE)
+		f.close()
+	except OSError:
+		return False
+	return ParseHeader(hdr) != None
+
+# Make a header from a list of sensor names
+#
+def MakeHeader(names, flags=0):
+	hdr = MAGIC + struct.pack('<HH', len(names), flags)
+	for n in names:
+		hdr += n.encode().ljust(NAMELEN, b'\0')
+	return hdr.ljust(HEADER_SIZE, b'\0')
+
+# Decode the sensor table from a header.
+# Returns None if the header isn't valid or the file is incomplete
+#
+def ParseHeader(hdr):
+	if len(hdr) < HEADER_SIZE or hdr[0:4] != MAGIC:
+		return None
+	(n, flags) = struct.unpack_from('<HH', hdr, 4)
+	if flags & INCOMPLETE:
+		return None
+	names = []
+	for i in range(0, n):
+		pos = 8 + i * NAMELEN
+		names.append(hdr[pos:pos+NAMELEN].rstrip(b'\0').decode())
+	return names
+
+# Convert a value string to an int16 for the file.
+# Returns NOVALUE if absent or not a number and None if the value can't be stored
+#
+def PackValue(v):
+	if v == None:
+		return NOVALUE
+	try:
+		v = int(v)
+	except ValueError:
+		return NOVALUE
+	if v <= NOVALUE or v > 32767:
+		return None
+	return v
+
+# Make the binary records from the parameters of one log line.
+# The sensor table is extended if a new sensor appears. Returns the packed records,
+# or None if a reading can't be stored exactly
+#
+def PackLine(params, names):
+	t = params['time']
+	secs = int(t[0:2]) * 3600 + int(t[2:4]) * 60 + int(t[4:6])
+	data = bytearray()
+	for key in params:
+		if key in ['date', 'time', 'from', 'user', 'pass']:	# These aren't sensor fields
+			continue
+		vals = params[key].split(',')
+		vals += [ None ] * (3 - len(vals))
+		cur = PackValue(vals[0])
+		mn = PackValue(vals[1])
+		mx = PackValue(vals[2])
+		if cur == None or mn == None or mx == None:
+			return None
+		if len(key.encode()) > NAMELEN:
+			return None
+		try:
+			idx = names.index(key)
+		except ValueError:
+			if len(names) >= MAXSENSORS:
+				return None
+			idx = len(names)
+			names.append(key)
+		data += RECORD.pack(secs, idx, cur, mn, mx)
+	return data
+
+# Append the sensor values from a list of (checked) parameter sets to a day file.
+# The file is locked while the header is checked so that concurrent writers
+# don't lose new entries in the sensor table.
+# Returns False if the file is invalid or incomplete, or has just been marked incomplete
+#
+def AppendParams(fname, plist):
+	fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0o644)
+	try:
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		hdr = os.pread(fd, HEADER_SIZE, 0)
+		if len(hdr) == 0:
+			names = []
+		else:
+			names = ParseHeader(hdr)
+			if names == None:
+				return False
+		n = len(names)
+		data = bytearray()
+		for params in plist:
+			packed = PackLine(params, names)
+			if packed == None:
+				os.pwrite(fd, MakeHeader(names[0:n], INCOMPLETE), 0)
+				return False
+			data += packed
+		if len(names) != n or len(hdr) == 0:
+			os.pwrite(fd, MakeHeader(names), 0)
+		if len(data) > 0:
+			end = os.lseek(fd, 0, os.SEEK_END)
+			os.pwrite(fd, data, end)
+	finally:
+		os.close(fd)
+	return True
+
+# Read a day file, starting at the given offset (0 for the whole file).
+# Returns (names, records, end) where records is an iterator of (time, sensor, cur, min, max) tuples
+# and end is the offset after the last complete record.
+# The values are None if not present. Returns None if the file isn't valid
+#
+def ReadDayFile(fname, offset=0):
+	f = open(fname, 'rb')
+	names = ParseHeader(f.read(HEADER_SIZE))
+	if names == None:
+		f.close()
+		return None
+	if offset < HEADER_SIZE:
+		offset = HEADER_SIZE
+	f.seek(offset)
+	data = f.read()
+	f.close()
+	end = (len(data) // RECORD.size) * RECORD.size
+	return (names, Records(memoryview(data)[0:end]), offset + end)
+
+# Generator for the records in a block of data
+#
+def Records(mv):
+	for (t, s, cur, mn, mx) in RECORD.iter_unpack(mv):
+		if mn == NOVALUE:
+			mn = None
+		if mx == NOVALUE:
+			mx = None
+		if cur == NOVALUE:
+			cur = None
+		yield (t, s, cur, mn, mx)
+	return
+
+# Map a day file into memory and return (names, columns), where columns is a dictionary of
+# memoryviews: 'time' (uint32) and 'sensor', 'cur', 'min', 'max' (int16).
+# The views index the mapped file directly; nothing is copied.
+# Only valid on a little-endian host. Returns None if the file isn't valid (or is incomplete) or is empty
+#
+def Columns(fname):
+	f = open(fname, 'rb')
+	size = os.fstat(f.fileno()).st_size
+	if size <= HEADER_SIZE:
+		f.close()
+		return None
+	m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	f.close()
+	names = ParseHeader(m[0:HEADER_SIZE])
+	if names == None:
+		return None
+	n = (size - HEADER_SIZE) // RECORD.size
+	body = memoryview(m)[HEADER_SIZE:HEADER_SIZE + n * RECORD.size]
+	h = body.cast('h')
+	u = body.cast('I')
+	cols = {
+		'time':		u[0::3],
+		'sensor':	h[2::6],
+		'cur':		h[3::6],
+		'min':		h[4::6],
+		'max':		h[5::6]
+	}
+	return (names, cols)
+
+# Convert a text log file to a day file. The day file is replaced.
+# If a reading can't be stored, the day file is only a header that is marked incomplete
+#
+def ConvertLog(logname):
+	names = []
+	data = bytearray()
+	f = io.TextIOWrapper(LogDir.OpenLog(logname))
+	for line in f:
+		params = {}
+		for pair in line.strip().split('&'):
+			k_v = pair.split('=', 1)
+			if len(k_v) == 2:
+				params[k_v[0]] = k_v[1]
+		t = params.get('time', '')
+		if len(t) != 6 or not t.isdigit():
+			continue
+		packed = PackLine(params, names)
+		if packed == None:
+			data = None
+			break
+		data += packed
+	f.close()
+
+	fname = DayFileName(logname)
+	tmpname = fname + '.tmp'
+	f = open(tmpname, 'wb')
+	if data == None:
+		f.write(MakeHeader(names, INCOMPLETE))
+	else:
+		f.write(MakeHeader(names))
+		f.write(data)
+	f.close()
+	os.replace(tmpname, fname)
+	return fname
+
+if __name__ == '__main__':
+	for logname in sys.argv[1:]:
+		print(ConvertLog(logname))
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Diagnostics for slow reports.
+#
+# Each time a report is rendered, the Analyser's timers, counters and problems (see
+# Analyser.GetDiagnostics()) are saved as JSON in the side file cache/user.kind.diag.
+# With opt_DiagnosticsFooter, they are also appended to the report as a comment line.
+#
+# The environment variable PICO_PROFILE adds a profile of the rendering to the diagnostics:
+#	PICO_PROFILE=cprofile		the functions that took the most time; the full profile is saved
+#								in cache/user.kind.prof (read it with python3 -m pstats)
+#	PICO_PROFILE=tracemalloc	the peak memory used and the lines that allocated the most memory
+
+import os
+import io
+import json
+import time
+import LogDir
+from py.Config import Config
+
+TOP = 20			# Number of functions or lines in a profile
+
+# Render a report and save the diagnostics.
+#	a		the Analyser
+#	kind	name of the report, e.g. 'text'
+#	render	function that reads the logs and prints the report
+# Returns the diagnostics
+#
+def Run(a, kind, render):
+	mode = os.environ.get('PICO_PROFILE', '')
+	profile = None
+	t = time.perf_counter()
+	if mode == 'cprofile':
+		import cProfile			# The profilers are only imported when they're wanted
+		prof = cProfile.Profile()
+		prof.runcall(render)
+		profile = ProfileTop(prof, LogDir.CacheFileName(a.user + '.' + kind + '.prof'))
+	elif mode == 'tracemalloc':
+		import tracemalloc
+		tracemalloc.start()
+		render()
+		profile = MemoryTop(tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+	else:
+		render()
+	total = time.perf_counter() - t
+
+	diag = a.GetDiagnostics()
+	diag['kind'] = kind
+	diag['time'] = int(time.time())
+	diag['total'] = total
+	if profile != None:
+		diag['profile'] = profile
+	LogDir.SaveCache(a.user + '.' + kind + '.diag', diag)
+	return diag
+
+# Save a cProfile profile and get the functions that took the most time (not counting the functions they called)
+#
+def ProfileTop(prof, fname):
+	import pstats
+	prof.dump_stats(fname)
+	st = pstats.Stats(prof, stream=io.StringIO())
+	top = []
+	for (func, (cc, nc, tt, ct, callers)) in st.stats.items():
+		top.append({ 'function': '%s:%d(%s)' % func, 'calls': nc, 'tottime': tt, 'cumtime': ct })
+	top.sort(key=lambda x: x['tottime'], reverse=True)
+	return { 'mode': 'cprofile', 'file': fname, 'top': top[0:TOP] }
+
+# Get the peak memory and the lines that allocated the most memory that is still in use
+#
+def MemoryTop(snapshot, peak):
+	top = []
+	for st in snapshot.statistics('lineno')[0:TOP]:
+		frame = st.traceback[0]
+		top.append({ 'line': '%s:%d' % (frame.filename, frame.lineno), 'size': st.size, 'count': st.count })
+	return { 'mode': 'tracemalloc', 'peak': peak, 'top': top }
+
+# Get the diagnostics as a comment line to append to a report of the given content type
+#
+def Footer(diag, ctype):
+	text = json.dumps(diag, separators=(',', ':'))
+	if ctype == 'text/html':
+		return '<!-- diagnostics ' + text.replace('--', '- -') + ' -->\n'
+	return '# diagnostics ' + text + '\n'
+
+# Check whether the diagnostics should be appended to the reports
+#
+def WantFooter():
+	return getattr(Config, 'opt_DiagnosticsFooter', False)
@@ -47,3 +47,102 @@ class Config():
 	# Options
 	#
 	opt_UseMinMax = True
+
+	# Add tables of the mean, median and 95th percentile of the current values for each day and month
+	# to the report. The median and percentile are approximate (see Sketch in Analyse.py)
+	#
+	opt_ShowSpread = False
+
+	# Append the diagnostics of the analyser (the time spent in each phase, the counts of files, lines and
+	# rejected lines, and the problems found in the logs) to each report as a comment line. They are always
+	# saved in cache/user.kind.diag (see Diagnostics.py)
+	#
+	opt_DiagnosticsFooter = False
+
+	# User (station) whose logs are analysed for the report if the request doesn't give station=NAME
+	#
+	opt_ReportUser = 'dh'
+
+	# Layout of the log directory (see LogDir.py):
+	#	'flat'		all the files in the log directory
+	#	'user'		a subdirectory for each user
+	#	'month'		a subdirectory for each user and month
+	# After changing the layout, run ./LogDir.py to move the existing files
+	#
+	opt_LogLayout = 'flat'
+
+	# Lengths of the report windows, including the current hour, day and month
+	#
+	opt_Hours = 25
+	opt_Days = 8
+	opt_Months = 13
+
+	# Log writer options for the long-running ingest server (Ingest.py)
+	#	opt_FlushPolicy		'record'	- write each record immediately
+	#						'interval'	- buffer the records and write them every opt_FlushInterval milliseconds
+	#						'count'		- buffer the records and write them when opt_FlushCount are waiting
+	#	opt_Fsync			True to sync the file to disk after every write (slow, but survives a power cut)
+	#	opt_MaxOpenLogs		number of log files to keep open
+	#
+	opt_FlushPolicy = 'record'
+	opt_FlushInterval = 1000
+	opt_FlushCount = 100
+	opt_Fsync = False
+	opt_MaxOpenLogs = 64
+
+	# Options for the asyncio ingest server (AsyncIngest.py); opt_IngestTimeout is used by Ingest.py too
+	#	opt_IngestQueue		number of requests that can wait to be written; further requests get 503
+	#	opt_IngestRetry		seconds in the Retry-After header of a 503 response
+	#	opt_IngestTimeout	seconds allowed for a client to send a complete request (and for the TLS handshake)
+	#
+	opt_IngestQueue = 1000
+	opt_IngestRetry = 5
+	opt_IngestTimeout = 30
+
+	# Ingest journal (see Journal.py), e.g. 'journal.plj', or None to write the log files directly.
+	# With a journal, wlog.py appends the records to the journal and replies at once; run ./Journal.py
+	# to copy them to the log files every opt_JournalInterval seconds.
+	#	opt_JournalSize		size of the journal in bytes, allocated when it is created
+	#
+	opt_Journal = None
+	opt_JournalSize = 16*1024*1024
+	opt_JournalInterval = 5
+
+	# Write a binary day file (user-YYYYMMDD.pld) next to each text log file.
+	# The analyser reads the day file instead of the text file when the day file is up to date.
+	# Existing text logs can be converted using DayFile.py
+	#
+	opt_DayFiles = False
+
+	# Maintain the round-robin aggregate file (user.agg) at ingest time. The analyser reads the
+	# aggregate file instead of the logs. Rebuild it from the logs using Aggregate.py
+	#
+	opt_Aggregates = False
+
+	# Save a checkpoint (user.ckpt) after each report, so that the next report only has to read
+	# the data that has been added to the logs since then
+	#
+	opt_Checkpoint = False
+
+	# Engine for computing the statistics from the logs:
+	#	'python'	- the pure Python code
+	#	'numpy'		- vectorised using NumPy (see NumpyEngine.py); falls back to 'python' if NumPy isn't installed
+	# Not used with opt_Checkpoint or opt_Aggregates
+	#
+	opt_Engine = 'python'
+
+	# Number of worker processes for reading the logs. 1 reads them in the analyser's own process
+	#
+	opt_Workers = 1
+
+	# SQLite database for the readings (see SqlStore.py), e.g. 'readings.db', or None for no database.
+	# When set, every record is also written to the database and the analyser computes the statistics
+	# with queries on the database. Import existing logs with SqlStore.py
+	#
+	opt_Database = None
+
+	# Archiving of old logs (see Archive.py): logs older than opt_ArchiveDays days are compressed into
+	# monthly archives with opt_ArchiveCodec ('lzma' or 'zlib') when Archive.py is run
+	#
+	opt_ArchiveDays = 400
+	opt_ArchiveCodec = 'lzma'
@@ -23,73 +23,434 @@
 import os
 import sys
 import traceback
+import io
+import contextlib
+import functools
 from py.Config import Config
+import LogDir
 
-# Input is a string containing a compressed date or time, e.g. YYYYMMDD or hhmmss
-# Output is [YYYY, MM, DD] or [hh, mm, ss] (all as integers)
+# Get an optional configuration value.
+# Options that were added after the first release have defaults, so older Config.py files still work.
 #
-def DateTimeSplit(dt):
-	x = int(dt)
-	dt = [0, 0, 0]
-	dt[2] = x % 100
-	x = x // 100
-	dt[1] = x % 100
-	x = x // 100
-	dt[0] = x
-	return dt
+def GetOption(name, dflt):
+	return getattr(Config, name, dflt)
 
-# Print an error message
+# Append some text to a log file. The directory is created if necessary (see LogDir.Layout()).
+# If a LogWriter is given, it is used instead of opening and closing the file.
 #
+def AppendToLog(fname, text, writer=None):
+	if writer != None:
+		writer.Write(fname, text)
+		return
+	try:
+		fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+	except FileNotFoundError:
+		LogDir.MakeDir(fname)
+		fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+	try:
+		os.write(fd, text.encode())
+	finally:
+		os.close(fd)
+	return
+
+# Write the optional secondary stores (binary day file, aggregates, database) for a group of checked
+# records that have been written to the log file fname.
+# The records are flushed from the writer's buffer first: an aggregate file that has to be rebuilt is
+# rebuilt from the log files, and a day file is only used if the log file isn't newer.
+# The modules for the stores are only imported when they are enabled, so that a CGI request doesn't
+# pay for importing them
+#
+def WriteSecondary(fname, records, writer=None):
+	if not (GetOption('opt_DayFiles', False) or GetOption('opt_Aggregates', False) \
+			or GetOption('opt_Database', None) != None):
+		return
+	if writer != None:
+		writer.FlushFile(fname)
+	plist = [ rec.Params() for rec in records ]
+	if GetOption('opt_DayFiles', False):
+		import DayFile
+		DayFile.AppendParams(DayFile.DayFileName(fname), plist)
+	if GetOption('opt_Aggregates', False):
+		import Aggregate
+		Aggregate.UpdateFile(plist[0]['user'], plist)
+	if GetOption('opt_Database', None) != None:
+		import SqlStore
+		SqlStore.InsertParams(plist[0]['user'], plist)
+	return
+
+# Print an error message. The last message is kept for the analyser's diagnostics
+#
+lasterror = None
 def Error(str):
+	global lasterror
+	lasterror = str
 	print('Error:', str)
 	return False
 
+# ===
+# A checked record from a query string or a log line (see ParseRecord())
+#	date		the date (YYYYMMDD)
+#	time		the time (hhmmss)
+#	user		the user name, or None
+#	password	the password, or None
+#	fields		the other parameters, as 'key=value' strings in the order they came
+#	readings	the sensor values: (name, cur, min, max, more) for each field except from;
+#				cur, min and max are integers (None if absent or not a number), more is True
+#				if there were more than three values. Only filled if asked for (see ParseRecord())
+#
+class Record():
+	__slots__ = ( 'date', 'time', 'user', 'password', 'fields', 'readings' )
+
+	def __init__(self):
+		self.date = None
+		self.time = None
+		self.user = None
+		self.password = None
+		self.fields = []
+		self.readings = []
+		return
+
+	# Get the record as a dictionary of parameters, as returned by SplitQuery()
+	#
+	def Params(self):
+		params = { 'date': self.date, 'time': self.time }
+		for f in self.fields:
+			(key, eq, value) = f.partition('=')
+			params[key] = value
+		if self.user != None:
+			params['user'] = self.user
+		if self.password != None:
+			params['pass'] = self.password
+		return params
+
+	# Set some parameters from a dictionary, replacing any that are already there in the same place,
+	# as dict.update() would. Used for the common parameters of a batch; the readings aren't updated
+	#
+	def Update(self, params):
+		for key in params:
+			value = params[key]
+			if key == 'date':
+				self.date = value
+			elif key == 'time':
+				self.time = value
+			elif key == 'user':
+				self.user = value
+			elif key == 'pass':
+				self.password = value
+			else:
+				pair = key + '=' + value
+				names = [ f.partition('=')[0] for f in self.fields ]
+				if key in names:
+					self.fields[names.index(key)] = pair
+				else:
+					self.fields.append(pair)
+		return
+
+# Split the value of a sensor (cur,min,max) into integers.
+# Returns (cur, min, max, more); each value is None if it's absent or not a number,
+# and more is True if there are more than three values
+#
+def SplitValues(value):
+	vals = value.split(',')
+	mn = None
+	mx = None
+	try:
+		cur = int(vals[0])
+	except ValueError:
+		cur = None
+	if len(vals) > 1:
+		try:
+			mn = int(vals[1])
+		except ValueError:
+			pass
+		if len(vals) > 2:
+			try:
+				mx = int(vals[2])
+			except ValueError:
+				pass
+			return (cur, mn, mx, len(vals) > 3)
+	return (cur, mn, mx, False)
+
+# Check a date (YYYYMMDD). Returns None if the date is valid, otherwise the error message.
+# The loggers send the same date many times, so the results are cached
+#
+monthdays = [ 0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31 ]
+@functools.lru_cache(maxsize=1024)
+def CheckDate(d):
+	if len(d) != 8 or not d.isdigit():
+		return 'invalid date.'
+	y = int(d[0:4])
+	m = int(d[4:6])
+	if y < 2000:
+		return 'year not plausible.'
+	if m < 1 or m > 12:
+		return 'month not plausible.'
+	maxday = monthdays[m]
+	if m == 2 and ( (y % 4 == 0 and y % 100 != 0) or y % 400 == 0 ):
+		maxday = 29		# Leap year
+	if d[6:8] < '01' or int(d[6:8]) > maxday:
+		return 'day of month not plausible.'
+	return None
+
+# Check a time (hhmmss). Returns None if the time is valid, otherwise the error message.
+# A logger sends readings at the same times each day, so the results are cached too
+#
+@functools.lru_cache(maxsize=4096)
+def CheckTime(t):
+	if len(t) != 6 or not t.isdigit():
+		return 'invalid time.'
+	if t[0:2] > '23':
+		return 'hour not plausible.'
+	if t[2:4] > '59':
+		return 'minute not plausible.'
+	if t[4:6] > '59':
+		return 'second not plausible.'
+	return None
+
+# Parse a query string or a log line (key=value pairs separated by &) and check the date, the time
+# and optionally the user name and password, in one pass. The sensor values are converted to integers
+# (Record.readings) only if values is True; the ingest only needs the fields.
+# Returns a Record, or None if there's an error (the error is reported)
+#
+def ParseRecord(q, check_creds=True, values=False):
+	rec = Record()
+	fields = rec.fields
+	readings = rec.readings
+	for pair in q.split('&'):
+		(key, eq, value) = pair.partition('=')
+		if eq == '':
+			Error('parameter "' + pair + '" has no value.')
+			return None
+		if key == 'date':
+			rec.date = value
+		elif key == 'time':
+			rec.time = value
+		elif key == 'user':
+			rec.user = value
+		elif key == 'pass':
+			rec.password = value
+		else:
+			fields.append(pair)
+			if values and key != 'from':
+				readings.append((key,) + SplitValues(value))
+
+	if rec.date == None:
+		Error('date parameter not present.')
+		return None
+	err = CheckDate(rec.date)
+	if err != None:
+		Error(err)
+		return None
+	if rec.time == None:
+		Error('time parameter not present.')
+		return None
+	err = CheckTime(rec.time)
+	if err != None:
+		Error(err)
+		return None
+	if check_creds and not (rec.user in Config.passwords and Config.passwords[rec.user] == rec.password):
+		Error('username/password mismatch.')
+		return None
+	return rec
+
 # Report an error if any of the data is crap
 #
-maxdays = [ 29, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31 ]
 def SanityCheck(params, check_creds=True):
 	try:
-		v = params['date']
-	except:
+		d = params['date']
+	except KeyError:
 		return Error('date parameter not present.')
+	err = CheckDate(d)
+	if err != None:
+		return Error(err)
 
 	try:
-		ymd = DateTimeSplit(v)
-	except:
-		return Error('invalid date.')
-	if ymd[0] < 2000:
-		return Error('year not plausible.')
-	if ymd[1] < 1 or ymd[1] > 12:
-		return Error('month not plausible.')
-	maxindex = ymd[1]
-	if ( ((ymd[0] % 4) == 0) and ((ymd[0] % 100) != 0) ) or ((ymd[0] % 400) == 0):
-		maxindex = 0	# Divides by 4 but not by 100 ==> leap year
-	if ymd[2] < 1 or ymd[2] > maxdays[maxindex]:
-		return Error('day of month not plausible.')
-
-	try:
-		v = params['time']
-	except:
+		t = params['time']
+	except KeyError:
 		return Error('time parameter not present.')
+	err = CheckTime(t)
+	if err != None:
+		return Error(err)
+
+	if check_creds:
+		return CheckCredentials(params)
 
+	return True
+
+# Report an error if the username and password don't match
+#
+def CheckCredentials(params):
 	try:
-		ymd = DateTimeSplit(v)
+		u = params['user']
+		p = params['pass']
+		if Config.passwords[u] != p:
+			return Error('username/password mismatch.')
 	except:
-		return Error('invalid time.')
-	if ymd[0] < 0 or ymd[0] > 23:
-		return Error('hour not plausible.')
-	if ymd[1] < 0 or ymd[1] > 59:
-		return Error('minute not plausible.')
-	if ymd[2] < 0 or ymd[2] > 59:
-		return Error('second not plausible.')
+		return Error('username/password mismatch.')
+	return True
 
-	if check_creds:
+# Split a query string into a dictionary of key,value pairs
+# Returns None if any parameter has no value
+#
+def SplitQuery(q):
+	params = {}
+	for kv in q.split('&'):
+		k_v = kv.split('=', 1)	# Might be an = in the value (unlikely)
+		if len(k_v) != 2:
+			Error('parameter "'+kv+'" has no value.')
+			return None
+		params[k_v[0]] = k_v[1]
+	return params
+
+# Make the name of the log file and the line to write to it from a checked Record
+# The line contains all parameters except user and pass, with date and time at the beginning
+#
+def LogRecord(rec):
+	fname = LogDir.LogFileName(rec.user, rec.date)
+	line = 'date=' + rec.date + '&time=' + rec.time
+	if len(rec.fields) > 0:
+		line += '&' + '&'.join(rec.fields)
+	return (fname, line + '\n')
+
+# Parse the incoming query string and perform some simple sanity checks
+# Returns the Record, or None if the checks fail (the error is reported)
+#
+def ParseQuery(q):
+	if q.count('&') < 4:
+		Error('QUERY_STRING contains fewer than five parameters.')
+		return None
+	return ParseRecord(q)
+
+# Process the incoming query
+# If the checks are OK, write the querty string to the log file
+#
+def ProcessQuery(q, writer=None):
+	rec = ParseQuery(q)
+	if rec == None:
+		return False
+	WriteRecords([ rec ], writer)
+	return True
+
+# Check the length of a query string and then check the query.
+# Returns the Record, or None if the checks fail (the error and the query string are reported)
+#
+def CheckQuery(q):
+	if len(q) < len('date=20230916&time=222900&x=y'):	# Minimal log data
+		Error('QUERY_STRING too short')
+		return None
+
+	if len(q) > 1000:									# Should be enough for anyone ;-)
+		Error('QUERY_STRING too long')
+		return None
+
+	rec = ParseQuery(q)
+	if rec == None:
+		print('QUERY_STRING = ' + q)
+	return rec
+
+# Check a query string and log it.
+# Used by wlog.py and by the ingest server
+#
+def LogQuery(q, writer=None, journal=None):
+	rec = CheckQuery(q)
+	if rec == None:
+		return False
+	WriteRecords([ rec ], writer, journal)
+	return True
+
+# Write checked records to the log files and the secondary stores.
+# The records are grouped by log file and each group is appended with a single write.
+# If a journal is given, the records are appended to the journal instead, unless it is full (see Journal.py)
+#
+def WriteRecords(records, writer=None, journal=None):
+	if journal != None and journal.Append(records):
+		return
+	groups = {}			# Log file name --> lines
+	rgroups = {}		# Log file name --> records, for the secondary stores
+	for rec in records:
+		(fname, line) = LogRecord(rec)
 		try:
-			u = params['user']
-			p = params['pass']
-			if Config.passwords[u] != p:
-				return Error('username/password mismatch.')
-		except:
-			return Error('username/password mismatch.')
+			groups[fname].append(line)
+			rgroups[fname].append(rec)
+		except KeyError:
+			groups[fname] = [ line ]
+			rgroups[fname] = [ rec ]
+
+	for fname in groups:
+		AppendToLog(fname, ''.join(groups[fname]), writer)
+		WriteSecondary(fname, rgroups[fname], writer)
+	return
+
+# Check a batch of records, e.g. readings that a station stored during an outage.
+# The query string supplies the credentials and any parameters that are common to all the records
+# (e.g. from=pico). The body contains one record per line, each of the form date=...&time=...&T00=...
+#
+# Returns (results, records): results contains 'OK' or the error message for each record, in the
+# order of the body, and records contains the accepted records. Returns None if the whole batch is
+# rejected (the error is reported)
+#
+maxbatch = 1000000
+def CheckBatch(q, body):
+	if q == None or q == '':
+		Error('QUERY_STRING not set')
+		return None
 
+	if len(q) > 1000:
+		Error('QUERY_STRING too long')
+		return None
+
+	if len(body) > maxbatch:
+		Error('request body too long')
+		return None
+
+	common = SplitQuery(q)
+	if common == None:
+		return None
+	if not CheckCredentials(common):
+		return None
+
+	results = []
+	records = []
+	for line in body.splitlines():
+		line = line.strip()
+		if line == '':
+			continue
+		buf = io.StringIO()
+		with contextlib.redirect_stdout(buf):		# Capture the error message, if any
+			rec = None
+			if len(line) > 1000:
+				Error('record too long')
+			else:
+				rec = ParseRecord(line, False)
+			if rec != None:
+				rec.Update(common)
+				if ('date' in common or 'time' in common) and not SanityCheck({ 'date': rec.date, 'time': rec.time }, False):
+					rec = None
+		if rec == None:
+			results.append(buf.getvalue().strip())
+			continue
+		records.append(rec)
+		results.append('OK')
+
+	return (results, records)
+
+# Print the results of a batch: one line per record, the record number (starting at 1) and either OK
+# or the error message. The client can discard exactly the records that were logged.
+#
+def PrintResults(results):
+	n = 1
+	for r in results:
+		print('%d %s' % (n, r))
+		n += 1
+	return
+
+# Check a batch, log the accepted records and print the results
+#
+def LogBatch(q, body, writer=None, journal=None):
+	checked = CheckBatch(q, body)
+	if checked == None:
+		return False
+	(results, records) = checked
+	WriteRecords(records, writer, journal)
+	PrintResults(results)
 	return True
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# This is a long-running alternative to wlog.py. The configuration is loaded once
+# and every upload is handled inside the same process, so there's no interpreter
+# startup per request.
+#
+# The responses are the same as those of wlog.py: OK if the data was logged,
+# Error: ... if not.
+#
+# Usage:
+#	./Ingest.py [--bind ADDRESS] [--port PORT] [--dir LOGDIR]
+#
+# Alternatively, Application can be given to any WSGI server.
+
+import os
+import sys
+import io
+import contextlib
+import traceback
+import argparse
+import atexit
+import signal
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from Helpers import *
+from LogWriter import LogWriter
+
+writer = None
+lock = threading.Lock()		# Serialises the requests and the writes (stdout is captured per request)
+
+# Get the log writer, creating it from the configuration when first used
+#
+def GetWriter():
+	global writer
+	if writer == None:
+		writer = LogWriter(GetOption('opt_FlushPolicy', 'record'),
+							GetOption('opt_FlushInterval', 1000),
+							GetOption('opt_FlushCount', 100),
+							GetOption('opt_Fsync', False),
+							GetOption('opt_MaxOpenLogs', 64))
+		atexit.register(writer.Close)
+	return writer
+
+# Handle a single request and return the text of the response.
+# body is None for a GET request (a single record in the query string) or the
+# body of a POST request (a batch of records).
+# The response is exactly what wlog.py prints after the headers.
+# The Helpers functions report errors using print(), so stdout is captured. The capture replaces sys.stdout
+# for the whole process, so only one request is handled at a time.
+#
+def HandleQuery(q, body=None):
+	buf = io.StringIO()
+	with lock, contextlib.redirect_stdout(buf):
+		try:
+			w = GetWriter()
+			if body != None:
+				ok = LogBatch(q, body, w)
+			elif q == None:
+				ok = Error('QUERY_STRING not set')
+			else:
+				ok = LogQuery(q, w)
+			if ok:
+				print('OK')
+		except Exception as e:
+			print('Sorry; an exception occurred.')
+			print('QUERY_STRING', q)
+			fexc = traceback.format_exception(e)
+			for l in fexc:
+				print(l.rstrip())
+			print('')
+	return buf.getvalue()
+
+# WSGI entry point
+#
+def Application(environ, start_response):
+	if environ.get('REQUEST_METHOD') == 'POST':
+		body = ReadBody(environ['wsgi.input'], environ.get('CONTENT_LENGTH'))
+		if body == None:
+			text = 'Error: request body too long\n'
+		else:
+			text = HandleQuery(environ.get('QUERY_STRING'), body)
+	else:
+		text = HandleQuery(environ.get('QUERY_STRING'))
+	reply = text.encode()
+	headers = [ ('Content-Type', 'text/plain'), ('Content-Length', str(len(reply))) ]
+	start_response('200 OK', headers)
+	return [reply]
+
+# Read the body of a POST request
+# Returns an empty string if there's no body and None if it's too long
+#
+def ReadBody(f, length):
+	try:
+		n = int(length)
+	except:
+		return ''
+	if n > maxbatch:
+		return None
+	return f.read(n).decode(errors='replace')
+
+# ===
+# Request handler for the standalone server
+#
+# HTTP/1.1 keeps the connection open between requests from a client (e.g. a proxy),
+# and Nagle is disabled so that the separately-written headers and body don't wait
+# for a delayed ACK. Each connection has its own thread, so an idle connection doesn't
+# hold up the other stations; it is closed after opt_IngestTimeout seconds.
+#
+class IngestHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True
+	timeout = GetOption('opt_IngestTimeout', 30)
+
+	def do_GET(self):
+		q = urlsplit(self.path).query
+		self.Reply(HandleQuery(q))
+		return
+
+	def do_POST(self):
+		q = urlsplit(self.path).query
+		body = ReadBody(self.rfile, self.headers.get('Content-Length'))
+		if body == None:
+			self.close_connection = True		# Unread body is still in the stream
+			self.Reply('Error: request body too long\n')
+		else:
+			self.Reply(HandleQuery(q, body))
+		return
+
+	# Send a text/plain response
+	#
+	def Reply(self, text, status=200):
+		body = text.encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'text/plain')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+		return
+
+	# Logging every request would cost more than handling it
+	#
+	def log_message(self, format, *args):
+		return
+
+# ===
+# The standalone server. Buffered records are written by the main thread while it waits for connections
+#
+class IngestServer(ThreadingHTTPServer):
+	def service_actions(self):
+		with lock:
+			GetWriter().Poll()
+		return
+
+# SIGTERM handler: stop the server the same way as ctrl-C, so that buffered records get written
+#
+def Terminate(signum, frame):
+	raise KeyboardInterrupt
+
+# Run the standalone server
+#
+def Main():
+	parser = argparse.ArgumentParser(description='pico-logger ingest server')
+	parser.add_argument('--bind', default='127.0.0.1', help='address to listen on')
+	parser.add_argument('--port', type=int, default=8081, help='port to listen on')
+	parser.add_argument('--dir', default=None, help='directory for the log files')
+	args = parser.parse_args()
+
+	if args.dir != None:
+		os.chdir(args.dir)
+
+	w = GetWriter()
+	server = IngestServer((args.bind, args.port), IngestHandler)
+	print('Listening on %s:%d' % (args.bind, args.port))
+	signal.signal(signal.SIGTERM, Terminate)
+	try:
+		server.serve_forever(min(w.interval, 0.5))
+	except KeyboardInterrupt:
+		pass
+	server.server_close()
+	with lock:
+		w.Close()
+	return
+
+if __name__ == '__main__':
+	Main()
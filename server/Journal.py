@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Ingest journal: deferred writing of the log files (opt_Journal).
+#
+# With a journal, wlog.py appends the checked records to a single preallocated file and replies at once,
+# instead of opening and writing the user's log file, day file, aggregate file and database. The compactor
+# (run this file) copies the records from the journal to the log files and the other stores, then marks
+# them as done. When all the records have been copied, the journal is emptied and used again from the start.
+#
+# Layout:
+#	Header		magic b'PLJ1', start (uint64), end (uint64)
+#	Records		start..end are the records that haven't been copied yet, one per line, in the form
+#				user=...&date=...&time=...&... (the password isn't stored)
+# The file is allocated at its full size (opt_JournalSize) when it is created, so an append doesn't have to
+# allocate disk space or change the size of the file. The writers and the compactor lock the file while they
+# read or change the header. If the journal is full, wlog.py writes the log files directly.
+#
+# The compactor copies the records before it advances the start, so a record is never lost. If it is killed
+# between the two steps, the records are copied again at the next run (they appear twice in the logs).
+#
+# The analyser reads only the log files, so a record appears in the reports after it has been copied.
+#
+# Usage:
+#	./Journal.py [--once] [--interval SECONDS] [--dir LOGDIR]
+#		copies the records every opt_JournalInterval seconds until it gets SIGTERM or SIGINT
+
+import os
+import sys
+import fcntl
+import struct
+import signal
+import argparse
+from Helpers import *
+from LogWriter import LogWriter
+
+MAGIC = b'PLJ1'
+HEADER = struct.Struct('<4sQQ')
+HEADER_SIZE = 512			# The records start after the header block
+
+journal = None				# The journal of this process (see Open())
+
+# Get the journal, or None if there is no journal (opt_Journal = None).
+# There is one Journal object per process, which keeps the file open after the first Append().
+# wlog.py runs once per request, so it opens the file once per request: that is a single open()
+# of the existing file, much less than opening the log file and the secondary stores
+#
+def Open():
+	global journal
+	name = GetOption('opt_Journal', None)
+	if name == None:
+		return None
+	if journal == None:
+		journal = Journal(name, GetOption('opt_JournalSize', 16*1024*1024), GetOption('opt_Fsync', False))
+	return journal
+
+# Make the journal line for a checked record
+#
+def JournalLine(rec):
+	line = 'user=' + rec.user + '&date=' + rec.date + '&time=' + rec.time
+	if len(rec.fields) > 0:
+		line += '&' + '&'.join(rec.fields)
+	return line + '\n'
+
+# ===
+# The journal file
+#
+class Journal():
+	def __init__(self, fname, size, fsync=False):
+		self.fname = fname
+		self.size = size
+		self.fsync = fsync
+		self.fd = None
+		return
+
+	# Open the journal file, creating and allocating it if necessary
+	#
+	def OpenFile(self):
+		if self.fd != None:
+			return self.fd
+		fd = os.open(self.fname, os.O_RDWR | os.O_CREAT, 0o666)
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		try:
+			if os.fstat(fd).st_size < HEADER_SIZE or os.pread(fd, 4, 0) != MAGIC:
+				os.posix_fallocate(fd, 0, max(self.size, HEADER_SIZE * 2))
+				os.pwrite(fd, HEADER.pack(MAGIC, HEADER_SIZE, HEADER_SIZE), 0)
+				os.fsync(fd)
+		finally:
+			fcntl.flock(fd, fcntl.LOCK_UN)
+		self.fd = fd
+		return fd
+
+	def Close(self):
+		if self.fd != None:
+			os.close(self.fd)
+			self.fd = None
+		return
+
+	# Read the header. The file must be locked. Returns (start, end)
+	#
+	def ReadHeader(self):
+		(magic, start, end) = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+		if magic != MAGIC:
+			raise ValueError(self.fname + ' is not a journal')
+		return (start, end)
+
+	# Write the header. The file must be locked
+	#
+	def WriteHeader(self, start, end):
+		os.pwrite(self.fd, HEADER.pack(MAGIC, start, end), 0)
+		return
+
+	# Append checked records to the journal.
+	# Returns False if they don't fit (the caller must write them directly)
+	#
+	def Append(self, records):
+		data = ''.join([ JournalLine(rec) for rec in records ]).encode()
+		fd = self.OpenFile()
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		try:
+			(start, end) = self.ReadHeader()
+			if end + len(data) > os.fstat(fd).st_size:
+				return False
+			os.pwrite(fd, data, end)
+			if self.fsync:
+				os.fdatasync(fd)		# The records must be on disk before the header that includes them
+			self.WriteHeader(start, end + len(data))
+			if self.fsync:
+				os.fdatasync(fd)
+		finally:
+			fcntl.flock(fd, fcntl.LOCK_UN)
+		return True
+
+	# Copy the records in the journal to the log files and the other stores, then remove them from the journal.
+	# Only one compactor can run at a time (the lock file is journal.lock). Returns the number of records copied
+	#
+	def Compact(self):
+		lockfd = os.open(self.fname + '.lock', os.O_RDWR | os.O_CREAT, 0o666)
+		try:
+			fcntl.flock(lockfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			os.close(lockfd)
+			return 0
+		try:
+			return self.CompactLocked()
+		finally:
+			os.close(lockfd)
+
+	def CompactLocked(self):
+		fd = self.OpenFile()
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		try:
+			(start, end) = self.ReadHeader()
+		finally:
+			fcntl.flock(fd, fcntl.LOCK_UN)
+		if start == end:
+			return 0
+
+		data = os.pread(fd, end - start, start)
+		records = []
+		for line in data.decode(errors='replace').splitlines():
+			rec = ParseRecord(line, False)
+			if rec == None or rec.user == None:
+				print('Journal record ignored: ' + line.replace('\0', ''))
+				continue
+			records.append(rec)
+
+		writer = LogWriter('record', fsync=self.fsync, maxopen=GetOption('opt_MaxOpenLogs', 64))
+		try:
+			WriteRecords(records, writer)
+		finally:
+			writer.Close()
+
+		# Remove the records from the journal. The records that were added meanwhile are moved to the
+		# start if there's room, so that the journal is used again from the start
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		try:
+			(s, e) = self.ReadHeader()
+			rest = e - end
+			if rest <= end - HEADER_SIZE:
+				if rest > 0:
+					os.pwrite(fd, os.pread(fd, rest, end), HEADER_SIZE)
+					if self.fsync:
+						os.fdatasync(fd)
+				self.WriteHeader(HEADER_SIZE, HEADER_SIZE + rest)
+			else:
+				self.WriteHeader(end, e)
+			if self.fsync:
+				os.fdatasync(fd)
+		finally:
+			fcntl.flock(fd, fcntl.LOCK_UN)
+		return len(records)
+
+# Run the compactor
+#
+def Main():
+	parser = argparse.ArgumentParser(description='Copy the pico-logger ingest journal to the log files')
+	parser.add_argument('--once', action='store_true', help='copy the records once and exit')
+	parser.add_argument('--interval', type=float, default=GetOption('opt_JournalInterval', 5),
+						help='seconds between copies')
+	parser.add_argument('--dir', default=None, help='log directory')
+	args = parser.parse_args()
+	if args.dir != None:
+		os.chdir(args.dir)
+
+	journal = Open()
+	if journal == None:
+		print('No journal: opt_Journal is not set in Config.py')
+		exit(1)
+
+	# SIGTERM and SIGINT are only received while waiting, so a copy is never interrupted
+	signals = [ signal.SIGTERM, signal.SIGINT ]
+	signal.pthread_sigmask(signal.SIG_BLOCK, signals)
+	while True:
+		journal.Compact()
+		sys.stdout.flush()
+		if args.once:
+			break
+		if signal.sigtimedwait(signals, args.interval) != None:
+			journal.Compact()		# The records that arrived while waiting
+			break
+	journal.Close()
+	return
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,320 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Finding the log files for a user.
+#
+# The log files are called user-YYYYMMDD.log. Where they are stored depends on opt_LogLayout:
+#	'flat'		all the files in the log directory (the default)
+#	'user'		a subdirectory for each user: user/user-YYYYMMDD.log
+#	'month'		a subdirectory for each user and month: user/YYYYMM/user-YYYYMMDD.log
+# The day files, archives and aggregate file of a user are stored in the same subdirectories.
+# Run ./LogDir.py to move existing files into the layout that is configured.
+#
+# Scanning a directory that contains years of logs for many users takes a long time, so the list of
+# a user's files is cached in cache/user.dir. The cached list of a directory is used as long as the
+# modification time of the directory is unchanged. (Appending to a file doesn't change the directory;
+# creating or deleting a file does.) With the 'month' layout, only the directory of the current month
+# normally changes, so the other months are never scanned again.
+#
+# The cache files (and the analyser's checkpoints) are kept in a subdirectory so that writing
+# them doesn't change the modification time of the log directory.
+#
+# Old logs can be compressed into monthly archives (see Archive.py). The days in a user's archives are
+# listed as if the log files were still there, and OpenLog() returns their content from the archive.
+# Archive (and lzma) is only imported by the functions that read the logs; the ingest only needs the
+# names of the files.
+
+import os
+import io
+import sys
+import json
+import time
+from py.Config import Config
+
+CACHEDIR = 'cache'
+LAYOUTS = [ 'flat', 'user', 'month' ]
+
+# Get the layout of the log directory
+#
+def Layout():
+	return getattr(Config, 'opt_LogLayout', 'flat')
+
+# Get the directory that holds the files of a user (or the month subdirectories)
+#
+def UserDir(user):
+	if Layout() == 'flat':
+		return '.'
+	return user
+
+# Get the name of the log file for a user and day (YYYYMMDD), relative to the log directory
+#
+def LogFileName(user, d):
+	fname = user + '-' + d + '.log'
+	layout = Layout()
+	if layout == 'user':
+		return os.path.join(user, fname)
+	if layout == 'month':
+		return os.path.join(user, d[0:6], fname)
+	return fname
+
+# Get the name of a file of a user that isn't for a particular day (e.g. the aggregate file)
+#
+def UserFileName(user, name):
+	if Layout() == 'flat':
+		return name
+	return os.path.join(user, name)
+
+# Create the directory for a file, if necessary
+#
+def MakeDir(fname):
+	dname = os.path.dirname(fname)
+	if dname != '':
+		os.makedirs(dname, exist_ok=True)
+	return
+
+# Get the path of a file in the cache directory, creating the directory if necessary
+#
+def CacheFileName(name):
+	if not os.path.isdir(CACHEDIR):
+		try:
+			os.mkdir(CACHEDIR)
+		except FileExistsError:
+			pass
+	return os.path.join(CACHEDIR, name)
+
+# Save some data in the cache directory. It's written to a temporary file and renamed,
+# so that a concurrent reader never sees a partial file
+#
+def SaveCache(name, data):
+	try:
+		cname = CacheFileName(name)
+		tmpname = cname + '.%d' % os.getpid()
+		f = open(tmpname, 'w')
+		json.dump(data, f)
+		f.close()
+		os.replace(tmpname, cname)
+	except OSError:
+		pass		# No cache next time; not fatal
+	return
+
+# Load some data from the cache directory. Returns None if there isn't any
+#
+def LoadCache(name):
+	try:
+		f = open(os.path.join(CACHEDIR, name), 'r')
+		data = json.load(f)
+		f.close()
+	except (OSError, ValueError):
+		return None
+	return data
+
+# Get the date (YYYYMMDD) from the name of a log file, or None if it isn't a log file for the user
+#
+def LogDate(fname, user):
+	if len(fname) != len(user) + len('-YYYYMMDD.log'):
+		return None
+	if not fname.startswith(user + '-') or not fname.endswith('.log'):
+		return None
+	d = fname[-12:-4]
+	if not d.isdigit():
+		return None
+	return d
+
+# Scan a directory for the files of a user.
+# Returns (log files, archives, month subdirectories), with the directory in the names
+#
+def ScanDir(dname, user):
+	logs = []
+	archives = []
+	months = []
+	try:
+		dir_obj = os.scandir(dname)
+	except FileNotFoundError:
+		return (logs, archives, months)
+	for dir_ent in dir_obj:
+		name = dir_ent.name
+		if LogDate(name, user) != None and dir_ent.is_file():
+			logs.append(name)
+		elif len(name) == len(user) + 11 and name.startswith(user + '-') and name.endswith('.pla'):
+			archives.append(name)
+		elif len(name) == 6 and name.isdigit() and dir_ent.is_dir():
+			months.append(name)
+	dir_obj.close()
+	if dname != '.':
+		logs = [ os.path.join(dname, name) for name in logs ]
+		archives = [ os.path.join(dname, name) for name in archives ]
+		months = [ os.path.join(dname, name) for name in months ]
+	return (logs, archives, months)
+
+# Get the log files (including the archived days) in a directory, using the cached list if the
+# directory hasn't changed. The month subdirectories are included if the layout is 'month'.
+#	cache		the cached lists: directory --> [ mtime, files, subdirectories ]
+#	newcache	the lists that can be saved are added to this
+#
+def DirLogs(dname, user, cache, newcache):
+	try:
+		mtime = os.stat(dname).st_mtime_ns
+	except FileNotFoundError:
+		return []
+	entry = cache.get(dname)
+	if entry == None or entry[0] != mtime:
+		(flist, archives, months) = ScanDir(dname, user)
+
+		# Add the days in the archives
+		if len(archives) > 0:
+			import Archive
+		for aname in archives:
+			archived = Archive.ReadIndex(aname)
+			if archived != None:
+				adir = os.path.dirname(aname)
+				flist += [ os.path.join(adir, user + '-' + d + '.log') for d in archived[1]['days'] ]
+		entry = [ mtime, sorted(set(flist)), sorted(months) ]
+
+	# If the directory changed very recently, another file might appear within the
+	# resolution of the timestamp, so don't save the list
+	if time.time_ns() - mtime > 2000000000:
+		newcache[dname] = entry
+
+	flist = entry[1]
+	if Layout() == 'month':
+		for mdir in entry[2]:
+			flist = flist + DirLogs(mdir, user, cache, newcache)
+	return flist
+
+# Get a sorted list of all the log files for a user, using the cache if it is up to date
+#
+def ListLogs(user):
+	cname = user + '.dir'
+	cache = LoadCache(cname)
+	if type(cache) != dict or cache.get('layout') != Layout() or type(cache.get('dirs')) != dict:
+		cache = { 'dirs': {} }
+	newcache = {}
+	flist = sorted(DirLogs(UserDir(user), user, cache['dirs'], newcache), key=lambda f: f[-12:-4])
+	if newcache != cache['dirs']:
+		SaveCache(cname, { 'layout': Layout(), 'dirs': newcache })
+	return flist
+
+# Get a sorted list of the log files for a user with dates in the range first..last (YYYYMMDD, inclusive)
+#
+def LogsInRange(user, first, last):
+	flist = []
+	for fname in ListLogs(user):
+		d = fname[-12:-4]
+		if d >= first and d <= last:
+			flist.append(fname)
+	return flist
+
+# Open a log file for reading (binary). If the day is in an archive, the archived content is returned,
+# followed by the content of the log file if there is one (records that arrived after the day was archived).
+# first and last (seconds since midnight) limit the archived blocks that are read to those that contain
+# times in the range first <= time < last; the result can contain other lines too.
+#
+def OpenLog(fname, first=None, last=None):
+	import Archive
+	aname = Archive.ArchiveName(fname)
+	archived = Archive.ReadIndex(aname)
+	d = fname[-12:-4]
+	if archived == None or d not in archived[1]['days']:
+		return open(fname, 'rb')
+
+	(codec, index) = archived
+	data = Archive.ReadDay(aname, codec, index, d, first, last)
+	try:
+		f = open(fname, 'rb')
+		if not Archive.IsArchived(index, d, os.fstat(f.fileno())):
+			data += f.read()
+		f.close()
+	except FileNotFoundError:
+		pass
+	return io.BytesIO(data)
+
+# Get the size and modification time of a log file, or of its archive if the day has been archived.
+# Returns None if neither exists
+#
+def StatLog(fname):
+	import Archive
+	for name in [ fname, Archive.ArchiveName(fname) ]:
+		try:
+			return os.stat(name)
+		except OSError:
+			pass
+	return None
+
+# Get the name that a file of a user should have in the configured layout.
+# Returns None if it isn't a log file, day file, archive or aggregate file of the user
+#
+def LayoutName(name, user):
+	if name == user + '.agg':
+		return UserFileName(user, name)
+	if name.endswith('.pld'):
+		d = LogDate(name[:-4] + '.log', user)
+		if d != None:
+			return LogFileName(user, d)[:-4] + '.pld'
+		return None
+	if name.endswith('.pla'):
+		m = name[len(user)+1:-4]
+		if len(name) == len(user) + 11 and name.startswith(user + '-') and m.isdigit():
+			return os.path.join(os.path.dirname(LogFileName(user, m + '01')), name)
+		return None
+	d = LogDate(name, user)
+	if d != None:
+		return LogFileName(user, d)
+	return None
+
+# Move the files of a user into the configured layout. Returns the number of files moved
+#
+def Migrate(user):
+	dirs = [ '.' ]
+	if os.path.isdir(user):
+		dirs.append(user)
+		dirs += ScanDir(user, user)[2]
+	moved = 0
+	for dname in dirs:
+		dir_obj = os.scandir(dname)
+		names = [ dir_ent.name for dir_ent in dir_obj if dir_ent.is_file() ]
+		dir_obj.close()
+		for name in names:
+			target = LayoutName(name, user)
+			src = name if dname == '.' else os.path.join(dname, name)
+			if target == None or target == src:
+				continue
+			if os.path.exists(target):
+				print('%s: not moved because %s exists' % (src, target))
+				continue
+			MakeDir(target)
+			os.rename(src, target)
+			moved += 1
+	for dname in reversed(dirs[1:]):
+		try:
+			os.rmdir(dname)			# Only if empty
+		except OSError:
+			pass
+	return moved
+
+# Move the files of the users (default: all the users in Config.passwords) into the configured layout
+#
+if __name__ == '__main__':
+	if Layout() not in LAYOUTS:
+		print('Unknown layout "%s"' % Layout())
+		exit(1)
+	users = sys.argv[1:]
+	if len(users) == 0:
+		users = sorted(Config.passwords)
+	for user in users:
+		print('%s: %d files moved to the %s layout' % (user, Migrate(user), Layout()))
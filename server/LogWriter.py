@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Buffered writer for the log files, for use in a long-running process such as Ingest.py
+#
+# The most recently used log files are kept open. Files for earlier days are closed when the
+# (UTC) day changes.
+#
+# Every file is opened with O_APPEND and each block of text is written with a single write(),
+# so several processes can append to the same file without mixing up their lines.
+#
+# Flush policies:
+#	'record'	- every record is written immediately
+#	'interval'	- records are buffered and written every <interval> milliseconds
+#	'count'		- records are buffered and written when <count> records are waiting
+# If fsync is True, the file is synced to disk after each write.
+#
+# With the buffered policies, a record that has been acknowledged with OK might be lost if the
+# process dies before the next flush.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+import LogDir
+
+class LogWriter():
+	def __init__(self, policy='record', interval=1000, count=100, fsync=False, maxopen=64):
+		if policy not in [ 'record', 'interval', 'count' ]:
+			raise ValueError('Unknown flush policy "' + policy + '"')
+		self.policy = policy
+		self.interval = interval / 1000.0
+		self.count = count
+		self.fsync = fsync
+		self.maxopen = maxopen
+		self.handles = OrderedDict()	# File name --> file descriptor, least recently used first
+		self.pending = {}				# File name --> list of buffered lines
+		self.npending = 0
+		self.lastflush = time.monotonic()
+		self.today = None
+		self.lock = threading.Lock()
+		return
+
+	# Write some text (one or more complete lines) to a log file, according to the policy
+	#
+	def Write(self, fname, text):
+		with self.lock:
+			if self.policy == 'record':
+				self.WriteFile(fname, text)
+				return
+
+			try:
+				self.pending[fname].append(text)
+			except KeyError:
+				self.pending[fname] = [ text ]
+			self.npending += text.count('\n')
+
+			if self.policy == 'count':
+				if self.npending >= self.count:
+					self.FlushPending()
+			elif time.monotonic() - self.lastflush >= self.interval:
+				self.FlushPending()
+		return
+
+	# Call this regularly (e.g. from the server loop) so that buffered records get written
+	# when no new records are arriving, and so that old files get closed
+	#
+	def Poll(self):
+		with self.lock:
+			if self.npending > 0 and self.policy == 'interval':
+				if time.monotonic() - self.lastflush >= self.interval:
+					self.FlushPending()
+			self.CheckDay()
+		return
+
+	# Write all buffered records
+	#
+	def Flush(self):
+		with self.lock:
+			self.FlushPending()
+		return
+
+	# Write the buffered records for one file
+	#
+	def FlushFile(self, fname):
+		with self.lock:
+			try:
+				text = ''.join(self.pending.pop(fname))
+			except KeyError:
+				return
+			self.npending -= text.count('\n')
+			self.WriteFile(fname, text)
+		return
+
+	# Write all buffered records and close all the files
+	#
+	def Close(self):
+		with self.lock:
+			self.FlushPending()
+			for fname in self.handles:
+				os.close(self.handles[fname])
+			self.handles.clear()
+		return
+
+	# Write the buffered records; one write per file. Caller holds the lock
+	#
+	def FlushPending(self):
+		pending = self.pending
+		self.pending = {}
+		self.npending = 0
+		self.lastflush = time.monotonic()
+		for fname in pending:
+			self.WriteFile(fname, ''.join(pending[fname]))
+		return
+
+	# Append a block of text to a file using a single write
+	#
+	def WriteFile(self, fname, text):
+		fd = self.Open(fname)
+		data = text.encode()
+		n = os.write(fd, data)
+		while n < len(data):			# Only if the disk is full or similar
+			data = data[n:]
+			n = os.write(fd, data)
+		if self.fsync:
+			os.fsync(fd)
+		return
+
+	# Get the descriptor of an open log file, opening it if necessary.
+	# If too many files are open, the least recently used file is closed.
+	#
+	def Open(self, fname):
+		self.CheckDay()
+		try:
+			fd = self.handles[fname]
+			self.handles.move_to_end(fname)
+			return fd
+		except KeyError:
+			pass
+		if len(self.handles) >= self.maxopen:
+			(old, oldfd) = self.handles.popitem(last=False)
+			os.close(oldfd)
+		try:
+			fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+		except FileNotFoundError:
+			LogDir.MakeDir(fname)		# First log in a new user or month directory
+			fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+		self.handles[fname] = fd
+		return fd
+
+	# When the day changes, close the files for all other days.
+	# The files are named user-YYYYMMDD.log
+	#
+	def CheckDay(self):
+		gmt = time.gmtime()
+		today = '%04d%02d%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday)
+		if today == self.today:
+			return
+		self.today = today
+		for fname in list(self.handles):
+			if os.path.basename(fname)[-12:-4] != today:
+				os.close(self.handles.pop(fname))
+		return
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Vectorised aggregation using NumPy (optional; opt_Engine = 'numpy').
+#
+# The readings for each day are loaded into arrays: seconds since midnight, sensor number and the
+# current, min and max values. The arrays for all days are joined and, for each window, the readings
+# are sorted by (bucket, sensor) and reduced with numpy.minimum.reduceat() etc.
+#
+# If NumPy isn't installed, Available() returns False and the analyser uses the pure Python code.
+# NumPy is imported by the first call of Available(): importing it takes longer than serving a cached
+# report, so the reports that don't use it shouldn't pay for it.
+
+import re
+import DayFile
+import LogDir
+
+numpy = None
+imported = False
+
+NOVALUE = -2147483648		# Missing value in the arrays
+BIG = 2147483647
+
+# Is NumPy available? Imports it the first time
+#
+def Available():
+	global numpy, imported
+	if not imported:
+		imported = True
+		try:
+			import numpy
+		except ImportError:
+			numpy = None
+	return numpy != None
+
+# Convert a list of value strings to an array of integers.
+# Empty strings, strings that aren't valid integers and values that don't fit become NOVALUE.
+#
+def ToInts(strs):
+	try:
+		v = numpy.array([ int(x) if x else NOVALUE for x in strs ], dtype=numpy.int64)
+	except (ValueError, OverflowError):
+		v = numpy.array([ StrToInt(x) for x in strs ], dtype=numpy.int64)
+	v[(v < NOVALUE) | (v > BIG)] = NOVALUE
+	return v.astype(numpy.int32)
+
+def StrToInt(valstr):
+	try:
+		v = int(valstr)
+	except:
+		return NOVALUE
+	if v <= NOVALUE or v > BIG:
+		return NOVALUE
+	return v
+
+# Regular expressions for LoadLog()
+#
+LINE = re.compile('^date=([0-9]{8})&time=((?:[01][0-9]|2[0-3])[0-5][0-9][0-5][0-9])&', re.M)
+VALUES = '([^,&\n]*)(?:,([^,&\n]*))?(?:,([^,&\n]*))?(,?)'
+patterns = {}
+
+# Get the regular expression that finds the date, time and values of a sensor in the lines of a log
+#
+def SensorPattern(name):
+	try:
+		return patterns[name]
+	except KeyError:
+		pass
+	pat = re.compile(LINE.pattern + '(?:[^\n]*?&)?' + re.escape(name) + '=' + VALUES, re.M)
+	patterns[name] = pat
+	return pat
+
+# Load the readings from a text log for the day d (YYYYMMDD).
+# index maps the names of the sensors to their numbers; other sensors are ignored.
+# Lines that aren't in the expected form are passed to bad().
+# If counters (see Analyse.COUNTERS) is given, the bytes, lines and readings of unknown sensors are added to it.
+#
+# The lines aren't split in Python: for each sensor, a regular expression finds the time and the
+# values in all the lines at once, and the strings are converted to integers by ToInts().
+# Returns (secs, sensor, cur, min, max) as NumPy arrays
+#
+def LoadLog(fname, d, index, bad, counters=None):
+	f = LogDir.OpenLog(fname)
+	data = f.read()
+	f.close()
+	end = data.rfind(b'\n') + 1
+	text = data[0:end].decode(errors='replace')
+
+	dates = LINE.findall(text)
+	nlines = text.count('\n')
+	baddate = False
+	for (ld, t) in dates:
+		if ld != d:
+			baddate = True
+			break
+	if baddate or len(dates) != nlines:
+		for line in text.splitlines():
+			m = LINE.match(line)
+			if m == None or m.group(1) != d:
+				bad(line.strip())
+
+	columns = [ [], [], [], [], [] ]
+	nfound = 0
+	for name in index:
+		found = SensorPattern(name).findall(text)
+		if baddate:
+			found = [ x for x in found if x[0] == d ]
+		nfound += len(found)
+		if len(found) == 0:
+			continue
+		(ld, t, cur, mn, mx, more) = zip(*found)
+		if ',' in more:
+			for m in more:
+				if m != '':
+					print('More than three values; remainder ignored')
+					if counters != None:
+						counters['extra_values'] += 1
+		t = numpy.array([ int(x) for x in t ], dtype=numpy.int32)
+		columns[0].append((t // 10000) * 3600 + ((t // 100) % 100) * 60 + t % 100)
+		columns[1].append(numpy.full(len(t), index[name], dtype=numpy.int32))
+		columns[2].append(ToInts(cur))
+		columns[3].append(ToInts(mn))
+		columns[4].append(ToInts(mx))
+
+	if counters != None:
+		counters['bytes'] += end
+		counters['lines'] += nlines
+		if len(dates) == nlines and not baddate:
+			# The pairs that aren't date, time, from or a known sensor (bad lines are counted by bad())
+			counters['unknown_sensors'] += text.count('&') - nlines - text.count('&from=') - nfound
+
+	if len(columns[0]) == 0:
+		return tuple([ numpy.zeros(0, dtype=numpy.int32) ] * 5)
+	return tuple([ numpy.concatenate(c) for c in columns ])
+
+# Load the readings from a binary day file. Returns None if it isn't a valid day file
+#
+def LoadDayFile(fname, index):
+	f = open(fname, 'rb')
+	data = f.read()
+	f.close()
+	names = DayFile.ParseHeader(data)
+	if names == None:
+		return None
+	dtype = numpy.dtype([('time', '<u4'), ('sensor', '<u2'), ('cur', '<i2'), ('min', '<i2'), ('max', '<i2')])
+	n = (len(data) - DayFile.HEADER_SIZE) // DayFile.RECORD.size
+	recs = numpy.frombuffer(data, dtype=dtype, count=n, offset=DayFile.HEADER_SIZE)
+
+	# Map the sensor numbers in the file to the configured sensor numbers (-1 if not configured)
+	remap = numpy.array([ index.get(name, -1) for name in names ] + [ -1 ], dtype=numpy.int32)
+	sensor = remap[numpy.minimum(recs['sensor'], len(names))]
+	keep = sensor >= 0
+
+	values = []
+	for col in [ 'cur', 'min', 'max' ]:
+		v = recs[col][keep].astype(numpy.int32)
+		v[v == DayFile.NOVALUE] = NOVALUE
+		values.append(v)
+	return (recs['time'][keep].astype(numpy.int32), sensor[keep], values[0], values[1], values[2])
+
+# Compute the statistics for one window.
+#	bucket			the bucket number of each reading (e.g. hour number)
+#	base, n			the window holds the buckets base, base-1, ... base-n+1
+#	epoch, order	the time of each reading and the order in which it was read
+#	sensor			sensor number of each reading
+#	cur, mn, mx		the values
+#	usemm			True to use the min/max values from the sensor (Config.opt_UseMinMax)
+# Returns a list of (i, sensor, epoch, cur, min, max, count, total, m2, hist) for each bucket (window
+# element i) and sensor that has readings. m2 is the sum of the squared differences of the current values
+# from their mean and hist is a dictionary: current value --> number of readings. Missing values are None.
+#
+def SummariseWindow(bucket, base, n, nsensors, epoch, order, sensor, cur, mn, mx, usemm):
+	i = base - bucket
+	ok = (i >= 0) & (i < n)
+	if not ok.any():
+		return []
+	(i, epoch, order, sensor, cur, mn, mx) = [ x[ok] for x in (i, epoch, order, sensor, cur, mn, mx) ]
+
+	# Sort by group, then by time; for equal times, the first reading comes last in the group
+	group = i * nsensors + sensor
+	srt = numpy.lexsort((-order, epoch, group))
+	(group, epoch, cur, mn, mx) = [ x[srt] for x in (group, epoch, cur, mn, mx) ]
+	starts = numpy.flatnonzero(numpy.concatenate(([True], group[1:] != group[:-1])))
+	lasts = numpy.concatenate((starts[1:], [len(group)])) - 1
+
+	if usemm:
+		lo = mn
+		hi = mx
+	else:
+		# As in Sensor.Update(), a current value only counts for the min/max if no reading of the group
+		# that was read before it has the same or a later time. Those readings come after it in the sort
+		key = (group << 32) + order[srt]
+		after = numpy.concatenate((numpy.minimum.accumulate(key[::-1])[::-1][1:], [ numpy.iinfo(numpy.int64).max ]))
+		lo = numpy.where(key < after, cur, NOVALUE)
+		hi = lo
+	mins = numpy.minimum.reduceat(numpy.where(lo == NOVALUE, BIG, lo).astype(numpy.int64), starts)
+	maxs = numpy.maximum.reduceat(hi.astype(numpy.int64), starts)
+	valid = cur != NOVALUE
+	counts = numpy.add.reduceat(valid.astype(numpy.int64), starts)
+	vcur = numpy.where(valid, cur, 0).astype(numpy.int64)
+	totals = numpy.add.reduceat(vcur, starts)
+	squares = numpy.add.reduceat(vcur * vcur, starts)
+
+	# Count the readings of each value in each group
+	(pairs, npairs) = numpy.unique((group[valid] << 32) + (cur[valid].astype(numpy.int64) - NOVALUE), return_counts=True)
+	hgroups = pairs >> 32
+	hvalues = ((pairs & 0xffffffff) + NOVALUE).tolist()
+	npairs = npairs.tolist()
+	hstarts = numpy.flatnonzero(numpy.concatenate(([True], hgroups[1:] != hgroups[:-1]))).tolist() + [ len(pairs) ]
+	hists = {}
+	for k in range(0, len(hstarts) - 1):
+		(a, b) = (hstarts[k], hstarts[k+1])
+		hists[int(hgroups[a])] = dict(zip(hvalues[a:b], npairs[a:b]))
+
+	result = []
+	for k in range(0, len(starts)):
+		g = int(group[starts[k]])
+		c = int(cur[lasts[k]])
+		lo = int(mins[k])
+		hi = int(maxs[k])
+		n = int(counts[k])
+		total = int(totals[k])
+		if n == 0:
+			m2 = 0.0
+		else:
+			m2 = (n * int(squares[k]) - total * total) / n
+		result.append((g // nsensors, g % nsensors, int(epoch[lasts[k]]),
+						None if c == NOVALUE else c,
+						None if lo == BIG else lo,
+						None if hi == NOVALUE else hi,
+						n, total, m2, hists.get(g, {})))
+	return result
+
+# Compute the statistics for all the windows from the readings of several days.
+#	days		list of (day number, month number, (secs, sensor, cur, min, max))
+#	windows		list of (base, n) for the hourly, daily and monthly windows
+# Returns a list of results (see SummariseWindow()) for each window
+#
+def Summarise(days, windows, nsensors, usemm):
+	days = [ day for day in days if len(day[2][0]) > 0 ]
+	if len(days) == 0:
+		return [ [], [], [] ]
+	epoch = numpy.concatenate([ day[2][0].astype(numpy.int64) + day[0] * 86400 for day in days ])
+	mkey = numpy.concatenate([ numpy.full(len(day[2][0]), day[1], dtype=numpy.int64) for day in days ])
+	(sensor, cur, mn, mx) = [ numpy.concatenate([ day[2][c] for day in days ]) for c in [1, 2, 3, 4] ]
+	order = numpy.arange(len(epoch))
+
+	buckets = [ epoch // 3600, epoch // 86400, mkey ]
+	results = []
+	for w in range(0, 3):
+		(base, n) = windows[w]
+		results.append(SummariseWindow(buckets[w], base, n, nsensors, epoch, order, sensor, cur, mn, mx, usemm))
+	return results
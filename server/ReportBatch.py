@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Render the reports of many stations at once.
+#
+# Each station's report is rendered into the report cache (see ReportCache.py) by a pool of worker
+# processes, one station per task, so the total time is divided by the number of CPU cores.
+# A report whose cached copy is still up to date isn't rendered again. Run it from cron (e.g. every
+# hour, or after an upload) so that the report CGI finds the reports in the cache.
+#
+# With --output DIR, the reports are published as static files instead: DIR/station.txt, station.html
+# and station.json, which the web server can send without running any Python. The logs are read once
+# for all three. Each file is written to a temporary file in DIR and renamed, so a viewer never sees a
+# partly written report.
+#
+# Each worker reads the logs of its station itself: opt_Workers (parallel reading of one station's
+# logs) is ignored, since the stations already keep all the cores busy.
+#
+# Usage:
+#	./ReportBatch.py [--workers N] [--dir LOGDIR] [--output DIR] [station ...]
+#		the default is all the stations in Config.passwords
+
+import os
+import sys
+import io
+import time
+import argparse
+import traceback
+import contextlib
+import concurrent.futures
+from py.Config import Config
+from Analyse import Analyser
+import ReportCache
+import Diagnostics
+import LogDir
+
+# The static reports: file name extension and the Analyser method that prints the report
+#
+FORMATS = [ ('txt', 'PrintStats'), ('html', 'HtmlStats'), ('json', 'JsonStats') ]
+
+# Initialise a worker process
+#
+def InitWorker():
+	Config.opt_Workers = 1
+	return
+
+# Render the report of a station into the cache, or publish the static reports in outdir,
+# if they are out of date. Returns (station, True if it was rendered, time taken, output of the worker)
+#
+def RenderStation(user, now, outdir=None):
+	t = time.perf_counter()
+	a = Analyser(user, now)
+	try:
+		if outdir == None:
+			done = CacheStation(a)
+		else:
+			done = PublishStation(a, outdir)
+		output = ''
+	except Exception:
+		done = False
+		output = traceback.format_exc()
+	return (user, done, time.perf_counter() - t, output)
+
+# Render the text report of a station into the cache. Returns False if it was up to date
+#
+def CacheStation(a):
+	def Render():
+		a.ReadLogs()
+		a.PrintStats()
+		return
+	(etag, body, diag) = ReportCache.Refresh(a, 'text', Render)
+	return not diag.get('cached', False)
+
+# Publish the static reports of a station in outdir. Returns False if they were up to date.
+# The text report starts with any errors found in the logs, like the report from TextStats.py
+#
+def PublishStation(a, outdir):
+	etag = ReportCache.Fingerprint(a, 'static')[0]
+	names = [ os.path.join(outdir, a.user + '.' + ext) for (ext, method) in FORMATS ]
+	cached = LogDir.LoadCache(a.user + '.static')
+	if type(cached) == dict and cached.get('etag') == etag and all([ os.path.exists(n) for n in names ]):
+		return False
+
+	bodies = []
+	def Render():
+		a.ReadLogs()
+		for (ext, method) in FORMATS:
+			buf = io.StringIO()
+			with contextlib.redirect_stdout(buf):
+				getattr(a, method)()
+			bodies.append(buf.getvalue())
+		return
+	buf = io.StringIO()
+	with contextlib.redirect_stdout(buf):
+		Diagnostics.Run(a, 'static', Render)
+	bodies[0] = buf.getvalue() + bodies[0]
+
+	for (name, body) in zip(names, bodies):
+		Publish(name, body)
+	LogDir.SaveCache(a.user + '.static', { 'etag': etag })
+	return True
+
+# Write a file atomically: write a temporary file in the same directory and rename it
+#
+def Publish(fname, text):
+	tmpname = fname + '.tmp%d' % os.getpid()
+	try:
+		f = open(tmpname, 'w')
+		f.write(text)
+		f.close()
+		os.replace(tmpname, fname)
+	except:
+		if os.path.exists(tmpname):
+			os.unlink(tmpname)
+		raise
+	return
+
+# Render the reports of a list of stations using a pool of <workers> processes.
+# With outdir, the static reports are published there instead of rendering into the cache.
+# Returns the number of stations whose reports were rendered
+#
+def RenderAll(users, workers, outdir=None, now=None):
+	if now == None:
+		now = time.time()
+	args = (users, [ now ] * len(users), [ outdir ] * len(users))
+	if workers <= 1:
+		InitWorker()
+		return Report(map(RenderStation, *args))
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=InitWorker) as pool:
+		return Report(pool.map(RenderStation, *args))
+
+# Print the results of RenderStation() as they arrive. Returns the number of reports rendered
+#
+def Report(results):
+	rendered = 0
+	for (user, done, t, output) in results:
+		if output != '':
+			print('%s: failed' % user)
+			print(output.rstrip())
+		elif done:
+			print('%s: rendered in %.3fs' % (user, t))
+			rendered += 1
+		else:
+			print('%s: up to date' % user)
+	return rendered
+
+def Main():
+	parser = argparse.ArgumentParser(description='Render the reports of pico-logger stations into the cache or as static files')
+	parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+	parser.add_argument('--dir', default=None, help='log directory')
+	parser.add_argument('--output', default=None, help='directory for the static reports')
+	parser.add_argument('stations', nargs='*')
+	args = parser.parse_args()
+
+	users = args.stations
+	if len(users) == 0:
+		users = sorted(Config.passwords)
+	for user in users:
+		if user not in Config.passwords:
+			print('Unknown station "%s"' % user)
+			exit(1)
+	outdir = None
+	if args.output != None:
+		outdir = os.path.abspath(args.output)
+		os.makedirs(outdir, exist_ok=True)
+	if args.dir != None:
+		os.chdir(args.dir)
+
+	t = time.perf_counter()
+	rendered = RenderAll(users, args.workers, outdir)
+	print('%d of %d reports rendered in %.3fs with %d workers' % (rendered, len(users), time.perf_counter() - t,
+																	args.workers))
+	return
+
+if __name__ == '__main__':
+	Main()
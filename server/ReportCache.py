@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Cache for rendered reports, with conditional GET.
+#
+# A report only changes when a log file in the windows changes or when the current hour changes
+# (the windows move on). The fingerprint of a report is made from the name, size and modification
+# time of each log file in the windows, the current hour, and the modification time of the
+# configuration. The rendered report is saved in cache/user.kind together with its fingerprint
+# (the ETag), and is sent again as long as the fingerprint is unchanged.
+#
+# A client that sends If-None-Match with the current ETag gets 304 Not Modified and no body.
+#
+# If the client accepts gzip (Accept-Encoding), the report is sent compressed. The compressed report is
+# a different entity, so its ETag has the suffix -gz. The response is sent with a Content-Length and
+# a single write.
+#
+# The diagnostics of the last rendering are kept beside the report (see Diagnostics.py).
+#
+# The station is selected by the parameter station=NAME in the query string (default opt_ReportUser).
+# ReportBatch.py renders the reports of all the stations into the cache ahead of the requests.
+
+import os
+import sys
+import io
+import contextlib
+import gzip
+import hashlib
+import email.utils
+import urllib.parse
+import LogDir
+import Diagnostics
+from py import Config as ConfigModule
+
+GZIP_LEVEL = 6			# Compression level for the reports; higher levels gain little on a few KiB of text
+
+# Compute the fingerprint of a report for an Analyser, before reading the logs.
+# Returns (etag, last modified time)
+#
+def Fingerprint(a, kind):
+	h = hashlib.sha1()
+	h.update(('%s %s %d' % (a.user, kind, a.hour0)).encode())
+	mtime = a.hour0 * 3600
+	for fname in [ ConfigModule.__file__ ] + a.FindLogs():
+		st = LogDir.StatLog(fname)
+		if st == None:
+			continue
+		h.update((' %s %d %d' % (fname, st.st_size, st.st_mtime_ns)).encode())
+		if st.st_mtime > mtime:
+			mtime = st.st_mtime
+	return ('"' + h.hexdigest()[0:20] + '"', mtime)
+
+# Check whether an If-None-Match header matches an ETag
+#
+def ETagMatches(header, etag):
+	if header == None:
+		return False
+	for tag in header.split(','):
+		tag = tag.strip()
+		if tag.startswith('W/'):
+			tag = tag[2:]
+		if tag == etag or tag == '*':
+			return True
+	return False
+
+# Check whether the client accepts gzip content encoding
+#
+def AcceptsGzip(header):
+	if header == None:
+		return False
+	for coding in header.split(','):
+		(name, sep, params) = coding.partition(';')
+		if name.strip().lower() not in [ 'gzip', 'x-gzip' ]:
+			continue
+		for param in params.split(';'):
+			(key, eq, value) = param.partition('=')
+			if key.strip().lower() == 'q':
+				try:
+					return float(value) > 0
+				except ValueError:
+					return False
+		return True
+	return False
+
+# Get the station (user) whose report is requested. Returns None if the station is unknown
+#
+def Station():
+	params = urllib.parse.parse_qs(os.environ.get('QUERY_STRING', ''))
+	user = params.get('station', [ getattr(ConfigModule.Config, 'opt_ReportUser', 'dh') ])[0]
+	if user not in ConfigModule.Config.passwords:
+		return None
+	return user
+
+# Send a 404 response for an unknown station
+#
+def NotFound():
+	sys.stdout.write('Status: 404 Not Found\nContent-type: text/plain\n\nUnknown station\n')
+	return
+
+# Get a report from the cache, rendering it if the cached copy is out of date.
+#	a		the Analyser (the logs haven't been read yet)
+#	kind	name of the report, e.g. 'text'; used to name the cache file
+#	render	function that reads the logs and prints the report
+#	etag	the fingerprint of the report, if it has already been computed
+# Returns (etag, body, diagnostics)
+#
+def Refresh(a, kind, render, etag=None):
+	if etag == None:
+		etag = Fingerprint(a, kind)[0]
+	cname = a.user + '.' + kind
+	cached = LogDir.LoadCache(cname)
+	if type(cached) == dict and cached.get('etag') == etag:
+		return (etag, cached['body'], { 'cached': True })
+
+	buf = io.StringIO()
+	with contextlib.redirect_stdout(buf):
+		diag = Diagnostics.Run(a, kind, render)
+	body = buf.getvalue()
+	LogDir.SaveCache(cname, { 'etag': etag, 'body': body })
+	return (etag, body, diag)
+
+# Serve a report as a CGI response.
+#	a		the Analyser (the logs haven't been read yet)
+#	kind	name of the report, e.g. 'text'; used to name the cache file
+#	ctype	the content type
+#	render	function that reads the logs and prints the report
+# The report is rendered only if the cached copy is out of date.
+#
+def Serve(a, kind, ctype, render):
+	(etag, mtime) = Fingerprint(a, kind)
+	compress = AcceptsGzip(os.environ.get('HTTP_ACCEPT_ENCODING'))
+	if compress:
+		tag = etag[:-1] + '-gz"'
+	else:
+		tag = etag
+	headers = 'ETag: ' + tag + '\n'
+	headers += 'Last-Modified: ' + email.utils.formatdate(mtime, usegmt=True) + '\n'
+	headers += 'Cache-Control: no-cache\n'
+	headers += 'Vary: Accept-Encoding\n'
+
+	if ETagMatches(os.environ.get('HTTP_IF_NONE_MATCH'), tag):
+		sys.stdout.write('Status: 304 Not Modified\n' + headers + '\n')
+		return
+
+	(etag, body, diag) = Refresh(a, kind, render, etag)
+	if Diagnostics.WantFooter():
+		body += Diagnostics.Footer(diag, ctype)
+
+	data = body.encode()
+	if compress:
+		data = gzip.compress(data, GZIP_LEVEL, mtime=0)
+		headers += 'Content-Encoding: gzip\n'
+	headers += 'Content-Length: %d\n' % len(data)
+	sys.stdout.flush()
+	sys.stdout.buffer.write(('Content-type: ' + ctype + '\n' + headers + '\n').encode() + data)
+	sys.stdout.buffer.flush()
+	return
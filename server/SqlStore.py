@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# SQLite storage for the readings (opt_Database).
+#
+# Each sensor value in a record becomes a row of the readings table:
+#	user		TEXT
+#	sensor		TEXT
+#	timestamp	INTEGER		seconds since 1970-01-01 (UTC)
+#	cur, min, max	INTEGER	values in tenths; NULL if not present
+#
+# The table is indexed on (user, sensor, timestamp), so the statistics for any time range can be
+# computed by the database without reading the rest of the data (see RangeStats()).
+# The database runs in WAL mode, so reports can read while a record is being written, and all the
+# records of a request (or a batch) are inserted in one transaction.
+#
+# Usage:
+#	./SqlStore.py user-YYYYMMDD.log ...		imports text logs into the database. The readings that are
+#											already in the database for the same user, day and sensors are
+#											replaced, so a log can be imported again safely.
+
+import os
+import sys
+import io
+import contextlib
+import sqlite3
+import calendar
+import Aggregate
+import LogDir
+import Helpers
+from py.Config import Config
+
+SCHEMA = [
+	'CREATE TABLE IF NOT EXISTS readings (user TEXT NOT NULL, sensor TEXT NOT NULL,'
+		' timestamp INTEGER NOT NULL, cur INTEGER, min INTEGER, max INTEGER)',
+	'CREATE INDEX IF NOT EXISTS readings_ust ON readings (user, sensor, timestamp)'
+]
+
+db = None		# Connection, kept open by long-running processes
+
+# Get the name of the database file
+#
+def DatabaseName():
+	return getattr(Config, 'opt_Database', None)
+
+# Open the database, creating the table and index if necessary
+#
+def Open():
+	global db
+	if db == None:
+		db = sqlite3.connect(DatabaseName(), timeout=10, isolation_level=None)
+		db.execute('PRAGMA journal_mode=WAL')
+		db.execute('PRAGMA synchronous=NORMAL')
+		for sql in SCHEMA:
+			db.execute(sql)
+	return db
+
+# Make the rows for the sensor values in a (checked) parameter set
+#
+def Rows(user, params):
+	rows = []
+	t = Aggregate.Keys(params['date'], params['time'])[0]
+	for key in params:
+		if key in ['date', 'time', 'from', 'user', 'pass']:	# These aren't sensor fields
+			continue
+		vals = params[key].split(',')
+		vals += [ None ] * (3 - len(vals))
+		rows.append((user, key, t, Aggregate.StrToInt(vals[0]), Aggregate.StrToInt(vals[1]),
+					Aggregate.StrToInt(vals[2])))
+	return rows
+
+# Insert the readings from a list of (checked) parameter sets in a single transaction
+#
+def InsertParams(user, plist):
+	rows = []
+	for params in plist:
+		rows += Rows(user, params)
+	d = Open()
+	d.execute('BEGIN')
+	try:
+		d.executemany('INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?)', rows)
+		d.execute('COMMIT')
+	except:
+		d.execute('ROLLBACK')
+		raise
+	return len(rows)
+
+# Import a text log file (user-YYYYMMDD.log). The readings that are already in the database for the
+# user and day are deleted first (for the sensors in the log and in the configuration).
+# Lines that the analyser rejects (a parameter without a value, or a failed SanityCheck()) are skipped.
+# Returns the number of readings imported
+#
+def ImportLog(logname):
+	base = os.path.basename(logname)
+	user = base[:-13]
+	ymd = base[-12:-4]
+	t0 = calendar.timegm((int(ymd[0:4]), int(ymd[4:6]), int(ymd[6:8]), 0, 0, 0))
+
+	rows = []
+	f = io.TextIOWrapper(LogDir.OpenLog(logname))
+	with contextlib.redirect_stdout(io.StringIO()):		# The errors aren't wanted here
+		for line in f:
+			params = {}
+			for pair in line.strip().split('&'):
+				k_v = pair.split('=', 1)
+				if len(k_v) != 2:
+					params = None
+					break
+				params[k_v[0]] = k_v[1]
+			if params != None and Helpers.SanityCheck(params, False):
+				rows += Rows(user, params)
+	f.close()
+	sensors = set(Config.sensornames)
+	for row in rows:
+		sensors.add(row[1])
+
+	d = Open()
+	d.execute('BEGIN')
+	try:
+		for sensor in sensors:
+			d.execute('DELETE FROM readings WHERE user = ? AND sensor = ? AND timestamp >= ? AND timestamp < ?',
+						(user, sensor, t0, t0 + 86400))
+		d.executemany('INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?)', rows)
+		d.execute('COMMIT')
+	except:
+		d.execute('ROLLBACK')
+		raise
+	return len(rows)
+
+# Compute the statistics of a sensor for each period of <step> seconds (e.g. 3600 for hours) that has
+# readings in the time range lo <= timestamp < hi. The period number is timestamp // step.
+# Without usemm, a current value only counts for the min/max if the reading is newer than all the
+# readings of the period that were inserted before it, as in Sensor.Update()
+# Returns a list of (period, time of most recent reading, min, max, count, total, sum of squares)
+#
+def RangeStats(user, sensor, step, lo, hi, usemm):
+	if usemm:
+		mm = 'min(min), max(max)'
+	else:
+		mm = 'min(CASE WHEN newest THEN cur END), max(CASE WHEN newest THEN cur END)'
+	sql = 'SELECT period, max(timestamp), ' + mm + ', count(cur), ifnull(sum(cur), 0), ifnull(sum(cur * cur), 0)' \
+			' FROM (SELECT timestamp / ? AS period, timestamp, cur, min, max,' \
+			' timestamp > ifnull(max(timestamp) OVER (PARTITION BY timestamp / ? ORDER BY rowid' \
+			' ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), -1) AS newest' \
+			' FROM readings WHERE user = ? AND sensor = ? AND timestamp >= ? AND timestamp < ?)' \
+			' GROUP BY period'
+	return Open().execute(sql, (step, step, user, sensor, lo, hi)).fetchall()
+
+# Count the readings of each current value of a sensor for each period of <step> seconds in the time
+# range lo <= timestamp < hi (see RangeStats()).
+# Returns a dictionary: period --> { value: number of readings }
+#
+def RangeHistograms(user, sensor, step, lo, hi):
+	sql = 'SELECT timestamp / ? AS period, cur, count(*) FROM readings' \
+			' WHERE user = ? AND sensor = ? AND timestamp >= ? AND timestamp < ? AND cur IS NOT NULL' \
+			' GROUP BY period, cur'
+	hists = {}
+	for (period, cur, n) in Open().execute(sql, (step, user, sensor, lo, hi)):
+		hists.setdefault(period, {})[cur] = n
+	return hists
+
+# Get the current value of a sensor at time t. If there are several readings with the same time,
+# the first one that was inserted is used (as in the analyser)
+#
+def ValueAt(user, sensor, t):
+	sql = 'SELECT cur FROM readings WHERE user = ? AND sensor = ? AND timestamp = ? ORDER BY rowid LIMIT 1'
+	row = Open().execute(sql, (user, sensor, t)).fetchone()
+	if row == None:
+		return None
+	return row[0]
+
+if __name__ == '__main__':
+	for logname in sys.argv[1:]:
+		print('%s: %d readings' % (logname, ImportLog(logname)))
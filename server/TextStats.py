@@ -21,12 +21,18 @@
 # file with the user and date in the name
 
 from Analyse import Analyser
+import ReportCache
 
+def Render():
+	a.ReadLogs()
+	a.PrintStats()
+	return
 
-print('Content-type: text/plain')
-print('')
-a = Analyser()
-a.ReadLogs()
-a.PrintStats()
+user = ReportCache.Station()
+if user == None:
+	ReportCache.NotFound()
+else:
+	a = Analyser(user)
+	ReportCache.Serve(a, 'text', 'text/plain', Render)
 
 exit(0)
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Time series of a sensor's current values, downsampled for charts.
+#
+# The readings are streamed in time order from the database (opt_Database) if there is one, otherwise
+# from the day files or text logs, a day (with opt_Engine = 'numpy', a month) at a time, and passed to a downsampler. The downsamplers only
+# hold a few buckets of readings, so the memory used doesn't depend on the length of the time range.
+#
+# Downsamplers:
+#	MinMax	- divides the range into buckets of equal time and keeps the min and max readings of each bucket,
+#			  so that peaks are never lost
+#	LTTB	- "largest triangle three buckets" (Steinarsson, 2013): keeps the one reading of each bucket that
+#			  forms the largest triangle with the reading kept from the previous bucket and the mean of the
+#			  next bucket; gives a good visual likeness with fewer points. The buckets are of equal time
+#			  rather than equal numbers of readings, so that the readings can be streamed.
+
+import os
+import io
+import time
+import calendar
+import LogDir
+import DayFile
+import SqlStore
+import NumpyEngine
+from py.Config import Config
+
+# ===
+# Min/max bucket downsampling
+#
+class MinMax():
+	def __init__(self, first, last, npoints):
+		self.first = first
+		self.width = max((last - first) / max(npoints // 2, 1), 1)
+		self.points = []
+		self.bucket = None
+		self.lo = None
+		self.hi = None
+		return
+
+	# Add a list of readings (time, value). The readings must be added in time order
+	#
+	def Add(self, points):
+		first = self.first
+		width = self.width
+		for p in points:
+			b = int((p[0] - first) // width)
+			if b != self.bucket:
+				self.Flush()
+				self.bucket = b
+				self.lo = p
+				self.hi = p
+			elif p[1] < self.lo[1]:
+				self.lo = p
+			elif p[1] > self.hi[1]:
+				self.hi = p
+		return
+
+	# Add readings from NumPy arrays of times and values. Only the min and max of each bucket
+	# are passed to Add()
+	#
+	def AddArrays(self, t, v):
+		import numpy
+		if len(t) == 0:
+			return
+		b = ((t - self.first) // self.width).astype(numpy.int64)
+		starts = numpy.flatnonzero(numpy.concatenate(([True], b[1:] != b[:-1])))
+		imin = numpy.lexsort((v, b))[starts]
+		imax = numpy.lexsort((-v.astype(numpy.int64), b))[starts]
+		idx = numpy.union1d(imin, imax)
+		self.Add(list(zip(t[idx].tolist(), v[idx].tolist())))
+		return
+
+	# Output the min and max of the current bucket, in time order
+	#
+	def Flush(self):
+		if self.lo == None:
+			return
+		if self.lo == self.hi:
+			self.points.append(self.lo)
+		elif self.lo[0] < self.hi[0]:
+			self.points += [ self.lo, self.hi ]
+		else:
+			self.points += [ self.hi, self.lo ]
+		self.lo = None
+		self.hi = None
+		return
+
+	# Get the downsampled series
+	#
+	def Finish(self):
+		self.Flush()
+		return self.points
+
+# ===
+# Largest-triangle-three-buckets downsampling
+#
+class LTTB():
+	def __init__(self, first, last, npoints):
+		self.first = first
+		self.width = max((last - first) / max(npoints - 2, 1), 1)
+		self.points = []
+		self.pending = []		# Up to two buckets of readings: [ bucket number, [ (time, value), ... ] ]
+		self.last = None
+		return
+
+	# Add a list of readings (time, value). The readings must be added in time order
+	#
+	def Add(self, points):
+		if len(points) == 0:
+			return
+		self.last = points[-1]
+		if len(self.points) == 0:
+			self.points.append(points[0])		# The first reading is always kept
+			points = points[1:]
+		first = self.first
+		width = self.width
+		pending = self.pending
+		if len(pending) > 0:
+			(bucket, plist) = pending[-1]
+		else:
+			bucket = None
+		for p in points:
+			b = int((p[0] - first) // width)
+			if b == bucket:
+				plist.append(p)
+				continue
+			bucket = b
+			plist = [ p ]
+			pending.append([ b, plist ])
+			if len(pending) > 2:
+				self.Select(pending[0][1], Mean(pending[1][1]))
+				pending.pop(0)
+		return
+
+	# Add readings from NumPy arrays of times and values
+	#
+	def AddArrays(self, t, v):
+		self.Add(list(zip(t.tolist(), v.tolist())))
+		return
+
+	# Keep the reading of a bucket that forms the largest triangle with the previously kept reading and c
+	#
+	def Select(self, bucket, c):
+		(at, av) = self.points[-1]
+		(ct, cv) = c
+		best = None
+		barea = -1
+		for p in bucket:
+			area = abs((at - ct) * (p[1] - av) - (at - p[0]) * (cv - av))
+			if area > barea:
+				barea = area
+				best = p
+		self.points.append(best)
+		return
+
+	# Get the downsampled series. The last reading is always kept
+	#
+	def Finish(self):
+		if len(self.pending) == 0:
+			return self.points
+		self.pending[-1][1].pop()		# The last reading
+		if len(self.pending) == 2:
+			if len(self.pending[1][1]) > 0:
+				self.Select(self.pending[0][1], Mean(self.pending[1][1]))
+				self.pending.pop(0)
+			else:
+				self.pending.pop()
+		if len(self.pending[0][1]) > 0:
+			self.Select(self.pending[0][1], self.last)
+		self.points.append(self.last)
+		self.pending = []
+		return self.points
+
+# Mean time and value of a list of readings
+#
+def Mean(points):
+	st = 0
+	sv = 0
+	for (t, v) in points:
+		st += t
+		sv += v
+	return (st / len(points), sv / len(points))
+
+# Convert a date (YYYYMMDD) or date and time (YYYYMMDDhhmm or YYYYMMDDhhmmss) to seconds since 1970.
+# Returns None if the string isn't valid
+#
+def ParseTime(s):
+	if not s.isdigit() or len(s) not in [ 8, 12, 14 ]:
+		return None
+	s = s.ljust(14, '0')
+	try:
+		return calendar.timegm((int(s[0:4]), int(s[4:6]), int(s[6:8]), int(s[8:10]), int(s[10:12]), int(s[12:14])))
+	except ValueError:
+		return None
+
+# Generator for the readings (time, current value) of a sensor in the time range first <= time < last,
+# in time order. The readings are yielded in lists of up to a day. Readings without a current value are skipped
+#
+def Readings(user, sensor, first, last):
+	if getattr(Config, 'opt_Database', None) != None:
+		sql = 'SELECT timestamp, cur FROM readings WHERE user = ? AND sensor = ? AND timestamp >= ? AND timestamp < ?' \
+				' AND cur IS NOT NULL ORDER BY timestamp'
+		cursor = SqlStore.Open().execute(sql, (user, sensor, first, last))
+		while True:
+			rows = cursor.fetchmany(1000)
+			if len(rows) == 0:
+				return
+			yield rows
+
+	d0 = '%04d%02d%02d' % time.gmtime(first)[0:3]
+	d1 = '%04d%02d%02d' % time.gmtime(last - 1)[0:3]
+	for fname in LogDir.LogsInRange(user, d0, d1):
+		d = fname[-12:-4]
+		t0 = calendar.timegm((int(d[0:4]), int(d[4:6]), int(d[6:8]), 0, 0, 0))
+		day = DayReadings(fname, sensor, first - t0, last - t0)
+		day.sort()
+		yield [ (t0 + secs, cur) for (secs, cur) in day if t0 + secs >= first and t0 + secs < last ]
+	return
+
+# Get the readings (seconds since midnight, current value) of a sensor from one day's log,
+# using the day file if it is up to date. first and last (seconds since midnight) limit the blocks
+# that are decompressed if the day has been archived
+#
+def DayReadings(fname, sensor, first=None, last=None):
+	dfname = DayFile.DayFileName(fname)
+	try:
+		if os.stat(dfname).st_mtime >= os.stat(fname).st_mtime:
+			content = DayFile.Columns(dfname)
+			if content != None:			# Otherwise empty or incomplete: read the text log
+				(names, cols) = content
+				if sensor not in names:
+					return []
+				idx = names.index(sensor)
+				return [ (t, cur) for (t, s, cur) in zip(cols['time'], cols['sensor'], cols['cur'])
+							if s == idx and cur != DayFile.NOVALUE ]
+	except OSError:
+		pass
+
+	result = []
+	key = '&' + sensor + '='
+	f = io.TextIOWrapper(LogDir.OpenLog(fname, first, last))
+	for line in f:
+		i = line.find(key)
+		if i < 0:
+			continue
+		t = line[line.find('&time=') + 6:][0:6]
+		value = line[i + len(key):].partition('&')[0].partition(',')[0].rstrip()
+		try:
+			result.append((int(t[0:2]) * 3600 + int(t[2:4]) * 60 + int(t[4:6]), int(value)))
+		except ValueError:
+			pass		# Damaged line or no current value
+	f.close()
+	return result
+
+# The same as Readings() for the logs, using NumpyEngine. Yields (times, values) as NumPy arrays,
+# for up to <days> days at a time
+#
+def NumpyReadings(user, sensor, first, last, days=32):
+	import numpy
+	d0 = '%04d%02d%02d' % time.gmtime(first)[0:3]
+	d1 = '%04d%02d%02d' % time.gmtime(last - 1)[0:3]
+	tlist = []
+	vlist = []
+	for fname in LogDir.LogsInRange(user, d0, d1):
+		d = fname[-12:-4]
+		t0 = calendar.timegm((int(d[0:4]), int(d[4:6]), int(d[6:8]), 0, 0, 0))
+		arrays = None
+		dfname = DayFile.DayFileName(fname)
+		try:
+			if os.stat(dfname).st_mtime >= os.stat(fname).st_mtime:
+				arrays = NumpyEngine.LoadDayFile(dfname, { sensor: 0 })
+		except OSError:
+			pass
+		if arrays != None:
+			(secs, sensors, cur, mn, mx) = arrays
+		else:
+			day = DayReadings(fname, sensor, first - t0, last - t0)		# Splitting the text is faster in Python for one sensor
+			secs = numpy.array([ p[0] for p in day ], dtype=numpy.int64)
+			cur = numpy.array([ p[1] for p in day ], dtype=numpy.int64)
+		t = secs.astype(numpy.int64) + t0
+		ok = (cur != NumpyEngine.NOVALUE) & (t >= first) & (t < last)
+		t = t[ok]
+		cur = cur[ok]
+		srt = numpy.argsort(t, kind='stable')
+		tlist.append(t[srt])
+		vlist.append(cur[srt])
+		if len(tlist) >= days:
+			yield (numpy.concatenate(tlist), numpy.concatenate(vlist))
+			tlist = []
+			vlist = []
+	if len(tlist) > 0:
+		yield (numpy.concatenate(tlist), numpy.concatenate(vlist))
+	return
+
+# Get the downsampled series for a list of sensors.
+#	method		'minmax' or 'lttb'
+# Returns a dictionary: sensor --> list of (time, value)
+#
+def Series(user, sensors, first, last, npoints, method):
+	result = {}
+	for sensor in sensors:
+		if method == 'lttb':
+			ds = LTTB(first, last, npoints)
+		else:
+			ds = MinMax(first, last, npoints)
+		if getattr(Config, 'opt_Engine', 'python') == 'numpy' and NumpyEngine.Available() \
+				and getattr(Config, 'opt_Database', None) == None:
+			for (t, v) in NumpyReadings(user, sensor, first, last):
+				ds.AddArrays(t, v)
+		else:
+			for points in Readings(user, sensor, first, last):
+				ds.Add(points)
+		result[sensor] = ds.Finish()
+	return result
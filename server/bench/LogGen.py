@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Synthetic log generator.
+#
+# Writes a tree of day logs (user-YYYYMMDD.log) as the stations would have sent them: one record per
+# station every <interval> seconds, with date, time, from=pico and a cur,min,max triple for each sensor.
+# The temperatures follow a yearly and a daily cycle with some noise; the min and max are those of the
+# interval. About one record in a hundred is missing, as if the station had been offline.
+# The files are placed according to opt_LogLayout (see LogDir.py).
+#
+# The output depends only on the parameters and the seed, so the same tree can be made again to
+# compare versions of the server.
+#
+# Usage:
+#	python3 -m bench.LogGen [--stations N] [--sensors N] [--interval S] [--years Y] [--end YYYYMMDD] [--seed N] dir
+
+import os
+import sys
+import math
+import time
+import random
+import calendar
+import argparse
+import LogDir
+
+# Get the names of the sensors: T00, T01, ...
+#
+def SensorNames(nsensors):
+	return [ 'T%02d' % i for i in range(0, nsensors) ]
+
+# Get the names of the stations (users): st000, st001, ...
+#
+def StationNames(nstations):
+	return [ 'st%03d' % i for i in range(0, nstations) ]
+
+# ===
+# The temperature model of one sensor, in tenths of a degree
+#
+class SensorModel():
+	def __init__(self, rnd, indoor):
+		self.rnd = rnd
+		if indoor:
+			(self.mean, self.year, self.day, self.noise) = (200, 20, 10, 3)
+		else:
+			(self.mean, self.year, self.day, self.noise) = (100, 80, 50, 8)
+		self.phase = rnd.uniform(-0.2, 0.2)
+		self.drift = 0.0
+		return
+
+	# The values (cur, min, max) for the interval that ends at time t (seconds since 1970)
+	#
+	def Values(self, t, interval):
+		self.drift = 0.95 * self.drift + self.rnd.gauss(0, self.noise)
+		y = 2 * math.pi * ((t / 86400 - 196) / 365.25 + self.phase)		# Warmest in mid-July
+		d = 2 * math.pi * ((t % 86400) / 86400 - 0.625)					# Warmest at 15:00 UTC
+		cur = int(self.mean + self.year * math.cos(y) + self.day * math.cos(d) + self.drift)
+		spread = 1 + int(self.noise * math.sqrt(interval / 300))
+		return (cur, cur - self.rnd.randint(0, spread), cur + self.rnd.randint(0, spread))
+
+# Write the logs of one station for the days first..last (days since 1970), stopping at time <end>
+# (seconds since 1970) if given. Returns (list of file names, number of lines)
+#
+def WriteStation(user, sensors, interval, first, last, rnd, end=None):
+	models = []
+	for i in range(0, len(sensors)):
+		models.append(SensorModel(rnd, i % 2 == 1))
+	flist = []
+	nlines = 0
+	for day in range(first, last + 1):
+		t0 = day * 86400
+		gmt = time.gmtime(t0)
+		d = '%04d%02d%02d' % (gmt.tm_year, gmt.tm_mon, gmt.tm_mday)
+		lines = []
+		for secs in range(0, 86400, interval):
+			t = t0 + secs
+			if end != None and t > end:
+				break
+			vals = [ m.Values(t, interval) for m in models ]
+			if rnd.random() < 0.01:
+				continue			# Offline
+			line = 'date=%s&time=%02d%02d%02d&from=pico' % (d, secs // 3600, (secs // 60) % 60, secs % 60)
+			for (name, v) in zip(sensors, vals):
+				line += '&%s=%d,%d,%d' % (name, v[0], v[1], v[2])
+			lines.append(line + '\n')
+		fname = LogDir.LogFileName(user, d)
+		LogDir.MakeDir(fname)
+		f = open(fname, 'w')
+		f.write(''.join(lines))
+		f.close()
+		flist.append(fname)
+		nlines += len(lines)
+	return (flist, nlines)
+
+# Write the logs for several stations in the current directory, for <years> years of history up to
+# the end of the day <end> (YYYYMMDD). Returns the number of lines
+#
+def Generate(nstations, nsensors, interval, years, end, seed=1):
+	last = calendar.timegm((int(end[0:4]), int(end[4:6]), int(end[6:8]), 0, 0, 0)) // 86400
+	first = last - int(years * 365.25) + 1
+	nlines = 0
+	for user in StationNames(nstations):
+		rnd = random.Random('%d %s' % (seed, user))
+		nlines += WriteStation(user, SensorNames(nsensors), interval, first, last, rnd)[1]
+	return nlines
+
+def Main():
+	gmt = time.gmtime()
+	parser = argparse.ArgumentParser(description='Write synthetic pico-logger logs')
+	parser.add_argument('--stations', type=int, default=1)
+	parser.add_argument('--sensors', type=int, default=2)
+	parser.add_argument('--interval', type=int, default=300, help='seconds between records')
+	parser.add_argument('--years', type=float, default=1)
+	parser.add_argument('--end', default='%04d%02d%02d' % gmt[0:3], help='last day (YYYYMMDD)')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('dir')
+	args = parser.parse_args()
+
+	os.makedirs(args.dir, exist_ok=True)
+	os.chdir(args.dir)
+	t = time.perf_counter()
+	nlines = Generate(args.stations, args.sensors, args.interval, args.years, args.end, args.seed)
+	print('%d lines in %.1f s' % (nlines, time.perf_counter() - t))
+	return
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,407 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark suite for the ingest and analysis paths.
+#
+# A tree of synthetic logs is written (see LogGen.py) and each stage is run in a separate process in
+# that directory, so that the peak RSS of a stage isn't inflated by the stages before it. The report
+# windows are computed for the end of the last generated day, so the results don't depend on the date.
+#
+# Stages:
+#	sanity		Helpers.SanityCheck() on the last 20000 records of the logs		calls/s
+#	ingest		Helpers.LogQuery(), in process									requests/s
+#	wlog		wlog.py as a CGI script (a new Python process per request)		requests/s
+#	analyseline	Analyser.AnalyseLine() on the lines in the report windows		lines/s
+#	readlogs	Analyser.ReadLogs() for each station							lines/s, wall time per report
+#	printstats	Analyser.PrintStats()											reports/s
+#	report		ReadLogs() and PrintStats() for one station						wall time, peak RSS
+#
+# The configuration (py/Config.py) is used, except that the sensors, passwords and report user are set
+# for the synthetic stations and the secondary stores, checkpoints, aggregates and the ingest journal are turned off.
+# Other options can be set with --option, e.g. --option "opt_Engine='numpy'", or
+# --option "opt_LogLayout='month'" to write and read the logs in the sharded layout.
+#
+# The results are saved as JSON, together with the parameters, options and version. Two result files
+# can be compared to find regressions.
+#
+# Usage:
+#	python3 -m bench.Suite [--stations N] [--sensors N] [--interval S] [--years Y] [--end YYYYMMDD]
+#							[--dir DIR] [--option NAME=VALUE ...] [--stages a,b,...] [--output FILE]
+#	python3 -m bench.Suite --compare OLD.json NEW.json
+
+import os
+import sys
+import io
+import ast
+import json
+import time
+import runpy
+import platform
+import resource
+import calendar
+import tempfile
+import argparse
+import contextlib
+import subprocess
+from bench import LogGen
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = [ 'sanity', 'ingest', 'wlog', 'analyseline', 'readlogs', 'printstats', 'report' ]
+REPEAT = 3
+
+# The options that are always set for the benchmark
+#
+FIXED_OPTIONS = {
+	'opt_DayFiles':		False,
+	'opt_Aggregates':	False,
+	'opt_Database':		None,
+	'opt_Checkpoint':	False,
+	'opt_Journal':		None,
+	'opt_LogLayout':	'flat'
+}
+
+# Set up the configuration for the synthetic stations and the options
+#
+def Configure(params):
+	from py.Config import Config
+	stations = LogGen.StationNames(params['stations'])
+	Config.sensornames = dict([ (name, name) for name in LogGen.SensorNames(params['sensors']) ])
+	Config.passwords = dict([ (user, 'bench') for user in stations + [ 'ingest' ] ])
+	Config.opt_ReportUser = stations[0]
+	for (name, value) in list(FIXED_OPTIONS.items()) + list(params['options'].items()):
+		setattr(Config, name, value)
+	return Config
+
+# The time of the report: the end of the last generated day
+#
+def ReportTime(params):
+	e = params['end']
+	return calendar.timegm((int(e[0:4]), int(e[4:6]), int(e[6:8]), 23, 59, 59))
+
+# Time a function: the best of <repeat> runs, in seconds
+#
+def Best(fn, repeat=REPEAT):
+	best = None
+	for i in range(0, repeat):
+		t = time.perf_counter()
+		fn()
+		t = time.perf_counter() - t
+		if best == None or t < best:
+			best = t
+	return best
+
+# Read the lines of a station's logs that are in the report windows
+#
+def WindowLines(user, now):
+	from Analyse import Analyser
+	lines = []
+	for fname in Analyser(user, now).FindLogs():
+		f = open(fname, 'r')
+		lines += [ line.strip() for line in f ]
+		f.close()
+	return lines
+
+# ===
+# The stages. Each one returns a dictionary of results
+#
+def StageSanity(params):
+	from Helpers import SanityCheck, SplitQuery
+	lines = WindowLines(LogGen.StationNames(1)[0], ReportTime(params))[-20000:]
+	plist = [ SplitQuery(line) for line in lines ]
+	def Run():
+		for p in plist:
+			SanityCheck(p, False)
+	t = Best(Run)
+	return { 'calls': len(plist), 'rate': len(plist) / t, 'unit': 'calls/s' }
+
+def StageIngest(params):
+	from Helpers import LogQuery
+	import LogDir
+	n = 2000
+	gmt = time.gmtime(ReportTime(params))
+	d = '%04d%02d%02d' % gmt[0:3]
+	qlist = []
+	for i in range(0, n):
+		q = 'date=%s&time=%02d%02d%02d&from=pico&user=ingest&pass=bench' % (d, (i // 3600) % 24, (i // 60) % 60, i % 60)
+		for name in LogGen.SensorNames(params['sensors']):
+			q += '&%s=%d,%d,%d' % (name, i % 300, i % 300 - 5, i % 300 + 5)
+		qlist.append(q)
+	def Run():
+		with contextlib.redirect_stdout(io.StringIO()):
+			for q in qlist:
+				LogQuery(q)
+		os.unlink(LogDir.LogFileName('ingest', d))
+	t = Best(Run)
+	return { 'requests': n, 'rate': n / t, 'unit': 'requests/s' }
+
+def StageWlog(params):
+	import LogDir
+	n = 20
+	gmt = time.gmtime(ReportTime(params))
+	d = '%04d%02d%02d' % gmt[0:3]
+	q = 'date=%s&time=120000&from=pico&user=ingest&pass=bench' % d
+	for name in LogGen.SensorNames(params['sensors']):
+		q += '&%s=123,100,150' % name
+	env = dict(os.environ, QUERY_STRING=q)
+	cmd = [ sys.executable, '-m', 'bench.Suite', '--cgi', os.path.join(SERVER_DIR, 'wlog.py'),
+			'--params', json.dumps(params) ]
+	t = time.perf_counter()
+	for i in range(0, n):
+		out = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True).stdout
+		if not out.rstrip().endswith(b'OK'):
+			raise Exception('wlog.py failed: ' + out.decode())
+	t = time.perf_counter() - t
+	os.unlink(LogDir.LogFileName('ingest', d))
+	return { 'requests': n, 'rate': n / t, 'unit': 'requests/s', 'wall': t / n,
+				'peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss }
+
+def StageAnalyseLine(params):
+	from Analyse import Analyser
+	now = ReportTime(params)
+	user = LogGen.StationNames(1)[0]
+	lines = WindowLines(user, now)
+	def Run():
+		a = Analyser(user, now)
+		for line in lines:
+			a.AnalyseLine(line)
+	t = Best(Run)
+	return { 'lines': len(lines), 'rate': len(lines) / t, 'unit': 'lines/s' }
+
+def StageReadLogs(params):
+	from Analyse import Analyser
+	now = ReportTime(params)
+	stations = LogGen.StationNames(params['stations'])
+	nlines = 0
+	for user in stations:
+		nlines += len(WindowLines(user, now))
+	def Run():
+		for user in stations:
+			Analyser(user, now).ReadLogs()
+	t = Best(Run)
+	return { 'lines': nlines, 'rate': nlines / t, 'unit': 'lines/s', 'wall': t / len(stations) }
+
+def StagePrintStats(params):
+	from Analyse import Analyser
+	n = 20
+	a = Analyser(LogGen.StationNames(1)[0], ReportTime(params))
+	a.ReadLogs()
+	def Run():
+		with contextlib.redirect_stdout(io.StringIO()):
+			for i in range(0, n):
+				a.PrintStats()
+	t = Best(Run)
+	return { 'reports': n, 'rate': n / t, 'unit': 'reports/s', 'wall': t / n }
+
+def StageReport(params):
+	from Analyse import Analyser
+	t = time.perf_counter()
+	a = Analyser(LogGen.StationNames(1)[0], ReportTime(params))
+	a.ReadLogs()
+	with contextlib.redirect_stdout(io.StringIO()):
+		a.PrintStats()
+	return { 'wall': time.perf_counter() - t }
+
+STAGE_FUNCTIONS = {
+	'sanity':		StageSanity,
+	'ingest':		StageIngest,
+	'wlog':			StageWlog,
+	'analyseline':	StageAnalyseLine,
+	'readlogs':		StageReadLogs,
+	'printstats':	StagePrintStats,
+	'report':		StageReport
+}
+
+# Run one stage in this process and print the results as JSON
+#
+def RunStage(name, params):
+	Configure(params)
+	result = STAGE_FUNCTIONS[name](params)
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	result['peak_rss_kb'] = max(rss, result.get('peak_rss_kb', 0))
+	print(json.dumps(result))
+	return
+
+# Run a CGI script with the benchmark configuration
+#
+def RunCgi(script, params):
+	Configure(params)
+	sys.argv = [ script ]
+	runpy.run_path(script, run_name='__main__')
+	return
+
+# Run a stage in a new process in the log directory. Returns the results
+#
+def SpawnStage(name, params, logdir):
+	env = dict(os.environ)
+	env['PYTHONPATH'] = SERVER_DIR + os.pathsep + env.get('PYTHONPATH', '')
+	cmd = [ sys.executable, '-m', 'bench.Suite', '--stage', name, '--params', json.dumps(params) ]
+	out = subprocess.run(cmd, cwd=logdir, env=env, stdout=subprocess.PIPE, check=True).stdout
+	return json.loads(out.decode().strip().splitlines()[-1])
+
+# Write the logs, unless the directory already holds logs made with the same parameters.
+# Returns the generator's results
+#
+def MakeTree(params, logdir):
+	import LogDir
+	Configure(params)
+	gparams = dict([ (k, params[k]) for k in [ 'stations', 'sensors', 'interval', 'years', 'end', 'seed' ] ])
+	gparams['layout'] = LogDir.Layout()
+	pname = os.path.join(logdir, 'bench-tree.json')
+	try:
+		f = open(pname, 'r')
+		saved = json.load(f)
+		f.close()
+		if saved['params'] == gparams:
+			return saved['generate']
+	except (OSError, ValueError, KeyError):
+		pass
+
+	olddir = os.getcwd()
+	os.chdir(logdir)
+	t = time.perf_counter()
+	nlines = LogGen.Generate(params['stations'], params['sensors'], params['interval'], params['years'],
+								params['end'], params['seed'])
+	t = time.perf_counter() - t
+	os.chdir(olddir)
+	result = { 'lines': nlines, 'wall': t, 'rate': nlines / t, 'unit': 'lines/s' }
+	f = open(pname, 'w')
+	json.dump({ 'params': gparams, 'generate': result }, f)
+	f.close()
+	return result
+
+# Get the version of the server code, if it's in a git working tree
+#
+def Version():
+	try:
+		out = subprocess.run([ 'git', 'describe', '--always', '--dirty' ], cwd=SERVER_DIR,
+								stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+		return out.decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+# Run the suite and save the results
+#
+def RunSuite(params, stages, logdir, output):
+	results = {
+		'suite':		1,
+		'time':			time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+		'version':		Version(),
+		'python':		platform.python_version(),
+		'platform':		platform.platform(),
+		'cpus':			os.cpu_count(),
+		'params':		params,
+		'stages':		{}
+	}
+	results['generate'] = MakeTree(params, logdir)
+	print('%-12s %12d lines' % ('generate', results['generate']['lines']))
+	for name in stages:
+		r = SpawnStage(name, params, logdir)
+		results['stages'][name] = r
+		line = '%-12s' % name
+		if 'rate' in r:
+			line += ' %12.1f %-10s' % (r['rate'], r['unit'])
+		else:
+			line += ' %23s' % ''
+		if 'wall' in r:
+			line += ' %10.2f ms' % (r['wall'] * 1000)
+		else:
+			line += ' %13s' % ''
+		line += ' %8d KiB peak' % r['peak_rss_kb']
+		print(line)
+
+	f = open(output, 'w')
+	json.dump(results, f, indent=1)
+	f.close()
+	print('Results saved in ' + output)
+	return results
+
+# Compare two result files. Prints the ratio new/old of each rate (higher is better) and each
+# wall time and peak RSS (lower is better), marking the changes of more than 10% for the worse
+#
+def Compare(oldname, newname):
+	res = []
+	for fname in [ oldname, newname ]:
+		f = open(fname, 'r')
+		res.append(json.load(f))
+		f.close()
+	(old, new) = res
+	if old['params'] != new['params']:
+		print('Warning: the parameters are different')
+	print('%-12s %-12s %14s %14s %8s' % ('Stage', 'Measure', old.get('version'), new.get('version'), 'Ratio'))
+	for name in STAGES:
+		try:
+			(o, n) = (old['stages'][name], new['stages'][name])
+		except KeyError:
+			continue
+		for (key, higher) in [ ('rate', True), ('wall', False), ('peak_rss_kb', False) ]:
+			if key not in o or key not in n or o[key] == 0:
+				continue
+			ratio = n[key] / o[key]
+			worse = (ratio < 0.9) if higher else (ratio > 1.1)
+			print('%-12s %-12s %14.4g %14.4g %8.2f%s' % (name, key, o[key], n[key], ratio, '  <-- worse' if worse else ''))
+	return
+
+def Main():
+	gmt = time.gmtime()
+	parser = argparse.ArgumentParser(description='pico-logger benchmark suite')
+	parser.add_argument('--stations', type=int, default=1)
+	parser.add_argument('--sensors', type=int, default=2)
+	parser.add_argument('--interval', type=int, default=300, help='seconds between records')
+	parser.add_argument('--years', type=float, default=1)
+	parser.add_argument('--end', default='%04d%02d%02d' % gmt[0:3], help='last day of the logs (YYYYMMDD)')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--dir', help='directory for the logs (kept for the next run); default temporary')
+	parser.add_argument('--option', action='append', default=[], help='configuration option NAME=VALUE')
+	parser.add_argument('--stages', default=','.join(STAGES))
+	parser.add_argument('--output', default='bench-%04d%02d%02d-%02d%02d%02d.json' % gmt[0:6])
+	parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+	parser.add_argument('--stage', help=argparse.SUPPRESS)
+	parser.add_argument('--cgi', help=argparse.SUPPRESS)
+	parser.add_argument('--params', help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.compare != None:
+		return Compare(args.compare[0], args.compare[1])
+	if args.stage != None:
+		return RunStage(args.stage, json.loads(args.params))
+	if args.cgi != None:
+		return RunCgi(args.cgi, json.loads(args.params))
+
+	options = {}
+	for opt in args.option:
+		(name, eq, value) = opt.partition('=')
+		options[name] = ast.literal_eval(value)
+	params = { 'stations': args.stations, 'sensors': args.sensors, 'interval': args.interval,
+				'years': args.years, 'end': args.end, 'seed': args.seed, 'options': options }
+	stages = [ s for s in args.stages.split(',') if s != '' ]
+	for s in stages:
+		if s not in STAGE_FUNCTIONS:
+			parser.error('unknown stage ' + s)
+	output = os.path.abspath(args.output)
+
+	if args.dir != None:
+		os.makedirs(args.dir, exist_ok=True)
+		RunSuite(params, stages, os.path.abspath(args.dir), output)
+	else:
+		with tempfile.TemporaryDirectory() as tmpdir:
+			RunSuite(params, stages, tmpdir, output)
+	return
+
+if __name__ == '__main__':
+	Main()
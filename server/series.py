@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of pico-logger.
+#
+# pico-logger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pico-logger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pico-logger.  If not, see <http://www.gnu.org/licenses/>.
+
+# JSON time series for charts.
+#
+# Parameters (query string):
+#	station		the station; default opt_ReportUser
+#	sensor		one or more sensors, separated by commas
+#	from, to	the time range: YYYYMMDD, YYYYMMDDhhmm or YYYYMMDDhhmmss (UTC); 'to' is exclusive
+#	points		the number of points wanted for each sensor (default 500, max 10000)
+#	method		minmax (default) or lttb
+#
+# Response:
+#	{ "station": ..., "from": ..., "to": ..., "method": ..., "series": { "T00": [ [time, value], ... ], ... } }
+#	time in seconds since 1970-01-01, value in the sensor's units (i.e. tenths / 10)
+
+import os
+import sys
+import json
+import traceback
+import urllib.parse
+from Helpers import *
+import TimeSeries
+
+# Send a JSON response
+#
+def Reply(obj, status=None):
+	if status != None:
+		print('Status: ' + status)
+	print('Content-type: application/json')
+	print('')
+	print(json.dumps(obj, separators=(',', ':')))
+	return
+
+# Handle the request. Returns an error message or None.
+# Nothing may be printed before the reply, so the query is checked without Error()
+#
+def Query():
+	q = os.environ.get('QUERY_STRING', '')
+	try:
+		params = dict(urllib.parse.parse_qsl(q, keep_blank_values=True, strict_parsing=(q != '')))
+	except ValueError:
+		return 'invalid query string'
+
+	user = params.get('station', GetOption('opt_ReportUser', 'dh'))
+	if user not in Config.passwords:
+		return 'unknown station'
+	sensors = params.get('sensor', '').split(',')
+	for s in sensors:
+		if s not in Config.sensornames:
+			return 'unknown sensor "' + s + '"'
+	first = TimeSeries.ParseTime(params.get('from', ''))
+	last = TimeSeries.ParseTime(params.get('to', ''))
+	if first == None or last == None or last <= first:
+		return 'invalid time range'
+	try:
+		npoints = int(params.get('points', '500'))
+	except ValueError:
+		return 'invalid number of points'
+	if npoints < 3 or npoints > 10000:
+		return 'invalid number of points'
+	method = params.get('method', 'minmax')
+	if method not in [ 'minmax', 'lttb' ]:
+		return 'invalid method'
+
+	series = TimeSeries.Series(user, sensors, first, last, npoints, method)
+	for s in series:
+		series[s] = [ [ t, v / 10 ] for (t, v) in series[s] ]
+	Reply({ 'station': user, 'from': first, 'to': last, 'method': method, 'series': series })
+	return None
+
+try:
+	err = Query()
+	if err != None:
+		Reply({ 'error': err }, '400 Bad Request')
+except:
+	Reply({ 'error': 'exception', 'traceback': traceback.format_exc() }, '500 Internal Server Error')
+
+exit(0)